@@ -1,30 +1,82 @@
+import time
+IMPORT_STARTED = time.perf_counter()  # Reported by --startup-profile
+
 import os
-import fcntl
-import termios
-import tty
 import struct
 import collections
+import concurrent.futures
 import asyncio
+import itertools
 import logging
+import queue
 import re
+import selectors
+import signal
+import socket
 import sys
-import time
-import argparse
+import bisect
 
-from copy import deepcopy
+# Modules only some modes use (argparse, fcntl, json, logging.handlers, mmap, termios, tty, zlib)
+# are imported where they are needed, so a modem started on a slow host answers its first AT sooner
 from enum import Enum
-from typing import AsyncGenerator, Callable, Optional, Tuple, Callable
+from typing import TYPE_CHECKING, AsyncGenerator, Awaitable, BinaryIO, Callable, Dict, Iterable, List, Optional, Pattern, Tuple, Union
 
-# Setup logging to output to stderr
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s %(levelname)s %(message)s',
-    stream=sys.stderr
-)
+if TYPE_CHECKING:
+    import argparse
+    import logging.handlers
 
 # Timeout constant
 DEFAULT_CONNECTION_TIMEOUT = 30  # Timeout in seconds
+DEFAULT_TELNET_PORT = 23
+STDIO_CHUNK_SIZE = 65536  # Maximum bytes read from stdin at a time
+REMOTE_READ_SIZE = 4096  # Maximum bytes read from the remote host at a time
+CLIENT_HIGH_WATER = 65536  # Pause the remote host once this many bytes are buffered for a TCP or stdio client
+CLIENT_LOW_WATER = 16384  # Resume the remote host once the client buffer drains below this size
+SERIAL_READ_SIZE = 4096  # Maximum bytes read from the serial port at a time
+SERIAL_WRITE_SIZE = 16384  # Queued chunks are coalesced into writes of up to this size
+SERIAL_HIGH_WATER = 65536  # Pause the remote host once this many bytes are queued for the serial port
+SERIAL_LOW_WATER = 16384  # Resume the remote host once the queue drains below this size
+SERIAL_RECONNECT_DELAY = 2.0  # Seconds between attempts to reopen a serial port that failed or went away
+WORKER_RESTART_DELAY = 1.0  # Seconds before restarting a worker process that exited unexpectedly
+SESSION_DRAIN_TIMEOUT = 30.0  # Seconds open TCP sessions get to finish after SIGTERM
+SESSION_HANGUP_TIMEOUT = 5.0  # Seconds sessions still open after the drain get to close once hung up
+KEEPALIVE_IDLE = 60  # Seconds a TCP connection is idle before keepalive probes are sent
+KEEPALIVE_INTERVAL = 10  # Seconds between keepalive probes
+KEEPALIVE_COUNT = 6  # Unanswered keepalive probes before the connection is dropped
 ESCAPE_GUARD_TIME = 1.0  # Seconds to wait before switching back to command mode after '+++'
+PACING_SLICE = 0.02  # Seconds of line time released per batch when pacing output to a line rate
+BITS_PER_BYTE = 10  # Start bit, 8 data bits and stop bit
+MAX_COMMAND_LENGTH = 256  # Longer command lines are discarded as line noise
+LOG_FORMAT = '%(asctime)s %(levelname)s %(message)s'
+LOG_RATE_LIMIT = 10  # Messages logged per call site within LOG_RATE_WINDOW, the rest are counted and dropped
+LOG_RATE_WINDOW = 10.0  # Seconds
+
+DNS_CACHE_TTL = 300.0  # Seconds a successful host name lookup is reused
+DNS_NEGATIVE_TTL = 10.0  # Seconds a failed host name lookup is reused
+DNS_CACHE_SIZE = 1024  # Host names kept by the resolver cache, least recently used are dropped first
+HAPPY_EYEBALLS_DELAY = 0.25  # Seconds before racing the next address while a connection attempt is pending (RFC 8305)
+PREWARM_POOL_SIZE = 1  # Standby connections kept open per favorite phonebook entry
+PREWARM_REFRESH_INTERVAL = 15.0  # Seconds between health checks of the standby connections
+PREWARM_MAX_AGE = 60.0  # Standby connections are replaced after this many seconds, before servers drop idle logins
+
+# S-registers with a non-zero power-on value
+S_ESCAPE_CHAR = 2  # Escape character, disabled when above 127
+S_CARRIER_WAIT = 7  # Seconds to wait for a connection when dialing
+S_GUARD_TIME = 12  # Escape guard time in fiftieths of a second
+S_INACTIVITY = 30  # Hang up after this many tens of seconds without data in either direction, 0 to disable
+INACTIVITY_UNIT = 10  # Seconds per unit of S30
+S_REGISTER_DEFAULTS = {
+    S_ESCAPE_CHAR: ord('+'),
+    S_CARRIER_WAIT: DEFAULT_CONNECTION_TIMEOUT,
+    S_GUARD_TIME: int(ESCAPE_GUARD_TIME * 50),
+}
+S_REGISTER_COUNT = 256  # S-registers 0-255, each holding a value of 0-255
+# Power-on values of every S-register. Immutable, so sessions share it until they set a register
+S_REGISTER_POWER_ON = bytes(S_REGISTER_DEFAULTS.get(register, 0) for register in range(S_REGISTER_COUNT))
+
+# Python heap allocated by an idle HayesATParser in COMMAND mode, excluding its client transport.
+# Checked by a test; sessions grow beyond it only while connected or dialing.
+SESSION_MEMORY_BUDGET = 1024
 
 class TelnetState(Enum):
     DATA = 'DATA'
@@ -38,64 +90,219 @@ class TelnetState(Enum):
     SB_BYTE = 250
     SE_BYTE = 240
 
+# Plain int copies of the telnet constants, avoiding Enum lookups in the translation loops
+IAC = 255
+DONT = 254
+DO = 253
+WONT = 252
+WILL = 251
+SB = 250
+SE = 240
+IAC_ESCAPED = bytes((IAC, IAC))
+
+# Telnet options answered by TelnetNegotiator
+TELOPT_BINARY = 0
+TELOPT_ECHO = 1
+TELOPT_SGA = 3
+TELOPT_TTYPE = 24
+TELOPT_NAWS = 31
+TTYPE_IS = 0
+TTYPE_SEND = 1
+MAX_SUBNEGOTIATION = 512  # Longer subnegotiation payloads are truncated
+TELNET_TERMINAL_TYPE = 'ANSI'  # Terminal type reported until AT*TT sets another
+TELNET_WINDOW_SIZE = (80, 24)  # Columns and rows sent with NAWS until AT*TW sets others
+
+class TelnetNegotiator:
+    """
+    Answers telnet option negotiation from a remote server, so servers that wait
+    for replies before sending their banner do not have to time out first.
+    Replies are queued and collected with take_replies(). Each option's state is
+    tracked, and only state changes are answered, which avoids negotiation loops.
+    """
+    # Options we agree to enable on our side when the server sends DO
+    DEFAULT_LOCAL_OPTIONS = frozenset((TELOPT_BINARY, TELOPT_SGA, TELOPT_TTYPE, TELOPT_NAWS))
+    # Options we agree to let the server enable when it sends WILL
+    DEFAULT_REMOTE_OPTIONS = frozenset((TELOPT_BINARY, TELOPT_ECHO, TELOPT_SGA))
+    # Offers sent when a connection opens, as (command, option) pairs
+    DEFAULT_OFFERS = ((DO, TELOPT_SGA), (DO, TELOPT_ECHO), (WILL, TELOPT_TTYPE), (WILL, TELOPT_NAWS))
+
+    def __init__(self, local_options: Optional[Iterable[int]] = None, remote_options: Optional[Iterable[int]] = None,
+                 terminal_type: str = TELNET_TERMINAL_TYPE, window_size: Tuple[int, int] = TELNET_WINDOW_SIZE):
+        self.local_options = frozenset(local_options) if local_options is not None else self.DEFAULT_LOCAL_OPTIONS
+        self.remote_options = frozenset(remote_options) if remote_options is not None else self.DEFAULT_REMOTE_OPTIONS
+        self.terminal_type = terminal_type
+        self.window_size = window_size
+        self.local_enabled: set = set()
+        self.remote_enabled: set = set()
+        self.pending: set = set()  # (command, option) offers awaiting an answer
+        self.replies = bytearray()
+
+    def take_replies(self) -> bytes:
+        """ :return: Queued replies for the server, clearing the queue. """
+        replies = bytes(self.replies)
+        self.replies.clear()
+        return replies
+
+    def offer(self, offers: Optional[Iterable[Tuple[int, int]]] = None) -> None:
+        """
+        Queue opening offers, enabling each option optimistically so the server's acknowledgement is not answered.
+
+        :param offers: (command, option) pairs, DEFAULT_OFFERS if omitted.
+        :return: None
+        """
+        for command, option in offers if offers is not None else self.DEFAULT_OFFERS:
+            enabled = self.local_enabled if command == WILL else self.remote_enabled
+            if option not in enabled:
+                enabled.add(option)
+                self.pending.add((command, option))
+                self.replies += bytes((IAC, command, option))
+
+    def command(self, command: int, option: int) -> None:
+        """
+        Handle a WILL, WONT, DO or DONT command received from the server.
+
+        :param command: The negotiation command byte.
+        :param option: The option byte.
+        :return: None
+        """
+        if command in (DO, DONT):
+            enabled, accepted, offer, accept, refuse = self.local_enabled, self.local_options, WILL, WILL, WONT
+        else:
+            enabled, accepted, offer, accept, refuse = self.remote_enabled, self.remote_options, DO, DO, DONT
+        answering_offer = (offer, option) in self.pending
+        self.pending.discard((offer, option))
+
+        if command in (DO, WILL):
+            if option in enabled:
+                if answering_offer and option == TELOPT_NAWS:
+                    self._send_window_size()
+                return
+            if option in accepted:
+                enabled.add(option)
+                self.replies += bytes((IAC, accept, option))
+                if option == TELOPT_NAWS:
+                    self._send_window_size()
+            else:
+                self.replies += bytes((IAC, refuse, option))
+        elif option in enabled:
+            enabled.discard(option)
+            if not answering_offer:
+                self.replies += bytes((IAC, refuse, option))
+
+    def subnegotiation(self, payload: bytes) -> None:
+        """
+        Handle a subnegotiation payload (the bytes between IAC SB and IAC SE).
+
+        :param payload: Option byte followed by its parameters, with IAC escaping removed.
+        :return: None
+        """
+        if payload[:2] == bytes((TELOPT_TTYPE, TTYPE_SEND)) and TELOPT_TTYPE in self.local_enabled:
+            self._send_subnegotiation(bytes((TELOPT_TTYPE, TTYPE_IS)) + self.terminal_type.encode('ascii'))
+
+    def _send_window_size(self) -> None:
+        width, height = self.window_size
+        self._send_subnegotiation(bytes((TELOPT_NAWS,)) + struct.pack('>HH', width, height))
+
+    def _send_subnegotiation(self, payload: bytes) -> None:
+        self.replies += bytes((IAC, SB)) + payload.replace(IAC_ESCAPED[:1], IAC_ESCAPED) + bytes((IAC, SE))
+
 class TelnetTranslator:
     """
     Telnet protocol translator for handling input and output data.
     This class is responsible for translating between raw byte data and
-    Telnet protocol commands.
+    Telnet protocol commands. Runs of plain data are located with bytes.find()
+    and copied in one slice, so only IAC sequences are handled byte by byte.
+    Negotiation commands and subnegotiation payloads are passed to the optional
+    TelnetNegotiator; without one they are discarded.
     """
-    def __init__(self):
+    __slots__ = ('state', 'subnegotiation', 'negotiator', 'command', 'sb_payload', 'iac_count')
+
+    def __init__(self, negotiator: Optional[TelnetNegotiator] = None):
         self.state: TelnetState = TelnetState.DATA
         self.subnegotiation: bool = False
+        self.negotiator = negotiator
+        self.command: int = 0  # Negotiation command awaiting its option byte
+        self.sb_payload = bytearray()
+        self.iac_count: int = 0  # IAC bytes decoded, collected and reset by the owner for its metrics
 
     def input_translation(self, bytes_chunk: bytes) -> bytes:
         """
         Decode Telnet protocol input from a chunk of bytes.
         """
-        WILL = 251
-        WONT = 252
-        DO = 253
-        DONT = 254
-
+        state = self.state
+        if state is TelnetState.DATA and IAC not in bytes_chunk:
+            return bytes(bytes_chunk)  # Fast path for the common chunk without telnet commands
+
+        iac_count = bytes_chunk.count(IAC)
+        self.iac_count += iac_count
+        if state is TelnetState.DATA and iac_count == 2 * bytes_chunk.count(IAC_ESCAPED):
+            # Binary data, such as a file transfer, where every IAC is an escaped 0xFF: undo them in one pass
+            return bytes(bytes_chunk).replace(IAC_ESCAPED, IAC_ESCAPED[:1])
+        view = memoryview(bytes_chunk)
         output = bytearray()
-        for byte in bytes_chunk:
-            if self.state == TelnetState.DATA:
-                if byte == TelnetState.IAC_BYTE.value:
-                    self.state = TelnetState.IAC
-                else:
-                    output.append(byte)  # Normal data byte
-
-            elif self.state == TelnetState.IAC:
-                if byte == TelnetState.IAC_BYTE.value:
-                    output.append(TelnetState.IAC_BYTE.value)  # Escaped 0xFF
-                    self.state = TelnetState.DATA
-                elif byte in (WILL, WONT, DO, DONT):
-                    self.state = TelnetState.IAC_OPTION
-                elif byte == TelnetState.SB_BYTE.value:
-                    self.state = TelnetState.SB
+        pos = 0
+        length = len(bytes_chunk)
+        while pos < length:
+            if state is TelnetState.DATA:
+                iac_index = bytes_chunk.find(IAC, pos)
+                if iac_index < 0:
+                    output += view[pos:]  # Rest of the chunk is normal data
+                    break
+                output += view[pos:iac_index]
+                pos = iac_index + 1
+                state = TelnetState.IAC
+
+            elif state is TelnetState.IAC:
+                byte = bytes_chunk[pos]
+                pos += 1
+                if byte == IAC:
+                    output.append(IAC)  # Escaped 0xFF
+                    state = TelnetState.DATA
+                elif WILL <= byte <= DONT:
+                    self.command = byte
+                    state = TelnetState.IAC_OPTION
+                elif byte == SB:
+                    state = TelnetState.SB
                     self.subnegotiation = True
+                    self.sb_payload.clear()
                 else:
                     # Simple command, no option
-                    self.state = TelnetState.DATA
-
-            elif self.state == TelnetState.IAC_OPTION:
-                # Skip option byte
-                self.state = TelnetState.DATA
-
-            elif self.state == TelnetState.SB:
-                if byte == TelnetState.IAC_BYTE.value:
-                    self.state = TelnetState.SB_IAC
-
-            elif self.state == TelnetState.SB_IAC:
-                if byte == TelnetState.IAC_BYTE.value:
-                    self.state = TelnetState.SB
-                elif byte == TelnetState.SE_BYTE.value:
+                    state = TelnetState.DATA
+
+            elif state is TelnetState.IAC_OPTION:
+                if self.negotiator is not None:
+                    self.negotiator.command(self.command, bytes_chunk[pos])
+                pos += 1
+                state = TelnetState.DATA
+
+            elif state is TelnetState.SB:
+                # Skip (or collect) the subnegotiation payload up to the next IAC
+                iac_index = bytes_chunk.find(IAC, pos)
+                end = iac_index if iac_index >= 0 else length
+                if self.negotiator is not None and len(self.sb_payload) < MAX_SUBNEGOTIATION:
+                    self.sb_payload += view[pos:min(end, pos + MAX_SUBNEGOTIATION - len(self.sb_payload))]
+                if iac_index < 0:
+                    break
+                pos = iac_index + 1
+                state = TelnetState.SB_IAC
+
+            elif state is TelnetState.SB_IAC:
+                byte = bytes_chunk[pos]
+                pos += 1
+                if byte == IAC:
+                    if self.negotiator is not None and len(self.sb_payload) < MAX_SUBNEGOTIATION:
+                        self.sb_payload.append(IAC)
+                    state = TelnetState.SB
+                elif byte == SE:
                     self.subnegotiation = False
-                    self.state = TelnetState.DATA
+                    state = TelnetState.DATA
+                    if self.negotiator is not None and self.sb_payload:
+                        self.negotiator.subnegotiation(bytes(self.sb_payload))
                 else:
                     # Unexpected — discard SB
-                    self.state = TelnetState.DATA
+                    state = TelnetState.DATA
 
+        self.state = state
         return bytes(output)
 
     def output_translation(self, bytes_chunk: bytes) -> bytes:
@@ -105,172 +312,1652 @@ class TelnetTranslator:
         :param bytes_chunk: The chunk of bytes to encode.
         :return: The Telnet encoded bytes.
         """
-        output = bytearray()
-        for byte in bytes_chunk:
-            if byte == TelnetState.IAC_BYTE.value:
-                # Escape IAC byte and append immediately
-                output.extend([TelnetState.IAC_BYTE.value, TelnetState.IAC_BYTE.value])
+        if IAC not in bytes_chunk:
+            return bytes(bytes_chunk)
+        # Escape every IAC byte by doubling it
+        return bytes(bytes_chunk).replace(IAC_ESCAPED[:1], IAC_ESCAPED)
+
+#### Logging ####
+
+# Logger for everything meowdem logs; sessions log through a SessionLogAdapter
+logger = logging.getLogger('meowdem')
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most LOG_RATE_LIMIT records per call site in each LOG_RATE_WINDOW,
+    so a message logged for every event cannot flood the log. The first record let
+    through after a window with dropped records reports how many were dropped.
+    """
+    def __init__(self, limit: int = LOG_RATE_LIMIT, window: float = LOG_RATE_WINDOW) -> None:
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.sites: Dict[Tuple[str, int], List] = {}  # [window start, records let through, records dropped] per call site
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        site = self.sites.get((record.pathname, record.lineno))
+        if site is None:
+            site = self.sites[(record.pathname, record.lineno)] = [record.created, 0, 0]
+        elif record.created - site[0] >= self.window:
+            site[0], site[1] = record.created, 0
+        if site[1] >= self.limit:
+            site[2] += 1
+            return False
+        site[1] += 1
+        if site[2]:
+            record.msg = f'{record.getMessage()} ({site[2]} similar messages suppressed)'
+            record.args = None
+            site[2] = 0
+        return True
+
+
+class SessionLogAdapter(logging.LoggerAdapter):
+    """
+    Adds the context of a modem session (session id, client and remote host) to its
+    log records, both as record attributes and as a prefix of the message.
+    """
+    def process(self, msg: str, kwargs: dict) -> Tuple[str, dict]:
+        kwargs['extra'] = {**self.extra, **kwargs.get('extra', {})}
+        context = ' '.join(f'{key}={value}' for key, value in self.extra.items() if value is not None)
+        return f'[{context}] {msg}', kwargs
+
+
+# Ids of the sessions opened by this process, used in their log context
+session_ids = itertools.count(1)
+
+
+def setup_logging(level: str = 'INFO', background: bool = True) -> Optional['logging.handlers.QueueListener']:
+    """ Send log records through a queue to a background thread writing them to stderr,
+    so the event loop never blocks on a slow stderr such as a file on an SD card.
+    Must be called again in forked processes, which do not inherit the writer thread.
+    :param level: Name of the lowest level logged.
+    :param background: Write from a background thread. Processes without an event loop that
+        are about to fork, like the worker supervisor, write directly instead.
+    :return: The started listener, stop() it to flush the queue before exiting. None without background.
+    """
+    stderr_handler = logging.StreamHandler(sys.stderr)
+    stderr_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    listener = None
+    if background:
+        from logging.handlers import QueueHandler, QueueListener
+        records: queue.SimpleQueue = queue.SimpleQueue()
+        listener = QueueListener(records, stderr_handler)
+        handler: logging.Handler = QueueHandler(records)
+    else:
+        handler = stderr_handler
+    handler.addFilter(RateLimitFilter())
+
+    root = logging.getLogger()
+    for old_handler in list(root.handlers):
+        root.removeHandler(old_handler)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+    if listener is not None:
+        listener.start()
+    return listener
+
+#### Phonebook ####
+
+class Phonebook:
+    """
+    Phonebook shared by every session in the process, optionally persisted to a journal file.
+    Edits are appended to the journal as single lines instead of rewriting the file, and the
+    journal is replayed into a dict on first use, so loading and dial lookups stay cheap with
+    thousands of entries. A journal holding mostly superseded lines is compacted on load.
+    Journal lines are tab separated: 'SET key host port', 'DEL key' or 'FAV key 0|1'.
+
+    Several processes may share one journal: appends and compaction hold an exclusive flock,
+    and every access applies lines appended by other processes since the last read (one
+    stat() call when nothing changed), reloading from scratch if the file was compacted.
+    """
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.entries: Dict[str, Tuple[str, Optional[int]]] = {}
+        self.favorite_keys: set = set()
+        self.sorted_keys: Optional[List[str]] = None  # Prefix index, rebuilt lazily after edits
+        self.inode: Optional[int] = None  # Identity of the journal file the index was read from
+        self.offset = 0  # Bytes of the journal applied so far
+        self.journal_lines = 0
+
+    def _refresh(self) -> None:
+        """ Apply journal lines appended since the last read. """
+        if self.path is None:
+            return
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if stat.st_ino != self.inode:
+            # First load, or the journal was compacted by another process
+            self.entries.clear()
+            self.favorite_keys.clear()
+            self.sorted_keys = None
+            self.inode = stat.st_ino
+            self.offset = 0
+            self.journal_lines = 0
+        if stat.st_size == self.offset:
+            return
+
+        with open(self.path, 'rb') as journal:
+            journal.seek(self.offset)
+            data = journal.read()
+        complete = data.rfind(b'\n') + 1  # Leave a partially written last line for the next read
+        lines = data[:complete].decode('utf-8').splitlines()
+        for line in lines:
+            self._apply(line.split('\t'))
+        self.offset += complete
+        self.journal_lines += len(lines)
+
+    def _apply(self, fields: List[str]) -> None:
+        """ Apply one journal record to the in-memory index. Malformed records are ignored. """
+        if fields[0] == 'SET' and len(fields) == 4:
+            try:
+                port = int(fields[3]) if fields[3] else None
+            except ValueError:
+                return
+            self.entries[fields[1]] = (fields[2], port)
+        elif fields[0] == 'DEL' and len(fields) == 2:
+            self.entries.pop(fields[1], None)
+            self.favorite_keys.discard(fields[1])
+        elif fields[0] == 'FAV' and len(fields) == 3:
+            if fields[2] == '1':
+                self.favorite_keys.add(fields[1])
             else:
-                # Append the single byte immediately
-                output.append(byte)
-        return bytes(output)
+                self.favorite_keys.discard(fields[1])
+        else:
+            return
+        self.sorted_keys = None
+
+    def _open_locked_journal(self) -> BinaryIO:
+        """ Open the journal for appending with an exclusive lock, retrying if another process replaced it meanwhile. """
+        import fcntl
+        while True:
+            journal = open(self.path, 'ab')
+            fcntl.flock(journal.fileno(), fcntl.LOCK_EX)
+            try:
+                if os.stat(self.path).st_ino == os.fstat(journal.fileno()).st_ino:
+                    return journal
+            except FileNotFoundError:
+                pass
+            journal.close()
+
+    def _record(self, *fields: str) -> None:
+        """ Append a record to the journal and apply it. """
+        if self.path is None:
+            self._apply(list(fields))
+            return
+        with self._open_locked_journal() as journal:
+            self._refresh()  # Apply edits from other processes first so records stay in journal order
+            journal.write(('\t'.join(fields) + '\n').encode('utf-8'))
+            journal.flush()
+            self._refresh()
+
+    def _compact(self) -> None:
+        """ Atomically rewrite the journal with one record per live entry. """
+        with self._open_locked_journal():
+            self._refresh()  # Include anything appended before the lock was taken
+            temp_path = f'{self.path}.{os.getpid()}.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as journal:
+                for key, (host, port) in self.entries.items():
+                    journal.write(f"SET\t{key}\t{host}\t{port if port is not None else ''}\n")
+                for key in self.favorite_keys:
+                    journal.write(f"FAV\t{key}\t1\n")
+            os.replace(temp_path, self.path)
+        self._refresh()
+
+    def _sync(self) -> None:
+        """ Bring the index up to date with the journal before an access. """
+        first_load = self.inode is None
+        self._refresh()
+        if first_load and self.journal_lines > 2 * (len(self.entries) + len(self.favorite_keys)) + 64:
+            self._compact()
+
+    def get(self, key: str) -> Optional[Tuple[str, Optional[int]]]:
+        """ :return: The (host, port) entry stored under key, or None. """
+        self._sync()
+        return self.entries.get(key)
+
+    def lookup(self, name: str) -> Optional[Tuple[str, Optional[int]]]:
+        """
+        Find an entry by its exact key, or by a prefix matching exactly one key.
+
+        :param name: Key or key prefix.
+        :return: The (host, port) entry, or None if there is no match or the prefix is ambiguous.
+        """
+        entry = self.get(name)
+        if entry is not None or not name:
+            return entry
+        if self.sorted_keys is None:
+            self.sorted_keys = sorted(self.entries)
+        index = bisect.bisect_left(self.sorted_keys, name)
+        matches = self.sorted_keys[index:index + 2]
+        if matches and matches[0].startswith(name) and (len(matches) == 1 or not matches[1].startswith(name)):
+            return self.entries[matches[0]]
+        return None
+
+    def items(self) -> List[Tuple[str, Tuple[str, Optional[int]]]]:
+        """ :return: All (key, (host, port)) entries. """
+        self._sync()
+        return list(self.entries.items())
+
+    def set(self, key: str, host: str, port: Optional[int]) -> None:
+        """ Add or replace an entry. A port of None means the default telnet port. """
+        self._record('SET', key, host, str(port) if port is not None else '')
+
+    def delete(self, key: str) -> bool:
+        """ Remove an entry. :return: True if the entry existed. """
+        if self.get(key) is None:
+            return False
+        self._record('DEL', key)
+        return True
+
+    def is_favorite(self, key: str) -> bool:
+        self._sync()
+        return key in self.favorite_keys
+
+    def set_favorite(self, key: str, favorite: bool) -> bool:
+        """ Mark or unmark an existing entry as a favorite. :return: False if there is no such entry. """
+        if self.get(key) is None:
+            return False
+        if favorite != (key in self.favorite_keys):
+            self._record('FAV', key, '1' if favorite else '0')
+        return True
+
+    def favorites(self) -> List[Tuple[str, Optional[int]]]:
+        """ :return: The (host, port) entries marked as favorites. """
+        self._sync()
+        return [self.entries[key] for key in self.favorite_keys if key in self.entries]
+
+    def __len__(self) -> int:
+        self._sync()
+        return len(self.entries)
+
+
+# Phonebook used by sessions that are not given their own; main() points it at the --phonebook file
+shared_phonebook = Phonebook()
+
+#### Dialer ####
+
+class ResolverCache:
+    """
+    Host name lookup cache shared by every parser in the process. getaddrinfo()
+    does not report record TTLs, so answers are kept for a fixed ttl and
+    failures for negative_ttl. Concurrent lookups of the same host share a
+    single getaddrinfo() call. At most max_entries hosts are kept, in least
+    recently used order, and expired entries are dropped as new ones arrive.
+    """
+    def __init__(self, ttl: float = DNS_CACHE_TTL, negative_ttl: float = DNS_NEGATIVE_TTL,
+                 max_entries: int = DNS_CACHE_SIZE):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.entries: collections.OrderedDict[str, Tuple[float, Union[List[str], OSError]]] = collections.OrderedDict()
+        self.lookups: Dict[str, asyncio.Future] = {}
+
+    @staticmethod
+    def _is_ip_address(host: str) -> bool:
+        for family in (socket.AF_INET, socket.AF_INET6):
+            try:
+                socket.inet_pton(family, host)
+                return True
+            except OSError:
+                pass
+        return False
+
+    async def resolve(self, host: str) -> List[str]:
+        """
+        Resolve a host name to its addresses, interleaved by address family as RFC 8305 recommends.
+
+        :param host: Host name or IP address literal.
+        :return: List of IP address strings in connection order.
+        """
+        if self._is_ip_address(host):
+            return [host]
+
+        loop = asyncio.get_running_loop()
+        entry = self.entries.get(host)
+        if entry is not None:
+            if entry[0] > loop.time():
+                self.entries.move_to_end(host)
+                if isinstance(entry[1], OSError):
+                    raise entry[1]
+                return entry[1]
+            del self.entries[host]
+
+        lookup = self.lookups.get(host)
+        if lookup is None:
+            lookup = loop.create_task(self._lookup(host))
+            # Retrieve the result even if every dial waiting on it was cancelled
+            lookup.add_done_callback(lambda task: task.cancelled() or task.exception())
+            self.lookups[host] = lookup
+        # Shield the shared lookup from a cancelled dial so other waiters still get the answer
+        return await asyncio.shield(lookup)
+
+    async def _lookup(self, host: str) -> List[str]:
+        loop = asyncio.get_running_loop()
+        try:
+            infos = await loop.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+        except OSError as e:
+            self._store(host, loop.time(), self.negative_ttl, e)
+            raise
+        finally:
+            del self.lookups[host]
+
+        by_family: Dict[int, List[str]] = {}
+        for family, _, _, _, sockaddr in infos:
+            addresses = by_family.setdefault(family, [])
+            if sockaddr[0] not in addresses:
+                addresses.append(sockaddr[0])
+        # Alternate between families, starting with the family getaddrinfo() preferred
+        ordered: List[str] = []
+        families = list(by_family.values())
+        for index in range(max(len(addresses) for addresses in families)):
+            ordered.extend(addresses[index] for addresses in families if index < len(addresses))
+        self._store(host, loop.time(), self.ttl, ordered)
+        return ordered
+
+    def _store(self, host: str, now: float, ttl: float, answer: Union[List[str], OSError]) -> None:
+        """ Cache an answer, dropping expired entries at the old end and anything over max_entries. """
+        entries = self.entries
+        entries[host] = (now + ttl, answer)
+        entries.move_to_end(host)
+        while entries:
+            oldest_host, (expires, _) = next(iter(entries.items()))
+            if expires > now and len(entries) <= self.max_entries:
+                break
+            del entries[oldest_host]
+
+
+resolver_cache = ResolverCache()
+
+
+async def open_happy_eyeballs_connection(addresses: List[str], port: int,
+                                         delay: float = HAPPY_EYEBALLS_DELAY) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    """
+    Connect to the first address that answers, starting a new attempt every delay seconds
+    or as soon as the previous one fails, and cancelling the rest once one succeeds.
+
+    :param addresses: IP addresses in the order they should be tried.
+    :param port: Port to connect to.
+    :param delay: Seconds to wait for a pending attempt before starting the next one.
+    :return: Tuple of StreamReader and StreamWriter for the winning connection.
+    """
+    remaining = iter(addresses)
+    next_address = next(remaining, None)
+    pending: set = set()
+    error: Optional[BaseException] = None
+    try:
+        while pending or next_address is not None:
+            if next_address is not None:
+                pending.add(asyncio.ensure_future(asyncio.open_connection(next_address, port)))
+                next_address = next(remaining, None)
+            done, pending = await asyncio.wait(
+                pending, timeout=delay if next_address is not None else None, return_when=asyncio.FIRST_COMPLETED
+            )
+            winner = None
+            for attempt in done:
+                if attempt.exception() is not None:
+                    error = attempt.exception()
+                elif winner is None:
+                    winner = attempt.result()
+                else:
+                    attempt.result()[1].close()  # Lost a simultaneous race
+            if winner is not None:
+                return winner
+    finally:
+        for attempt in pending:
+            attempt.cancel()
+    raise error if error is not None else OSError(f'No addresses to connect to on port {port}')
+
+
+async def dial(host: str, port: int, timeout: float) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    """
+    Resolve a host through the shared cache and connect to it within timeout seconds.
+
+    :param host: Host name or IP address.
+    :param port: Port to connect to.
+    :param timeout: Seconds to wait for the connection, including the lookup.
+    :return: Tuple of StreamReader and StreamWriter.
+    """
+    async def resolve_and_connect() -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        addresses = await resolver_cache.resolve(host)
+        return await open_happy_eyeballs_connection(addresses, port)
+    return await asyncio.wait_for(resolve_and_connect(), timeout=timeout)
+
+class ConnectionPrewarmer:
+    """
+    Keeps standby connections open to favorite phonebook entries so dialing them
+    connects at once. Each owner (a parser with prewarming enabled) registers the
+    addresses it wants kept warm; one background task maintains the pools for the
+    union of all owners and only runs while there is something to keep warm.
+    Data a server sends before its connection is taken stays buffered in the
+    StreamReader and is delivered once the session starts reading.
+    """
+    def __init__(self, pool_size: int = PREWARM_POOL_SIZE, refresh_interval: float = PREWARM_REFRESH_INTERVAL,
+                 max_age: float = PREWARM_MAX_AGE):
+        self.pool_size = pool_size
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        self.owners: Dict[object, set] = {}
+        self.pools: Dict[Tuple[str, int], List[Tuple[float, asyncio.StreamReader, asyncio.StreamWriter]]] = {}
+        self.task: Optional[asyncio.Task] = None
+        self.wakeup: Optional[asyncio.Event] = None  # Created with the maintenance task, on the running loop
+
+    def targets(self) -> set:
+        """ :return: Set of (host, port) addresses wanted by any owner. """
+        return set().union(*self.owners.values())
+
+    def set_targets(self, owner: object, targets: Iterable[Tuple[str, int]]) -> None:
+        """
+        Replace the addresses an owner wants kept warm. An empty list unregisters the owner.
+
+        :param owner: Object registering the addresses, usually a HayesATParser.
+        :param targets: (host, port) addresses to keep standby connections to.
+        :return: None
+        """
+        targets = set(targets)
+        if targets:
+            self.owners[owner] = targets
+        else:
+            self.owners.pop(owner, None)
+
+        wanted = self.targets()
+        for address in list(self.pools):
+            if address not in wanted:
+                for _, _, writer in self.pools.pop(address):
+                    writer.close()
+        if wanted and (self.task is None or self.task.done()):
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.create_task(self._maintain())
+        elif not wanted and self.task is not None:
+            self.task.cancel()
+            self.task = None
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def take(self, host: str, port: int) -> Optional[Tuple[asyncio.StreamReader, asyncio.StreamWriter]]:
+        """
+        Hand over a healthy standby connection, if one is ready, and schedule its replacement.
+
+        :param host: Host name from the phonebook entry.
+        :param port: Port number.
+        :return: Tuple of StreamReader and StreamWriter, or None.
+        """
+        pool = self.pools.get((host, port))
+        while pool:
+            created, reader, writer = pool.pop(0)
+            if self.wakeup is not None:
+                self.wakeup.set()
+            if self._is_healthy(created, reader, writer):
+                return reader, writer
+            writer.close()
+        return None
+
+    def _is_healthy(self, created: float, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        return (not writer.is_closing() and not reader.at_eof() and reader.exception() is None
+                and asyncio.get_running_loop().time() - created < self.max_age)
+
+    async def _maintain(self) -> None:
+        """ Background task dropping stale standby connections and opening replacements. """
+        loop = asyncio.get_running_loop()
+        while True:
+            self.wakeup.clear()
+            for address in self.targets():
+                pool = self.pools.setdefault(address, [])
+                for entry in [entry for entry in pool if not self._is_healthy(*entry)]:
+                    pool.remove(entry)
+                    entry[2].close()
+                while len(pool) < self.pool_size:
+                    try:
+                        reader, writer = await dial(*address, timeout=DEFAULT_CONNECTION_TIMEOUT)
+                    except (OSError, asyncio.TimeoutError) as e:
+                        logger.info(f'Prewarming {address[0]}:{address[1]} failed: {e}')
+                        break
+                    if address not in self.targets():
+                        writer.close()  # The entry stopped being a favorite while dialing
+                        break
+                    pool.append((loop.time(), reader, writer))
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.refresh_interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+prewarmer = ConnectionPrewarmer()
+
+#### Line Rate Pacing ####
+
+class LinePacer:
+    """
+    Token bucket that delivers data at a modem line rate. Data is released in
+    batches every PACING_SLICE seconds rather than byte by byte, so a paced
+    session costs one timer wakeup per slice regardless of the line rate.
+    """
+    def __init__(self, bits_per_second: int):
+        self.bits_per_second = bits_per_second
+        self.bytes_per_second: float = bits_per_second / BITS_PER_BYTE
+        # Never accumulate more than one slice worth of data, or at least a byte for very slow rates
+        self.burst: float = max(1.0, self.bytes_per_second * PACING_SLICE)
+        self.tokens: float = 0.0
+        self.last_refill: Optional[float] = None
+
+    async def pace(self, data: bytes, output_cb: Callable[[bytes], None]) -> None:
+        """
+        Pass data to output_cb no faster than the line rate allows.
+
+        :param data: The chunk of bytes to deliver.
+        :param output_cb: Callback receiving each released batch.
+        :return: None
+        """
+        loop = asyncio.get_running_loop()
+        pos = 0
+        while pos < len(data):
+            now = loop.time()
+            if self.last_refill is None:
+                self.tokens = self.burst
+            else:
+                self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.bytes_per_second)
+            self.last_refill = now
+
+            batch_size = int(self.tokens)
+            if batch_size:
+                batch = data[pos:pos + batch_size]
+                output_cb(batch)
+                pos += len(batch)
+                self.tokens -= len(batch)
+                if pos >= len(data):
+                    break
+            await asyncio.sleep(max(PACING_SLICE, (1 - self.tokens) / self.bytes_per_second))
+
+#### Metrics ####
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LOOP_LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+LOOP_LAG_INTERVAL = 1.0  # Seconds between event loop lag samples while metrics are served
+
+class Histogram:
+    """ Histogram with fixed bucket bounds, rendered as a cumulative Prometheus histogram. """
+    def __init__(self, bounds: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts: List[int] = [0] * (len(bounds) + 1)  # The last bucket counts values above every bound
+        self.total: float = 0.0
+        self.count: int = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def render(self, name: str, description: str) -> List[str]:
+        """
+        Render the histogram in the Prometheus text format.
+
+        :param name: Metric name.
+        :param description: Text for the HELP line.
+        :return: Lines of the exposition.
+        """
+        lines = [f'# HELP {name} {description}', f'# TYPE {name} histogram']
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum {self.total}')
+        lines.append(f'{name}_count {self.count}')
+        return lines
+
+
+class SessionMetrics:
+    """
+    Counters kept by one modem session. They are updated once per chunk or event,
+    never per byte, so collection stays on in production.
+    """
+    # Counter attributes and their descriptions, summed into the process totals
+    COUNTERS = (
+        ('bytes_from_client', 'Bytes received from clients'),
+        ('bytes_to_client', 'Bytes sent to clients'),
+        ('bytes_to_remote', 'Bytes sent to remote hosts'),
+        ('bytes_from_remote', 'Bytes received from remote hosts'),
+        ('dial_attempts', 'Dial attempts'),
+        ('dial_failures', 'Dial attempts that did not connect'),
+        ('escapes', 'Escapes from DATA to COMMAND mode'),
+        ('telnet_iac', 'Telnet IAC bytes decoded'),
+        ('transfers', 'File transfers'),
+        ('transfer_bytes', 'Bytes passed through for file transfers'),
+        ('transfer_seconds', 'Seconds spent in file transfers'),
+    )
+    # High-water mark attributes and their descriptions, maximized into the process totals
+    HIGH_WATER_MARKS = (
+        ('client_buffer_high_water', 'Largest write buffer towards a client in bytes'),
+        ('remote_buffer_high_water', 'Largest write buffer towards a remote host in bytes'),
+    )
+    __slots__ = ('started', 'dial_latency', 'connect_time') + tuple(name for name, _ in COUNTERS + HIGH_WATER_MARKS)
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.bytes_from_client: int = 0
+        self.bytes_to_client: int = 0
+        self.bytes_to_remote: int = 0
+        self.bytes_from_remote: int = 0
+        self.dial_attempts: int = 0
+        self.dial_failures: int = 0
+        self.escapes: int = 0
+        self.telnet_iac: int = 0
+        self.transfers: int = 0
+        self.transfer_bytes: int = 0
+        self.transfer_seconds: float = 0.0
+        self.client_buffer_high_water: int = 0
+        self.remote_buffer_high_water: int = 0
+        self.dial_latency: Optional[float] = None  # Seconds the last dial took to connect
+        self.connect_time: Optional[float] = None  # Seconds from the last ATD to CONNECTED
+
+    def merge(self, other: 'SessionMetrics') -> None:
+        """ Add the counters of other to these and keep the larger high-water marks. """
+        for name, _ in self.COUNTERS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        for name, _ in self.HIGH_WATER_MARKS:
+            setattr(self, name, max(getattr(self, name), getattr(other, name)))
+
+
+class ProcessMetrics:
+    """
+    Metrics of the whole process: the counters of open sessions are summed with
+    those of closed sessions when rendered, so sessions never touch shared totals
+    on their data path. Latency histograms are updated per event.
+    """
+    def __init__(self):
+        self.open_sessions: set = set()  # SessionMetrics of the sessions currently open
+        self.closed_sessions = SessionMetrics()  # Totals of the sessions that have ended
+        self.sessions_total: int = 0
+        self.dial_latency = Histogram()
+        self.connect_time = Histogram()
+        self.loop_lag = Histogram(LOOP_LAG_BUCKETS)
+
+    def open_session(self) -> SessionMetrics:
+        metrics = SessionMetrics()
+        self.open_sessions.add(metrics)
+        self.sessions_total += 1
+        return metrics
+
+    def close_session(self, metrics: SessionMetrics) -> None:
+        if metrics in self.open_sessions:
+            self.open_sessions.discard(metrics)
+            self.closed_sessions.merge(metrics)
+
+    def totals(self) -> SessionMetrics:
+        """ :return: Counters summed over every session, open or closed. """
+        totals = SessionMetrics()
+        totals.merge(self.closed_sessions)
+        for metrics in self.open_sessions:
+            totals.merge(metrics)
+        return totals
+
+    def render(self) -> str:
+        """ :return: The process metrics in the Prometheus text exposition format. """
+        totals = self.totals()
+        lines = [
+            '# HELP meowdem_sessions_open Sessions currently open',
+            '# TYPE meowdem_sessions_open gauge',
+            f'meowdem_sessions_open {len(self.open_sessions)}',
+            '# HELP meowdem_sessions_total Sessions opened since start',
+            '# TYPE meowdem_sessions_total counter',
+            f'meowdem_sessions_total {self.sessions_total}',
+        ]
+        for name, description in SessionMetrics.COUNTERS:
+            lines += [f'# HELP meowdem_{name}_total {description}', f'# TYPE meowdem_{name}_total counter',
+                      f'meowdem_{name}_total {getattr(totals, name)}']
+        for name, description in SessionMetrics.HIGH_WATER_MARKS:
+            lines += [f'# HELP meowdem_{name}_bytes {description}', f'# TYPE meowdem_{name}_bytes gauge',
+                      f'meowdem_{name}_bytes {getattr(totals, name)}']
+        lines += self.dial_latency.render('meowdem_dial_latency_seconds', 'Time taken by dials that connected')
+        lines += self.connect_time.render('meowdem_connect_time_seconds', 'Time from ATD to CONNECTED')
+        lines += self.loop_lag.render('meowdem_event_loop_lag_seconds', 'Delay of event loop timer callbacks')
+        return '\n'.join(lines) + '\n'
+
+    async def sample_loop_lag(self, interval: float = LOOP_LAG_INTERVAL) -> None:
+        """
+        Measure how late a timer wakes up every interval seconds, for as long as the task runs.
+
+        :param interval: Seconds between samples.
+        :return: None
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+            self.loop_lag.observe(max(0.0, loop.time() - expected))
+
+
+process_metrics = ProcessMetrics()
+
+
+#### Connection Housekeeping ####
+
+class InactivityTimer:
+    """
+    Calls a callback once no activity was recorded for timeout seconds. Recording
+    activity only stores a timestamp; the single loop timer re-arms itself for the
+    remaining time when it fires early, so busy connections cost no timer operations
+    per chunk and idle ones no polling.
+    """
+    __slots__ = ('timeout', 'callback', 'loop', 'last_activity', 'handle')
+
+    def __init__(self, timeout: float, callback: Callable[[], None]):
+        self.timeout = timeout
+        self.callback = callback
+        self.loop = asyncio.get_running_loop()
+        self.last_activity: float = self.loop.time()
+        self.handle: Optional[asyncio.TimerHandle] = None
+        self.start()
+
+    def touch(self) -> None:
+        """ Record activity, postponing the callback. """
+        self.last_activity = self.loop.time()
+
+    def start(self) -> None:
+        """ Arm the timer if it is not armed, counting from the last activity. """
+        if self.handle is None:
+            self.handle = self.loop.call_at(self.last_activity + self.timeout, self._expired)
+
+    def cancel(self) -> None:
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+
+    def _expired(self) -> None:
+        self.handle = None
+        if self.loop.time() < self.last_activity + self.timeout:
+            self.start()
+        else:
+            self.callback()
+
+
+def configure_keepalive(sock: Optional[socket.socket]) -> None:
+    """ Enable TCP keepalive so peers that vanished without closing the connection are noticed.
+    :param sock: Socket of the connection, ignored if None or not a TCP socket.
+    :return: None
+    """
+    if sock is None or sock.type != socket.SOCK_STREAM or sock.family not in (socket.AF_INET, socket.AF_INET6):
+        return
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    for option, value in (('TCP_KEEPIDLE', KEEPALIVE_IDLE), ('TCP_KEEPINTVL', KEEPALIVE_INTERVAL),
+                          ('TCP_KEEPCNT', KEEPALIVE_COUNT)):
+        if hasattr(socket, option):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+
+
+async def close_writer(writer: asyncio.StreamWriter) -> None:
+    """ Close a stream and wait for it, ignoring a peer that already reset the connection.
+    :param writer: StreamWriter to close.
+    :return: None
+    """
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except ConnectionError:
+        pass
+
+
+#### File Transfers ####
+
+# X/YMODEM and ZMODEM control characters
+SOH = 0x01  # Start of a 128 byte X/YMODEM block
+STX = 0x02  # Start of a 1024 byte X/YMODEM block
+EOT = b'\x04'  # Sent by an X/YMODEM sender after the last block
+CAN = 0x18  # Repeated to abort a transfer; also ZMODEM's ZDLE escape
+ZMODEM_HEADER = b'**\x18B'  # ZPAD ZPAD ZDLE ZHEX, the start of a ZMODEM hex header
+ZMODEM_ZFIN = ZMODEM_HEADER + b'08'  # Hex header of ZFIN, sent by both sides to end a ZMODEM session
+TRANSFER_ABORT = bytes((CAN, CAN))  # Never part of a ZMODEM stream, where a CAN is always followed by an escaped byte
+TRANSFER_IDLE_TIMEOUT = 10.0  # Seconds without data after which a transfer is assumed to be over
+
+
+def xmodem_blocks_end(data: bytes) -> Tuple[int, int]:
+    """ Walk the whole X/YMODEM blocks at the start of a chunk. A block is SOH or STX, the block
+    number and its complement, 128 or 1024 data bytes and a two byte CRC or one byte checksum.
+    :param data: Chunk to walk.
+    :return: Offset just past the last whole block, 0 if the chunk does not start with one,
+             and the trailer length of that block.
+    """
+    offset = 0
+    trailer = 0
+    length = len(data)
+    while length - offset >= 132:
+        start = data[offset]
+        if start not in (SOH, STX) or data[offset + 1] + data[offset + 2] != 0xff:
+            break
+        block_end = offset + (131 if start == SOH else 1027)
+        # The block ends the chunk or is followed by another block or EOT
+        for trailer in (2, 1):
+            end = block_end + trailer
+            if end == length or (end < length and data[end] in (SOH, STX, EOT[0])):
+                break
+        else:
+            break
+        offset = end
+    return offset, trailer if offset else 0
+
+
+def detect_transfer(data: bytes, from_client: bool = False) -> Optional[str]:
+    """ Recognise the start of a file transfer in a chunk from either side of a connection.
+    X/YMODEM blocks are only looked for in data from the remote host, where a chunk of whole
+    blocks is hard to mistake for anything else; uploads are only recognised for ZMODEM.
+    :param data: Chunk received from the client or the remote host.
+    :param from_client: True if the chunk came from the client, False if from the remote host.
+    :return: 'ZMODEM', 'YMODEM' or 'XMODEM', or None if the chunk does not start a transfer.
+    """
+    if ZMODEM_HEADER in data:
+        return 'ZMODEM'
+    if from_client:
+        return None
+    end, _ = xmodem_blocks_end(data)
+    if end and (end == len(data) or data[end:] == EOT):
+        if data[1] != 0:
+            return 'XMODEM'
+        if data[3] != 0:
+            return 'YMODEM'  # Block 0 naming a file; an empty block 0 ends a YMODEM batch
+    return None
+
+
+class FileTransfer:
+    """
+    A file transfer in progress on a session. Its data is binary, so while it lasts the
+    session passes chunks through without escape detection or character set translation.
+    ZMODEM chunks are searched for the ZFIN headers ending the session. X/YMODEM data from
+    the sender is followed block by block across reads, so EOT and cancels only count
+    between blocks, and a YMODEM batch lasts until the empty block 0 after the last file.
+    """
+    __slots__ = ('protocol', 'started', 'bytes', 'zfin_from', 'block_trailer', 'block_remaining',
+                 'block_header', 'eot_seen', 'idle_timer')
+
+    def __init__(self, protocol: str, idle_callback: Callable[[], None]):
+        """
+        :param protocol: 'ZMODEM', 'YMODEM' or 'XMODEM', as returned by detect_transfer().
+        :param idle_callback: Called if no data is transferred for TRANSFER_IDLE_TIMEOUT seconds.
+        """
+        self.protocol = protocol
+        self.started = time.monotonic()
+        self.bytes: int = 0
+        self.zfin_from: set = set()  # Sides that sent ZFIN, True for the client
+        self.block_trailer: int = 0  # X/YMODEM checksum (1) or CRC (2) length, learnt from the first blocks
+        self.block_remaining: int = 0  # Bytes of the current X/YMODEM block still to come
+        self.block_header = bytearray()  # Start byte, block number, complement and first data byte of the current block
+        self.eot_seen = True  # A YMODEM block 0 now starts a file or ends the batch, rather than being a wrapped block number
+        self.idle_timer = InactivityTimer(TRANSFER_IDLE_TIMEOUT, idle_callback)
+
+    def update(self, data: bytes, from_client: bool) -> bool:
+        """ Count a chunk of the transfer and check whether it ends the transfer.
+        :param data: Chunk passed through for the transfer.
+        :param from_client: True if the chunk came from the client, False if from the remote host.
+        :return: True if the transfer is over.
+        """
+        self.bytes += len(data)
+        self.idle_timer.touch()
+        if self.protocol == 'ZMODEM':
+            if ZMODEM_ZFIN in data:
+                self.zfin_from.add(from_client)
+            return len(self.zfin_from) == 2 or TRANSFER_ABORT in data
+        if from_client:
+            return TRANSFER_ABORT in data  # The receiver only sends single control characters
+        if not self.block_trailer:
+            _, self.block_trailer = xmodem_blocks_end(data)
+            if not self.block_trailer:
+                return False  # Block boundaries unknown until whole blocks are seen
+        return self._follow_blocks(data)
+
+    def _follow_blocks(self, data: bytes) -> bool:
+        """ Follow the sender's X/YMODEM blocks through a chunk.
+        :param data: Chunk from the sender, continuing where the previous one stopped.
+        :return: True if the chunk ends the transfer.
+        """
+        offset = 0
+        length = len(data)
+        while offset < length:
+            if self.block_remaining:
+                take = min(self.block_remaining, length - offset)
+                header = self.block_header
+                if len(header) < 4:
+                    header += data[offset:offset + min(take, 4 - len(header))]
+                offset += take
+                self.block_remaining -= take
+                if not self.block_remaining and self.protocol == 'YMODEM' and header[1] == 0 and self.eot_seen:
+                    if header[3] == 0:
+                        return True  # Empty block 0: no more files in the batch
+                    self.eot_seen = False
+                continue
+            byte = data[offset]
+            if byte == SOH or byte == STX:
+                self.block_header = bytearray()
+                self.block_remaining = (131 if byte == SOH else 1027) + self.block_trailer
+            elif byte == EOT[0]:
+                if self.protocol == 'XMODEM':
+                    return True
+                self.eot_seen = True  # The next file's block 0 or the empty one ending the batch follows
+                offset += 1
+            elif data.startswith(TRANSFER_ABORT, offset):
+                return True
+            else:
+                offset += 1  # Line noise between blocks
+        return False
+
+
+#### Session Capture ####
+
+# A capture file is CAPTURE_MAGIC followed by records, each a CAPTURE_RECORD header
+# (seconds since the session started, direction, payload length) and the payload
+CAPTURE_MAGIC = b'MEOWCAP1'
+CAPTURE_RECORD = struct.Struct('<dBI')
+CAPTURE_CLIENT_IN = 0  # Bytes from the client, as passed to HayesATParser.receive()
+CAPTURE_CLIENT_OUT = 1  # Bytes sent to the client
+CAPTURE_REMOTE_IN = 2  # Bytes read from the remote host, before telnet decoding
+CAPTURE_REMOTE_OUT = 3  # Bytes written to the remote host
+CAPTURE_FLUSH_SIZE = 65536  # Buffered capture bytes that trigger a write
+CAPTURE_FLUSH_INTERVAL = 1.0  # Seconds buffered capture data may wait for a write
+
+# Directory new sessions are captured to, set by --capture-dir
+capture_dir: Optional[str] = None
+# Single thread writing every capture file, so the event loop never blocks on disk writes
+capture_executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+capture_ids = itertools.count(1)
+
+
+def _append_capture(path: str, data: bytes) -> None:
+    with open(path, 'ab') as capture_file:
+        capture_file.write(data)
+
+
+class SessionCapture:
+    """
+    Append-only binary log of both directions of a session. Records are collected in
+    memory and handed to the capture thread once CAPTURE_FLUSH_SIZE bytes are buffered
+    or CAPTURE_FLUSH_INTERVAL seconds have passed, so capturing costs a struct pack and
+    a buffer append per chunk. The file is only opened while a batch is appended, so
+    captured sessions hold no file descriptor and sessions without traffic leave no file.
+    """
+    __slots__ = ('path', 'started', 'buffer', 'written', 'flush_handle')
+
+    def __init__(self, path: str):
+        global capture_executor
+        if capture_executor is None:
+            capture_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='capture')
+        self.path = path
+        self.started = time.monotonic()
+        self.buffer = bytearray()
+        self.written = False  # Whether the file was started with CAPTURE_MAGIC
+        self.flush_handle: Optional[asyncio.TimerHandle] = None
+
+    @classmethod
+    def create(cls, directory: str) -> 'SessionCapture':
+        """ Start capturing to a new file in directory, named after the time, process and session. """
+        name = f"meowdem-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(capture_ids)}.cap"
+        return cls(os.path.join(directory, name))
+
+    def record(self, direction: int, data: bytes) -> None:
+        """
+        Append a record to the capture.
+
+        :param direction: One of the CAPTURE_* direction constants.
+        :param data: The bytes that passed in that direction.
+        :return: None
+        """
+        buffer = self.buffer
+        buffer += CAPTURE_RECORD.pack(time.monotonic() - self.started, direction, len(data))
+        buffer += data
+        if len(buffer) >= CAPTURE_FLUSH_SIZE:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(CAPTURE_FLUSH_INTERVAL, self.flush)
+
+    def flush(self) -> None:
+        """ Hand the buffered records to the capture thread. """
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if self.buffer:
+            batch = bytes(self.buffer) if self.written else CAPTURE_MAGIC + self.buffer
+            capture_executor.submit(_append_capture, self.path, batch)
+            self.buffer.clear()
+            self.written = True
+
+    def close(self) -> None:
+        """ Hand the rest of the capture to the capture thread. """
+        self.flush()
+
+
+def finish_captures() -> None:
+    """ Wait until the capture thread has written everything it was handed. """
+    global capture_executor
+    if capture_executor is not None:
+        capture_executor.shutdown(wait=True)
+        capture_executor = None
+
+
+def read_capture(path: str) -> Iterable[Tuple[float, int, bytes]]:
+    """
+    Read a capture file through a memory map.
+
+    :param path: Path of the capture file.
+    :return: Iterator of (seconds since the session started, direction, payload) tuples.
+    """
+    import mmap
+    with open(path, 'rb') as capture_file, mmap.mmap(capture_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        if data[:len(CAPTURE_MAGIC)] != CAPTURE_MAGIC:
+            raise ValueError(f'{path} is not a meowdem capture')
+        pos = len(CAPTURE_MAGIC)
+        end = len(data)
+        header_size = CAPTURE_RECORD.size
+        while pos + header_size <= end:
+            timestamp, direction, length = CAPTURE_RECORD.unpack_from(data, pos)
+            pos += header_size
+            yield timestamp, direction, data[pos:pos + length]
+            pos += length
+
+
+#### Link Compression ####
+
+# Two meowdem instances can compress the link between them. The dialing side opens with
+# LINK_HELLO, a telnet offer of an unassigned option that telnet servers refuse and
+# other servers ignore. A meowdem serving TCP clients answers LINK_ACCEPT, after which
+# both directions are a raw deflate stream.
+TELOPT_LINK_COMPRESSION = 227  # Unassigned telnet option number
+LINK_HELLO = bytes((IAC, WILL, TELOPT_LINK_COMPRESSION))
+LINK_ACCEPT = bytes((IAC, DO, TELOPT_LINK_COMPRESSION))
+LINK_REFUSE = bytes((IAC, DONT, TELOPT_LINK_COMPRESSION))
+LINK_HELLO_TIMEOUT = 1.0  # Seconds to wait for LINK_ACCEPT before continuing uncompressed
+LINK_COMPRESSION_LEVEL = 6
+Z_SYNC_FLUSH = 2  # zlib.Z_SYNC_FLUSH, zlib is only imported once a link is compressed
+
+class LinkCodec:
+    """
+    Streaming deflate codec for a meowdem to meowdem link. The compression history is
+    kept across chunks, so repeated ANSI sequences and text compress well, and every
+    chunk ends with a sync flush so a single keystroke is sent at once.
+    """
+    __slots__ = ('compressor', 'decompressor')
+
+    def __init__(self):
+        import zlib
+        # Negative window bits give a raw deflate stream without zlib headers
+        self.compressor = zlib.compressobj(LINK_COMPRESSION_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data) + self.compressor.flush(Z_SYNC_FLUSH)
+
+    def decompress(self, data: bytes) -> bytes:
+        return self.decompressor.decompress(data)
+
+
+#### Character Sets ####
+
+def make_translation_table(changes: Dict[int, int]) -> bytes:
+    """ Build a bytes.translate() table mapping every byte to itself, except the keys of changes to their values. """
+    table = bytearray(range(256))
+    for source, target in changes.items():
+        table[source] = target
+    return bytes(table)
+
+
+class Charset:
+    """
+    Character set and line ending convention of a client, such as a C64 or an Atari 8-bit,
+    translated to and from the ASCII spoken by remote hosts and the command interpreter.
+    Bytes are mapped with bytes.translate() tables and line endings rewritten with
+    bytes.replace(), so a chunk is translated in a few passes in C whatever its size.
+    """
+    __slots__ = ('name', 'input_table', 'output_table', 'output_delete', 'newline', 'split_lf')
+
+    def __init__(self, name: str, input_changes: Dict[int, int], output_changes: Dict[int, int],
+                 newline: bytes = b'\r\n', output_delete: bytes = b''):
+        """
+        :param name: Name reported by AT*C?.
+        :param input_changes: Client bytes mapped to the ASCII bytes sent in their place.
+        :param output_changes: ASCII bytes mapped to the client bytes sent in their place.
+        :param newline: The client's end of line; CR LF and lone LF from the remote host are replaced with it.
+        :param output_delete: ASCII bytes dropped on their way to the client.
+        """
+        self.name = name
+        self.input_table = make_translation_table(input_changes)
+        if len(newline) == 1:
+            output_changes = {**output_changes, ord('\n'): newline[0]}
+        self.output_table = make_translation_table(output_changes)
+        self.output_delete = output_delete
+        self.newline = newline
+        # Sent for the LF of a CR LF split across chunks, the CR having been translated on its own already
+        carriage_return = b'\r'.translate(self.output_table, output_delete)
+        self.split_lf = newline[len(carriage_return):] if newline.startswith(carriage_return) else newline
+
+
+class CharsetTranslator:
+    """ Translates one session's data between its client's Charset and ASCII. """
+    __slots__ = ('charset', 'cr_pending')
+
+    def __init__(self, charset: Charset):
+        self.charset = charset
+        self.cr_pending: bool = False  # The last chunk sent to the client ended with a CR
+
+    def input_translation(self, bytes_chunk: bytes) -> bytes:
+        """ Translate data from the client to ASCII. """
+        return bytes_chunk.translate(self.charset.input_table)
+
+    def output_translation(self, bytes_chunk: bytes) -> bytes:
+        """ Translate ASCII data to the client's character set and line endings. """
+        charset = self.charset
+        split_lf = None
+        if self.cr_pending and bytes_chunk[:1] == b'\n':
+            split_lf = charset.split_lf
+            bytes_chunk = bytes_chunk[1:]
+        self.cr_pending = bytes_chunk[-1:] == b'\r'
+        data = bytes_chunk.replace(b'\r\n', b'\n').translate(charset.output_table, charset.output_delete)
+        if len(charset.newline) > 1:
+            data = data.replace(b'\n', charset.newline)
+        return data if split_lf is None else split_lf + data
+
+
+# Client character sets selectable with AT*C<n>; 0 is ASCII without translation
+charsets: Dict[int, Charset] = {
+    # C64 in lower/upper case mode: PETSCII swaps the cases and has its own DEL
+    1: Charset(
+        'PETSCII',
+        input_changes={
+            0x14: 0x08,
+            **{char: char + 0x20 for char in range(0x41, 0x5b)},
+            **{char: char - 0x20 for char in range(0x61, 0x7b)},
+            **{char: char - 0x80 for char in range(0xc1, 0xdb)},
+        },
+        output_changes={
+            0x08: 0x14,
+            0x7f: 0x14,
+            **{char: char + 0x80 for char in range(0x41, 0x5b)},
+            **{char: char - 0x20 for char in range(0x61, 0x7b)},
+        },
+        newline=b'\r',
+    ),
+    # Atari 8-bit: ATASCII ends lines with EOL (0x9B) and moves backspace, tab and bell
+    2: Charset(
+        'ATASCII',
+        input_changes={0x9b: 0x0d, 0x7e: 0x08, 0x7f: 0x09, 0xfd: 0x07},
+        output_changes={0x08: 0x7e, 0x7f: 0x7e, 0x09: 0x7f, 0x07: 0xfd},
+        newline=b'\x9b',
+        output_delete=b'\r',
+    ),
+    # ASCII terminals that need CR LF from hosts sending lone LF
+    3: Charset('ASCII CRLF', {}, {}),
+}
+
+
+def register_charset(number: int, charset: Charset) -> None:
+    """ Make a character set selectable with AT*C<number>, replacing any set with that number.
+    :param number: Number to select the set with, 1 or higher.
+    :param charset: The character set.
+    :return: None
+    """
+    if number < 1:
+        raise ValueError('Character set 0 is ASCII and cannot be replaced')
+    charsets[number] = charset
+
 
 #### AT Command Parser ####
 
+LINE_END_PATTERN = re.compile(b'[\r\n]')
+# Address stored by AT&Z; anything else could break the tab separated phonebook journal
+PHONEBOOK_ADDRESS = re.compile(r'(?P<host>(?:[a-zA-Z0-9-]+\.)*[a-zA-Z0-9-]+)(?::(?P<port>\d{1,5}))?')
+BACKSPACE = 0x08
+DELETE = 0x7f
+
 class ParserMode(Enum):
     COMMAND = 'command'
     DATA = 'data'
     DIALING = 'dialing'  # New mode state
 
+class CommandError(Exception):
+    """ Raised by a subcommand handler to reject its arguments; the rest of the command line is skipped. """
+
+
+# Signature of a subcommand handler: a method name on the parser, or a callable taking the parser
+# followed by the regex groups of the matched subcommand
+CommandHandler = Union[str, Callable[..., None]]
+
+
+class CommandTable(dict):
+    """
+    Compiled subcommand patterns and their handlers, keyed by each subcommand's leading
+    character. The patterns of a leading character are compiled the first time it is
+    looked up, so a modem answers its first AT without compiling grammar it does not use.
+    """
+    __slots__ = ('pending',)
+
+    def __init__(self):
+        super().__init__()
+        self.pending: Dict[str, List[Tuple[str, CommandHandler]]] = {}  # Patterns not compiled yet, by leading character
+
+    def __missing__(self, leader: str) -> List[Tuple[Pattern[str], CommandHandler]]:
+        pending = self.pending.pop(leader, None)
+        if pending is None:
+            return []  # Not stored, so line noise cannot grow the table
+        entries = self[leader] = [(re.compile(pattern), handler) for pattern, handler in pending]
+        return entries
+
+    def add(self, pattern: str, handler: CommandHandler, first: bool = False) -> None:
+        """ Add a subcommand to the table.
+        :param pattern: Regex for the subcommand, starting with a literal character.
+        :param handler: Handler of the subcommand.
+        :param first: Match it before the existing subcommands with the same leading character, rather than after them.
+        :return: None
+        """
+        leader = pattern[1] if pattern.startswith('\\') else pattern[0]
+        if leader in self:
+            entries, entry = self[leader], (re.compile(pattern), handler)
+        else:
+            entries, entry = self.pending.setdefault(leader, []), (pattern, handler)
+        entries.insert(0 if first else len(entries), entry)
+
+    def copy(self) -> 'CommandTable':
+        table = CommandTable()
+        table.update((leader, list(entries)) for leader, entries in self.items())
+        table.pending = {leader: list(entries) for leader, entries in self.pending.items()}
+        return table
+
+
+def build_command_table(grammar: Iterable[Tuple[str, CommandHandler]]) -> CommandTable:
+    """ Build the table of a subcommand grammar.
+    :param grammar: (pattern, handler) pairs in match priority order. Patterns must start with a literal character.
+    :return: CommandTable mapping a leading character to its compiled patterns and handlers.
+    """
+    table = CommandTable()
+    for pattern, handler in grammar:
+        table.add(pattern, handler)
+    return table
+
+
 class HayesATParser:
-    def __init__(self, client_output_cb: Callable[[bytes], None] = print):
-        self.command_buffer: str = ''
-        self.command_prefix = 'AT'
+    # The AT grammar is compiled once and shared by every parser; each subcommand is dispatched on
+    # its leading character and matched in place, so long chained commands are parsed in one pass
+    command_table = build_command_table((
+        (r'Z', 'handle_ATZ'),
+        (r'I(\d)?', 'handle_ATI'),
+        (r'S(\d+)=(\d+)', 'handle_ats_set'),
+        (r'S(\d+)\?', 'handle_ats_query'),
+        (r'&Z([\w-]+)=([^\r\n]*)', 'handle_AT_amp_Z'),
+        (r'&Z([\w-]+)\?', 'handle_AT_amp_Z_query'),
+        (r'&Z\?', lambda parser: parser.handle_AT_amp_Z_query('0')),
+        (r'&([A-Z])(\d+)', 'handle_amp_command'),
+        (r'%([A-Z])(\d+)', 'handle_pct_command'),
+        (r'D[T|P](.+)', 'handle_ATD'),
+        (r'D(.+)', 'handle_ATD'),
+        (r'H(0)?', 'handle_ATH'),
+        (r'O', 'handle_ATO'),
+        (r'E(0|1|\?)', 'handle_ATE'),
+        (r'\*T(0|1)', 'handle_AT_star_T'),
+        (r'\*TT=([\w-]{1,40})', 'handle_AT_star_TT'),
+        (r'\*TT(\?)', 'handle_AT_star_TT'),
+        (r'\*TW=(\d{1,5}),(\d{1,5})', 'handle_AT_star_TW'),
+        (r'\*TW(\?)', 'handle_AT_star_TW'),
+        (r'\*B(\d+|\?)', 'handle_AT_star_B'),
+        (r'\*P(0|1)', 'handle_AT_star_P'),
+        (r'\*F([\w-]+)=(0|1)', 'handle_AT_star_F'),
+        (r'\*Z(0|1|\?)', 'handle_AT_star_Z'),
+        (r'\*C(\d+|\?)', 'handle_AT_star_C'),
+        (r'\?', 'handle_ATQMARK'),
+    ))
+
+    @classmethod
+    def register_command(cls, pattern: str, handler: CommandHandler) -> None:
+        """ Register an additional subcommand, taking precedence over existing ones with the same leading character.
+        Registering on a subclass leaves the parent class' table untouched.
+        :param pattern: Regex for the subcommand (without the 'AT' prefix), starting with a literal character.
+        :param handler: Name of a parser method, or a callable taking the parser and the match groups.
+        :return: None
+        """
+        if 'command_table' not in cls.__dict__:
+            cls.command_table = cls.command_table.copy()
+        cls.command_table.add(pattern, handler, first=True)
+
+    command_prefix = 'AT'
+
+    # Thousands of idle sessions may be open at once, so parsers have no __dict__; everything
+    # a session does not need until it connects or enables an option is created on first use
+    __slots__ = (
+        'command_buffer', 'output_batch', 'mode', 'writer', 'dialing_task',
+        'telnet_translator', 'client_telnet_translator', 'phonebook', 'prewarm_enabled',
+        'escape_count', 'escape_timer', 'client_out_cb', 'client_drain_cb', 'client_buffer_size_cb',
+        'metrics', '_log', 's_registers', 'telnet_translation_enabled', 'echo_enabled', 'pacer',
+        'inactivity_timer', 'capture', 'link_compression', 'link_codec', 'charset_translator',
+        'transfer', 'terminal_type', 'window_size',
+    )
+
+    def __init__(self, client_output_cb: Callable[[bytes], None] = print,
+                 client_drain_cb: Optional[Callable[[], Awaitable[None]]] = None,
+                 phonebook: Optional[Phonebook] = None,
+                 client_buffer_size_cb: Optional[Callable[[], int]] = None):
+        self.command_buffer = bytearray()  # Current command line, upper-cased
+        self.output_batch: Optional[bytearray] = None  # Collects client output while receive() runs
         self.mode = ParserMode.COMMAND  
 
         self.writer: Optional[asyncio.StreamWriter] = None  # Stores the writer, None if no connection is open
         self.dialing_task: Optional[asyncio.Task] = None  # Task that runs while dialing
 
-        self.telnet_translator = TelnetTranslator()
-        self.phonebook: dict[str, tuple[str, Optional[int]]] = {}  
+        self.telnet_translator: Optional[TelnetTranslator] = None  # Decodes data from the remote host, created on every connection
+        self.client_telnet_translator: Optional[TelnetTranslator] = None  # Decodes data from the client, created when translation is first used
+        self.phonebook = phonebook if phonebook is not None else shared_phonebook
+        self.prewarm_enabled: bool = False  # Keep standby connections to the phonebook's favorites
 
         # Variables to handle escape from DATA to COMMAND mode
-        self.escape_detected_time: Optional[float] = None
-        self.escape_guard_time = ESCAPE_GUARD_TIME  # Use the constant here
+        self.escape_count: int = 0  # Number of consecutive escape characters seen in DATA mode
+        self.escape_timer: Optional[asyncio.TimerHandle] = None  # Armed only while a complete escape sequence awaits its guard time
         self.client_out_cb = client_output_cb  # Callback for client output binary data
-        self.guard_time_task = asyncio.create_task(self._monitor_guard_time())
+        self.client_drain_cb = client_drain_cb  # Awaited after each chunk from the remote host, pausing it while the client is behind
+        self.client_buffer_size_cb = client_buffer_size_cb  # Returns the bytes buffered for the client, for its high-water mark
+        self.metrics = process_metrics.open_session()
+        self._log: Optional[SessionLogAdapter] = None
         
         # Modem state variables
-        self.s_registers = {}
+        self.s_registers: Union[bytes, bytearray] = S_REGISTER_POWER_ON  # Copied to a bytearray on the first ATS<n>=<v>
         self.telnet_translation_enabled: bool = False
+        self.terminal_type: str = TELNET_TERMINAL_TYPE  # Reported to telnet servers asking for TTYPE, set by AT*TT
+        self.window_size: Tuple[int, int] = TELNET_WINDOW_SIZE  # Columns and rows sent with NAWS, set by AT*TW
         self.echo_enabled = True
-
-        self.subcommand_handlers = [
-            (r'^Z', self.handle_ATZ),
-            (r'^I', self.handle_ATI),
-            (r'^S(\d+)=(\d+)', self.handle_ats_set),
-            (r'^S(\d+)\?', self.handle_ats_query),
-            (r'^&Z([\w-]+)=([^\r\n]*)', self.handle_AT_amp_Z),
-            (r'^&Z([\w-]+)\?', self.handle_AT_amp_Z_query),
-            (r'^&Z\?', lambda: self.handle_AT_amp_Z_query('0')),
-            (r'^&([A-Z])(\d+)', self.handle_amp_command),
-            (r'^%([A-Z])(\d+)', self.handle_pct_command),
-            (r'^D[T|P](.+)', self.handle_ATD),
-            (r'^D(.+)', self.handle_ATD),
-            (r'^H(0)?', self.handle_ATH),
-            (r'^O', self.handle_ATO),
-            (r'^E(0|1|\?)', self.handle_ATE),
-            (r'^\*T(0|1)', self.handle_AT_star_T),
-            (r'^\?', self.handle_ATQMARK),
-        ]
+        self.pacer: Optional[LinePacer] = None  # Paces output from the remote host, None for unlimited speed
+        self.inactivity_timer: Optional[InactivityTimer] = None  # Hangs up an idle connection, armed while connected if S30 is set
+        self.link_compression: bool = False  # Offer link compression when dialing, set by AT*Z1
+        self.link_codec: Optional[LinkCodec] = None  # Compresses the remote connection when the far side is a meowdem that accepted
+        self.charset_translator: Optional[CharsetTranslator] = None  # Translates the client's character set, None for ASCII
+        self.transfer: Optional[FileTransfer] = None  # File transfer passing through the connection
+
+        # Record both directions of the session when started with --capture-dir
+        self.capture: Optional[SessionCapture] = None
+        if capture_dir is not None:
+            capture = self.capture = SessionCapture.create(capture_dir)
+
+            def capture_client_output(data: bytes) -> None:
+                capture.record(CAPTURE_CLIENT_OUT, data)
+                client_output_cb(data)
+            self.client_out_cb = capture_client_output
+        if startup_profile is not None:
+            self.client_out_cb = startup_profile.first_response_cb(self.client_out_cb)
+
+    @property
+    def log(self) -> SessionLogAdapter:
+        """ Logger adding this session's context to its records, created on first use. """
+        if self._log is None:
+            self._log = SessionLogAdapter(logger, {'session': next(session_ids), 'client': None, 'remote': None})
+        return self._log
+
+    def client_out(self, data: bytes) -> None:
+        """ Send data to the client, batching it into a single callback while receive() is running. """
+        if self.output_batch is not None:
+            self.output_batch += data
+        else:
+            if self.charset_translator is not None:
+                data = self.charset_translator.output_translation(data)
+            self.metrics.bytes_to_client += len(data)
+            self.client_out_cb(data)
 
     def client_out_str(self, data: str):
         """Send data to the client using the provided callback translating the string to bytes."""
-        self.client_out_cb(data.encode('latin1'))  # Send the data as raw binary
-
-    async def _monitor_guard_time(self):
-        """Background task to monitor if the guard time has passed."""
-        while True:
-            if self.escape_detected_time is not None:
-                elapsed_time = time.time() - self.escape_detected_time
-                if elapsed_time >= ESCAPE_GUARD_TIME:  
-                    self.mode = ParserMode.COMMAND  # Switch back to command mode
-                    self.client_out_str('OK\r\n')
-                    self.escape_detected_time = None  # Reset after guard time is handled
+        self.client_out(data.encode('latin1'))  # Send the data as raw binary
+
+    def _escape_guard_expired(self) -> None:
+        """ Timer callback run when no data followed a complete escape sequence within the guard time. """
+        self.escape_timer = None
+        self.escape_count = 0
+        self.metrics.escapes += 1
+        self.mode = ParserMode.COMMAND  # Switch back to command mode
+        self.client_out_str('OK\r\n')
+
+    def _cancel_escape_timer(self) -> None:
+        """ Cancel a pending escape guard timer, if any. """
+        if self.escape_timer is not None:
+            self.escape_timer.cancel()
+            self.escape_timer = None
+
+    def _cancel_inactivity_timer(self) -> None:
+        """ Cancel the S30 inactivity timer, if any. """
+        if self.inactivity_timer is not None:
+            self.inactivity_timer.cancel()
+            self.inactivity_timer = None
+
+    def _start_transfer(self, protocol: str) -> FileTransfer:
+        """ Pass the connection through untouched while a file transfer runs.
+        :param protocol: Protocol recognised by detect_transfer().
+        :return: The new transfer.
+        """
+        self._cancel_escape_timer()
+        self.escape_count = 0
+        self.metrics.transfers += 1
+        self.log.info(f'{protocol} transfer started')
+        transfer = self.transfer = FileTransfer(protocol, self._end_transfer)
+        return transfer
+
+    def _end_transfer(self) -> None:
+        """ Return to normal processing after a file transfer ended, was aborted or went idle. """
+        transfer = self.transfer
+        if transfer is None:
+            return
+        self.transfer = None
+        transfer.idle_timer.cancel()
+        elapsed = time.monotonic() - transfer.started
+        self.metrics.transfer_bytes += transfer.bytes
+        self.metrics.transfer_seconds += elapsed
+        self.log.info(f'{transfer.protocol} transfer ended: {transfer.bytes} bytes in {elapsed:.1f}s '
+                      f'({transfer.bytes / elapsed if elapsed else 0:.0f} bytes/s)')
+
+    def close(self) -> None:
+        """ Release the session's resources: pending timers, an ongoing dial and the remote connection. """
+        self._cancel_escape_timer()
+        self._cancel_inactivity_timer()
+        self._end_transfer()
+        if self.capture is not None:
+            self.capture.close()
+            self.capture = None
+        if self.dialing_task and not self.dialing_task.done():
+            self.dialing_task.cancel()
+        if self.writer and not self.writer.is_closing():
+            self.writer.close()
+        self.writer = None
+        if self.prewarm_enabled:
+            prewarmer.set_targets(self, ())
+        process_metrics.close_session(self.metrics)
 
-            await asyncio.sleep(0.1)  # Check every 100ms
+    def _collect_iac_count(self, translator: TelnetTranslator) -> None:
+        """ Move the IAC count of a translator into the session metrics. """
+        if translator.iac_count:
+            self.metrics.telnet_iac += translator.iac_count
+            translator.iac_count = 0
 
     def receive(self, data: bytes):
+        self.metrics.bytes_from_client += len(data)
+        if self.capture is not None:
+            self.capture.record(CAPTURE_CLIENT_IN, data)
         if self.telnet_translation_enabled:
-            data = self.telnet_translator.input_translation(data)
+            translator = self.client_telnet_translator
+            if translator is None:
+                translator = self.client_telnet_translator = TelnetTranslator()
+            data = translator.input_translation(data)
+            self._collect_iac_count(translator)
+        if self.transfer is None and self.mode == ParserMode.DATA and self.writer is not None:
+            protocol = detect_transfer(data, True)
+            if protocol is not None:
+                self._start_transfer(protocol)
+        if self.charset_translator is not None and self.transfer is None:
+            data = self.charset_translator.input_translation(data)
 
         if self.mode == ParserMode.DIALING:
             if self.dialing_task and not self.dialing_task.done():
                 self.dialing_task.cancel()  # Cancel the dialing operation
+                self.metrics.dial_failures += 1
                 self.client_out_str('NO CARRIER\r\n')
                 self.mode = ParserMode.COMMAND
             return 
 
-        for byte in data:
-            char = chr(byte).upper()
-            self._receive_char(byte)
-
-    def _receive_char(self, byte: int):
-        char = chr(byte)
-        if self.mode == ParserMode.DATA:
-            if self.writer and not self.writer.is_closing():
-                try:
-                    self.writer.write(bytes([byte]))  # Send the byte as raw binary
-                    asyncio.create_task(self.writer.drain())  # Ensure the data is sent
-                except Exception as e:
-                    self.client_out_str(f"ERROR: Failed to send data: {str(e)}\r\n")
-
-            if self.command_buffer == '+++':
-                self.escape_detected_time = None
-                self.command_buffer = ''
-            elif '+' in self.command_buffer and char != '+':
-                self.command_buffer = ''    
-
-            # Look for a full escape sequence of '+++'
-            if char == '+':
-                self.command_buffer += char
-                if self.command_buffer == '+++':
-                    self.escape_detected_time = time.time()
-
+        # Echo and command responses are sent to the client in one call once the chunk is processed
+        self.output_batch = bytearray()
+        try:
+            pos = 0
+            while pos < len(data):
+                if self.mode == ParserMode.DATA:
+                    # Everything left in the chunk belongs to the remote host
+                    self._receive_data(data[pos:])
+                    break
+                pos = self._receive_command_input(data, pos)
+        finally:
+            output, self.output_batch = self.output_batch, None
+            if output:
+                if self.charset_translator is not None:
+                    output = self.charset_translator.output_translation(output)
+                self.metrics.bytes_to_client += len(output)
+                self.client_out_cb(bytes(output))
+
+    def _receive_data(self, data: bytes) -> None:
+        """ Forward a chunk received in DATA mode to the remote host in a single write.
+        The escape characters are forwarded too, so the chunk never needs to be split; only its
+        trailing run of escape characters (S2) is inspected to track a possible '+++' escape sequence,
+        which returns to COMMAND mode once no more data arrives within the guard time (S12).
+        :param data: Bytes received from the client while in DATA mode.
+        :return: None
+        """
+        transfer = self.transfer
+        if self.writer and not self.writer.is_closing():
+            if self.capture is not None:
+                self.capture.record(CAPTURE_REMOTE_OUT, data)
+            wire_data = data
+            if self.telnet_translation_enabled and self.telnet_translator is not None:
+                wire_data = self.telnet_translator.output_translation(wire_data)
+            if self.link_codec is not None:
+                wire_data = self.link_codec.compress(wire_data)
+            try:
+                self.writer.write(wire_data)
+            except Exception as e:
+                self.client_out_str(f"ERROR: Failed to send data: {str(e)}\r\n")
+            else:
+                if self.inactivity_timer is not None:
+                    self.inactivity_timer.touch()
+                metrics = self.metrics
+                metrics.bytes_to_remote += len(wire_data)
+                buffered = self.writer.transport.get_write_buffer_size()
+                if buffered > metrics.remote_buffer_high_water:
+                    metrics.remote_buffer_high_water = buffered
+
+        if transfer is not None:
+            # Escape characters are file data during a transfer
+            if transfer.update(data, True):
+                self._end_transfer()
             return
 
-        # Handle backspace with echo as delete
-        if char in ['\x7f', '\b']:
-            if self.echo_enabled:
-                self.client_out_str('\b \b') 
-            self.command_buffer = self.command_buffer[:-1]
+        # Any data arriving within the guard time cancels a pending escape
+        self._cancel_escape_timer()
+        escape_char = self.s_registers[S_ESCAPE_CHAR]
+        if escape_char > 127:
+            return  # Escape sequence detection disabled
+
+        escape_run = len(data) - len(data.rstrip(bytes((escape_char,))))
+        # A chunk made only of escape characters continues the previous run, unless that run was already complete
+        if escape_run == len(data) and self.escape_count < 3:
+            escape_run += self.escape_count
+        self.escape_count = (escape_run - 1) % 3 + 1 if escape_run else 0
+        if self.escape_count == 3:
+            guard_time = self.s_registers[S_GUARD_TIME] / 50
+            self.escape_timer = asyncio.get_running_loop().call_later(guard_time, self._escape_guard_expired)
+
+    async def drain(self) -> None:
+        """ Wait until the remote connection's write buffer is below its high-water mark.
+        Callers await this once per chunk passed to receive() to get backpressure from the remote host.
+        :return: None
+        """
+        writer = self.writer
+        if writer is None or writer.is_closing():
             return
+        try:
+            await writer.drain()
+        except ConnectionError:
+            # The socket reader notices the closed connection and cleans up
+            pass
 
-        next_char = char.upper()
-        self.command_buffer += next_char
-
-        if self.echo_enabled:
-            self.client_out_str(next_char)
-
-        while "AT" in self.command_buffer:
-            at_index = self.command_buffer.find('AT')
-            for end_index in range(at_index + 2, len(self.command_buffer)):
-                if self.command_buffer[end_index] in ['\r', '\n']:
-                    command_str = self.command_buffer[at_index:end_index]
-                    if self.echo_enabled:
-                        self.client_out_str('\n')
-
-                    self.execute_command(command_str)
-                    self.command_buffer = self.command_buffer[end_index + 1:]
-                    break
+    def _receive_command_input(self, data: bytes, pos: int) -> int:
+        """ Process COMMAND mode input line by line, executing each complete 'AT' command.
+        Each line is located with a single scan for CR/LF and appended to the command buffer in one slice;
+        only lines containing backspaces are handled byte by byte.
+        :param data: Bytes received from the client.
+        :param pos: Offset of the first unprocessed byte.
+        :return: Offset of the first byte not processed, which is before the end of data only when a command switched to DATA mode.
+        """
+        buffer = self.command_buffer
+        length = len(data)
+        while pos < length:
+            line_end = LINE_END_PATTERN.search(data, pos)
+            end = line_end.start() if line_end is not None else length
+            segment = data[pos:end].upper()
+            if BACKSPACE not in segment and DELETE not in segment:
+                buffer += segment
+                if self.echo_enabled:
+                    self.client_out(segment)
             else:
+                for byte in segment:
+                    # Handle backspace with echo as delete
+                    if byte == BACKSPACE or byte == DELETE:
+                        if self.echo_enabled:
+                            self.client_out(b'\b \b')
+                        del buffer[-1:]
+                    else:
+                        buffer.append(byte)
+                        if self.echo_enabled:
+                            self.client_out(bytes((byte,)))
+            if len(buffer) > MAX_COMMAND_LENGTH:
+                buffer.clear()  # Line noise, not a command
+
+            if line_end is None:
+                return length
+            pos = end + 1
+            if self.echo_enabled:
+                self.client_out(data[end:pos])
+
+            at_index = buffer.find(b'AT')
+            if at_index < 0:
+                buffer.clear()  # A line without a command
+                continue
+            command_str = buffer[at_index:].decode('latin1')
+            buffer.clear()
+            if self.echo_enabled:
+                self.client_out(b'\n')
+            self.execute_command(command_str)
+            if self.mode == ParserMode.DATA:
                 break
+        return pos
 
     def execute_command(self, command: str):
         """ Execute a parsed AT command.  """
-        # Remove spaces between 'AT' and the rest of the command for compatibility
-        if command.startswith('AT'):
-            command = 'AT' + command[2:].lstrip()
-        else:
+        if not command.startswith('AT'):
             self.client_out_str('ERROR: Invalid command prefix\r\n')
             return
 
-        command_body = command[2:]
-        pos = 0
-        while pos < len(command_body):
-            matched = False
-            for pattern, handler in self.subcommand_handlers:
-                match = re.match(pattern, command_body[pos:])
+        # Skip spaces between 'AT' and the rest of the command for compatibility
+        pos = 2
+        length = len(command)
+        while pos < length and command[pos].isspace():
+            pos += 1
+
+        command_table = self.command_table
+        while pos < length:
+            leader = command[pos]
+            for pattern, handler in command_table[leader]:
+                match = pattern.match(command, pos)
                 if match:
-                    handler(*match.groups())
-                    pos += match.end()
-                    matched = True
+                    try:
+                        if isinstance(handler, str):
+                            getattr(self, handler)(*match.groups())
+                        else:
+                            handler(self, *match.groups())
+                    except CommandError as e:
+                        self.client_out_str(f"ERROR: {e}\r\n")
+                        return
+                    pos = match.end()
                     break
-            if not matched:
-                if command_body[pos] in ['Z', '&', '%', 'S', 'D', 'H', 'O']:
+            else:
+                if leader in 'Z&%SDHO':
                     pos += 1  # Skip unsupported commands without arguments
                 else:
-                    self.client_out_str(f"ERROR: Unknown subcommand at: '{command_body[pos:]}'\r\n")
+                    self.client_out_str(f"ERROR: Unknown subcommand at: '{command[pos:]}'\r\n")
                     break
         else:
             if self.mode == ParserMode.COMMAND:
@@ -279,22 +1966,62 @@ class HayesATParser:
     # === Handlers ===
     def handle_ATZ(self, *args):
         self.echo_enabled = True
-        self.s_registers = {}
+        self.s_registers = S_REGISTER_POWER_ON
         self.telnet_translation_enabled = False
-
-    def handle_ATI(self, *args):
+        self.terminal_type = TELNET_TERMINAL_TYPE
+        self.window_size = TELNET_WINDOW_SIZE
+        self.pacer = None
+        self.link_compression = False
+        self.charset_translator = None
+
+    def handle_ATI(self, page: Optional[str] = None):
+        """ Handler for ATI: modem information, or the session's statistics for ATI1. """
+        if page == '1':
+            self.handle_ATI_statistics()
+            return
         self.client_out_str('Modem Info: Python Virtual Modem v1.0\r\n')
         self.client_out_str(f"Echo enabled: {self.echo_enabled}\r\n") 
         self.client_out_str(f"Telnet translation enabled: {self.telnet_translation_enabled}\r\n")
 
+    def handle_ATI_statistics(self):
+        """ Show the counters of this session. """
+        metrics = self.metrics
+
+        def seconds(value: Optional[float]) -> str:
+            return f'{value:.3f}s' if value is not None else 'N/A'
+
+        self.client_out_str(
+            f"Session time: {time.monotonic() - metrics.started:.0f}s\r\n"
+            f"Bytes from client: {metrics.bytes_from_client}\r\n"
+            f"Bytes to client: {metrics.bytes_to_client}\r\n"
+            f"Bytes to remote: {metrics.bytes_to_remote}\r\n"
+            f"Bytes from remote: {metrics.bytes_from_remote}\r\n"
+            f"Dial attempts: {metrics.dial_attempts} ({metrics.dial_failures} failed)\r\n"
+            f"Last dial latency: {seconds(metrics.dial_latency)}\r\n"
+            f"Last time to CONNECTED: {seconds(metrics.connect_time)}\r\n"
+            f"Escapes: {metrics.escapes}\r\n"
+            f"Telnet IAC bytes: {metrics.telnet_iac}\r\n"
+            f"File transfers: {metrics.transfers}, {metrics.transfer_bytes} bytes in {metrics.transfer_seconds:.1f}s"
+            f" ({metrics.transfer_bytes / metrics.transfer_seconds if metrics.transfer_seconds else 0:.0f} bytes/s)\r\n"
+            f"Client buffer high-water: {metrics.client_buffer_high_water}\r\n"
+            f"Remote buffer high-water: {metrics.remote_buffer_high_water}\r\n"
+        )
+
     def handle_ats_set(self, reg, value):
-        self.s_registers[int(reg)] = int(value)
+        """ Handler for setting an S-register, copying the shared power-on values on the first write. """
+        reg_num, value_num = int(reg), int(value)
+        if reg_num >= S_REGISTER_COUNT or value_num > 255:
+            raise CommandError(f'S-register or value out of range: S{reg}={value}')
+        if type(self.s_registers) is bytes:
+            self.s_registers = bytearray(self.s_registers)
+        self.s_registers[reg_num] = value_num
 
     def handle_ats_query(self, reg: str):
         """ Handler for querying an S-register value. """
         reg_num = int(reg)
-        value = self.s_registers.get(reg_num, 0)  # Default to 0 if not set
-        self.client_out_str(f"{value}\r\n")
+        if reg_num >= S_REGISTER_COUNT:
+            raise CommandError(f'S-register out of range: S{reg}')
+        self.client_out_str(f"{self.s_registers[reg_num]}\r\n")
 
     def handle_amp_command(self, letter, value):
         pass
@@ -304,9 +2031,10 @@ class HayesATParser:
 
     def handle_ATH(self, *args):
         """Handler for the ATH command to hang up an open connection."""
+        self._cancel_inactivity_timer()
+        self._end_transfer()
         if self.writer and not self.writer.is_closing():
-            self.writer.close()
-            asyncio.create_task(self.writer.wait_closed())
+            self.writer.close()  # The socket reader task waits for the close to finish
             self.writer = None
             self.client_out_str('NO CARRIER\r\n')
         self.mode = ParserMode.COMMAND
@@ -333,6 +2061,28 @@ class HayesATParser:
         else:
             self.client_out_str('ERROR\r\n')
 
+    def handle_AT_star_Z(self, value: str) -> None:
+        """ Handler for the custom AT*Z command to offer link compression to a meowdem on the far side of the next dial, or AT*Z? to query it. """
+        if value == '?':
+            active = ' (active)' if self.link_codec is not None else ''
+            self.client_out_str(f"{int(self.link_compression)}{active}\r\n")
+            return
+        self.link_compression = value == '1'
+
+    def handle_AT_star_C(self, value: str) -> None:
+        """ Handler for the custom AT*C<n> command to select the client's character set, or AT*C? to query it. 0 means ASCII. """
+        if value == '?':
+            translator = self.charset_translator
+            self.client_out_str(f"{translator.charset.name if translator is not None else 'ASCII'}\r\n")
+            return
+        number = int(value)
+        if number == 0:
+            self.charset_translator = None
+        elif number in charsets:
+            self.charset_translator = CharsetTranslator(charsets[number])
+        else:
+            raise CommandError(f'Unknown character set {number}')
+
     def handle_AT_star_T(self, value: str):
         """Handler for the custom AT*T command to toggle telnet translation."""
         if value == '1':
@@ -342,21 +2092,75 @@ class HayesATParser:
         else:
             self.client_out_str('ERROR\r\n')
 
+    def handle_AT_star_TT(self, value: str) -> None:
+        """ Handler for the custom AT*TT=<type> command to set the terminal type reported to telnet servers from the next dial, or AT*TT? to query it. """
+        if value == '?':
+            self.client_out_str(f"{self.terminal_type}\r\n")
+            return
+        self.terminal_type = value
+
+    def handle_AT_star_TW(self, value: str, rows: Optional[str] = None) -> None:
+        """ Handler for the custom AT*TW=<columns>,<rows> command to set the window size sent to telnet servers from the next dial, or AT*TW? to query it. """
+        if value == '?':
+            self.client_out_str(f"{self.window_size[0]},{self.window_size[1]}\r\n")
+            return
+        window_size = (int(value), int(rows))
+        if max(window_size) > 0xffff:
+            raise CommandError('Window size out of range')
+        self.window_size = window_size
+
+    def handle_AT_star_B(self, value: str) -> None:
+        """ Handler for the custom AT*B<bps> command to pace output to a line rate, or AT*B? to query it. 0 means unlimited. """
+        if value == '?':
+            rate = self.pacer.bits_per_second if self.pacer is not None else 0
+            self.client_out_str(f"{rate}\r\n")
+            return
+        rate = int(value)
+        self.pacer = LinePacer(rate) if rate else None
+
+    def _update_prewarm(self) -> None:
+        """ Register the addresses of favorite phonebook entries with the prewarmer while prewarming is enabled. """
+        targets = []
+        if self.prewarm_enabled:
+            targets = [(host, port or DEFAULT_TELNET_PORT) for host, port in self.phonebook.favorites()]
+        prewarmer.set_targets(self, targets)
+
+    def handle_AT_star_P(self, value: str) -> None:
+        """ Handler for the custom AT*P command to toggle keeping standby connections to favorite phonebook entries. """
+        self.prewarm_enabled = value == '1'
+        self._update_prewarm()
+
+    def handle_AT_star_F(self, entry_num: str, value: str) -> None:
+        """ Handler for the custom AT*F<n>=0/1 command to mark a phonebook entry as a favorite for prewarming. """
+        if not self.phonebook.set_favorite(entry_num, value == '1'):
+            self.client_out_str('NOT SET\r\n')
+        elif self.prewarm_enabled:
+            self._update_prewarm()
+
     def handle_ATQMARK(self, *args):
         """ Handler for the AT? command to display help text. """
         help_text = (
             'Hayes AT Command Help:\r\n'
             'ATZ            - Reset modem\r\n'
             'ATI            - Modem info\r\n'
+            'ATI1           - Session statistics\r\n'
             'ATS<n>=<v>     - Set S-register n to value v\r\n'
             'ATS<n>?        - Query S-register n\r\n'
             'ATDT<addr>     - Dial (tone) <host>:<port>\r\n'
             'ATDP<addr>     - Dial (pulse) <host>:<port>\r\n'
             'ATD<addr>      - Dial <host>:<port>\r\n'
+            'ATDS=<n>       - Dial phonebook entry n, or the only one starting with n\r\n'
             'ATH            - Hang up\r\n'
             'ATO            - Return to data mode\r\n'
             'ATE0/1/?       - Echo off/on/query\r\n'
             'AT*T0/1        - Telnet translation off/on\r\n'
+            'AT*TT=<type>/? - Terminal type reported to telnet servers\r\n'
+            'AT*TW=c,r/?    - Window size sent to telnet servers\r\n'
+            'AT*B<bps>/?    - Line rate in bits/s, 0 for unlimited\r\n'
+            'AT*P0/1        - Prewarm favorite entries off/on\r\n'
+            'AT*F<n>=0/1    - Unmark/mark entry n as favorite\r\n'
+            'AT*Z0/1/?      - Link compression with a meowdem off/on/query\r\n'
+            'AT*C<n>/?      - Character set: 0 ASCII, 1 PETSCII, 2 ATASCII, 3 ASCII CRLF\r\n'
             'AT?            - This help\r\n'
         )
         self.client_out_str(help_text)
@@ -367,26 +2171,23 @@ class HayesATParser:
         address = address.strip()
         if not address:
             # Remove entry if address is empty
-            if key in self.phonebook:
-                del self.phonebook[key]
+            favorite = self.phonebook.is_favorite(key)
+            if self.phonebook.delete(key):
                 self.client_out_str('DELETED\r\n')
+                if favorite and self.prewarm_enabled:
+                    self._update_prewarm()
             else:
                 self.client_out_str('NOT SET\r\n')
             return
-        # Accept host or host:port
-        if ':' in address:
-            host, port = self._parse_address(address)
-            if host is None:
-                self.client_out_str('ERROR: INVALID ADDRESS. USE THE FORM <HOST>[:<PORT>]\r\n')
-                return
-            self.phonebook[key] = (host, port)
-        else:
-            # Only host provided, store with default port 23
-            host = address
-            if not host:
-                self.client_out_str('ERROR: INVALID ADDRESS. USE THE FORM <HOST>[:<PORT>]\r\n')
-                return
-            self.phonebook[key] = (host, None)
+        # Accept host or host:port; without a port the entry dials the default port 23
+        match = PHONEBOOK_ADDRESS.fullmatch(address)
+        port = int(match.group('port')) if match and match.group('port') else None
+        if match is None or port is not None and not 0 < port < 65536:
+            self.client_out_str('ERROR: INVALID ADDRESS. USE THE FORM <HOST>[:<PORT>]\r\n')
+            return
+        self.phonebook.set(key, match.group('host'), port)
+        if self.prewarm_enabled and self.phonebook.is_favorite(key):
+            self._update_prewarm()
 
     # Add handler for AT&Z<n>? query
     def handle_AT_amp_Z_query(self, entry_num: str) -> None:
@@ -429,27 +2230,158 @@ class HayesATParser:
     async def _handle_socket_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
         """ Coroutine to read from the socket and send raw data back via client_out. """
         self.writer = writer  # Set the writer when the connection is open
+        configure_keepalive(writer.get_extra_info('socket'))
+        inactivity_timeout = self.s_registers[S_INACTIVITY] * INACTIVITY_UNIT
+        if inactivity_timeout:
+            self.inactivity_timer = InactivityTimer(inactivity_timeout, self._inactivity_expired)
+        negotiator = TelnetNegotiator(terminal_type=self.terminal_type, window_size=self.window_size)
+        self.telnet_translator = TelnetTranslator(negotiator)
+        self.link_codec = None
+        codec: Optional[LinkCodec] = None
         try:
+            data = await self._negotiate_link(reader, writer) if self.link_compression else b''
+            codec = self.link_codec
+            if self.telnet_translation_enabled:
+                # Offer the usual client options up front instead of waiting for the server to ask
+                negotiator.offer()
+                self._write_remote(writer, negotiator.take_replies())
+            if data:
+                await self._forward_remote_data(data, writer)
             while True:
-                data = await reader.read(1024)  # Read up to 1024 bytes
+                # Nothing more is read until the client has absorbed the previous chunk, so the
+                # remote host is held back by TCP flow control and memory per session stays bounded
+                data = await reader.read(REMOTE_READ_SIZE)
                 if not data:
                     break  # Connection closed
-
-                if self.telnet_translation_enabled:
-                    translated = self.telnet_translator.input_translation(data)
-                    self.client_out_cb(translated)
-                else:
-                    self.client_out_cb(data)  # Output data in latin1 encoding
+                await self._forward_remote_data(data, writer)
+        except ConnectionError as e:
+            self.log.info(f'Connection lost: {e}')
         except Exception as e:
-            logging.error(f"Exception in _handle_socket_connection: {e}", exc_info=True)
+            self.log.error(f"Exception in _handle_socket_connection: {e}", exc_info=True)
             pass
         finally:
-            writer.close()
-            await writer.wait_closed()
-            self.writer = None  # Reset the writer when the connection is closed
+            if self.link_codec is codec:
+                self.link_codec = None  # Release the compression buffers unless a newer connection uses them
+            if self.writer is writer:
+                # Closed by the remote host rather than hung up here
+                self.writer = None
+                self._cancel_inactivity_timer()
+                self._end_transfer()
+                if self.mode == ParserMode.DATA:
+                    self._cancel_escape_timer()
+                    self.mode = ParserMode.COMMAND
+                    self.client_out_str('NO CARRIER\r\n')
+            await close_writer(writer)
+
+    async def _negotiate_link(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bytes:
+        """ Offer link compression and enable it if the far side accepts within LINK_HELLO_TIMEOUT.
+        :param reader: StreamReader of the new remote connection.
+        :param writer: StreamWriter of the new remote connection.
+        :return: Data the far side sent with or instead of its answer, still to be forwarded.
+        """
+        writer.write(LINK_HELLO)
+        try:
+            data = await asyncio.wait_for(reader.read(REMOTE_READ_SIZE), LINK_HELLO_TIMEOUT)
+        except asyncio.TimeoutError:
+            return b''
+        if data.startswith(LINK_ACCEPT):
+            self.link_codec = LinkCodec()
+            self.log.info('Link compression enabled')
+            return data[len(LINK_ACCEPT):]
+        if data.startswith(LINK_REFUSE):
+            return data[len(LINK_REFUSE):]
+        return data
+
+    def _write_remote(self, writer: asyncio.StreamWriter, data: bytes) -> None:
+        """ Write protocol data, such as telnet replies, to the remote host. """
+        if self.capture is not None:
+            self.capture.record(CAPTURE_REMOTE_OUT, data)
+        if self.link_codec is not None:
+            data = self.link_codec.compress(data)
+        writer.write(data)
+
+    async def _forward_remote_data(self, data: bytes, writer: asyncio.StreamWriter) -> None:
+        """ Decode a chunk read from the remote host and pass it to the client, waiting while the client is behind.
+        :param data: Bytes read from the remote host.
+        :param writer: StreamWriter of the remote connection, for telnet negotiation replies.
+        :return: None
+        """
+        metrics = self.metrics
+        metrics.bytes_from_remote += len(data)
+        if self.link_codec is not None:
+            data = self.link_codec.decompress(data)
+            if not data:
+                return  # Only part of a compressed block arrived
+        if self.capture is not None:
+            self.capture.record(CAPTURE_REMOTE_IN, data)
+        if self.telnet_translation_enabled:
+            translator = self.telnet_translator
+            data = translator.input_translation(data)
+            self._collect_iac_count(translator)
+            if translator.negotiator.replies:
+                self._write_remote(writer, translator.negotiator.take_replies())
+        transfer = self.transfer
+        if transfer is None:
+            protocol = detect_transfer(data)
+            if protocol is not None:
+                transfer = self._start_transfer(protocol)
+        if transfer is not None:
+            if transfer.update(data, False):
+                self._end_transfer()
+        elif self.charset_translator is not None:
+            data = self.charset_translator.output_translation(data)
+        metrics.bytes_to_client += len(data)
+        if self.pacer is not None:
+            await self.pacer.pace(data, self.client_out_cb)
+        else:
+            self.client_out_cb(data)  # Output data in latin1 encoding
+        if self.client_buffer_size_cb is not None:
+            buffered = self.client_buffer_size_cb()
+            if buffered > metrics.client_buffer_high_water:
+                metrics.client_buffer_high_water = buffered
+        if self.client_drain_cb is not None:
+            await self.client_drain_cb()
+        if self.inactivity_timer is not None:
+            self.inactivity_timer.touch()
+
+    def _inactivity_expired(self) -> None:
+        """ Timer callback hanging up a connection without data in either direction for S30 tens of seconds. """
+        self.inactivity_timer = None
+        self.log.info('Hanging up inactive connection')
+        self._cancel_escape_timer()
+        self.handle_ATH()
+
+    async def open_remote(self, host: str, port: int) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        """ Open the connection for ATD, taking a standby connection if one is ready.
+        :param host: Host name or address to connect to.
+        :param port: TCP port to connect to.
+        :return: Tuple of the connection's StreamReader and StreamWriter.
+        """
+        standby = prewarmer.take(host, port)
+        if standby is not None:
+            return standby
+        timeout = self.s_registers[S_CARRIER_WAIT] or DEFAULT_CONNECTION_TIMEOUT
+        started = time.monotonic()
+        connection = await dial(host, port, timeout)
+        self.metrics.dial_latency = time.monotonic() - started
+        process_metrics.dial_latency.observe(self.metrics.dial_latency)
+        return connection
 
     def handle_ATD(self, number: str):
-        host, port = HayesATParser._parse_address(number)
+        """ Handler for ATD<addr>: dial a phonebook key or host[:port]. ATDS=<key> also accepts a unique key prefix,
+        which plain ATD does not, so a literal host name is never taken for a longer key starting with it. """
+        number = number.strip()
+        if number.startswith('S='):
+            entry = self.phonebook.lookup(number[2:])
+            if entry is None:
+                self.client_out_str('NOT SET\r\n')
+                return
+        else:
+            entry = self.phonebook.get(number)
+        if entry is not None:
+            host, port = entry[0], entry[1] or DEFAULT_TELNET_PORT
+        else:
+            host, port = HayesATParser._parse_address(number)
 
         if host is None:
             self.client_out_str('INVALID ADDRESS. USE THE FORM <HOSTNAME>:<PORT>\r\n')
@@ -457,16 +2389,24 @@ class HayesATParser:
 
         self.client_out_str(f"DIALING {host}:{port}...\r\n")
         self.mode = ParserMode.DIALING  # Set mode to DIALING
+        metrics = self.metrics
+        metrics.dial_attempts += 1
+        dial_started = time.monotonic()
 
         async def connect():
             try:
-                reader, writer = await asyncio.wait_for(
-                    asyncio.open_connection(host, port), timeout=DEFAULT_CONNECTION_TIMEOUT
-                )
+                reader, writer = await self.open_remote(host, port)
+                metrics.connect_time = time.monotonic() - dial_started
+                process_metrics.connect_time.observe(metrics.connect_time)
+                self.log.extra['remote'] = f'{host}:{port}'
+                self.log.info(f'Connected in {metrics.connect_time:.3f}s')
                 self.client_out_str('CONNECTED\r\n')
                 self.mode = ParserMode.DATA
                 await self._handle_socket_connection(reader, writer)
             except Exception as e:
+                if self.mode == ParserMode.DIALING:
+                    metrics.dial_failures += 1
+                    self.log.info(f'Dialing {host}:{port} failed: {e}')
                 self.client_out_str('NO CARRIER\r\n')
                 self.writer = None  # Ensure writer is reset on error
                 self.mode = ParserMode.COMMAND
@@ -474,6 +2414,158 @@ class HayesATParser:
         self.dialing_task = asyncio.create_task(connect())
 
 
+#### Capture Replay ####
+
+class ReplayWriter:
+    """ Stands in for the remote connection's StreamWriter during a replay, discarding what is written. """
+    def __init__(self) -> None:
+        self.transport = self
+        self.closing = False
+
+    def write(self, data: bytes) -> None:
+        pass
+
+    async def drain(self) -> None:
+        pass
+
+    def get_write_buffer_size(self) -> int:
+        return 0
+
+    def get_extra_info(self, name: str, default: object = None) -> object:
+        return default
+
+    def is_closing(self) -> bool:
+        return self.closing
+
+    def close(self) -> None:
+        self.closing = True
+
+    async def wait_closed(self) -> None:
+        pass
+
+
+class ReplayParser(HayesATParser):
+    """
+    Parser fed from a capture. Dialing connects at once to a stand-in remote host whose
+    data is delivered from the capture's REMOTE_IN records by feed_remote(), through the
+    same telnet decoding and client output path as a live connection. Phonebook keys dial
+    what the given phonebook holds, so replay with the phonebook the capture was made with.
+    """
+    def __init__(self, client_output_cb: Callable[[bytes], None], pace: bool = False,
+                 phonebook: Optional[Phonebook] = None):
+        super().__init__(client_output_cb, phonebook=phonebook if phonebook is not None else Phonebook())
+        self.pace = pace  # Honour AT*B line rates; off to replay as fast as possible
+        self.remote_reader: Optional[asyncio.StreamReader] = None
+
+    async def open_remote(self, host: str, port: int) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        self.remote_reader = asyncio.StreamReader()  # Never fed, so the socket reader just waits
+        return self.remote_reader, ReplayWriter()  # type: ignore
+
+    def handle_AT_star_B(self, value: str) -> None:
+        if self.pace or value == '?':
+            super().handle_AT_star_B(value)
+
+    async def _negotiate_link(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bytes:
+        # The capture holds remote data after link negotiation and decompression, so there is nothing to wait for
+        return b''
+
+    async def feed_remote(self, data: bytes) -> None:
+        """ Deliver data as if read from the remote host, once the replayed dial has connected. """
+        while self.mode == ParserMode.DIALING:
+            await asyncio.sleep(0)
+        if self.writer is not None:
+            await self._forward_remote_data(data, self.writer)
+
+    def close(self) -> None:
+        if self.remote_reader is not None:
+            self.remote_reader.feed_eof()
+        super().close()
+
+
+async def replay_capture(path: str, realtime: bool = False, phonebook: Optional[Phonebook] = None) -> Dict[str, object]:
+    """
+    Feed a capture back through a ReplayParser and compare its client output with the captured one.
+
+    :param path: Path of the capture file.
+    :param realtime: Keep the captured timing. Otherwise records are fed as fast as possible,
+        skipping ahead over escape guard times the capture waited out.
+    :param phonebook: Phonebook the captured session dialed keys from, empty if omitted.
+    :return: Statistics of the replay.
+    """
+    output = bytearray()
+    expected = bytearray()
+    parser = ReplayParser(output.extend, pace=realtime, phonebook=phonebook)
+    loop = asyncio.get_running_loop()
+    client_bytes = remote_bytes = records = 0
+    previous = 0.0
+    started = loop.time()
+    for timestamp, direction, data in read_capture(path):
+        records += 1
+        if realtime:
+            delay = started + timestamp - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        elif parser.escape_timer is not None and timestamp - previous >= parser.s_registers[S_GUARD_TIME] / 50:
+            parser._cancel_escape_timer()
+            parser._escape_guard_expired()
+        previous = timestamp
+
+        if direction == CAPTURE_CLIENT_IN:
+            client_bytes += len(data)
+            parser.receive(data)
+            await asyncio.sleep(0)  # Let a replayed dial connect
+        elif direction == CAPTURE_REMOTE_IN:
+            remote_bytes += len(data)
+            await parser.feed_remote(data)
+        elif direction == CAPTURE_CLIENT_OUT:
+            expected += data
+    elapsed = loop.time() - started
+    parser.close()
+    await asyncio.sleep(0)
+    return {
+        'records': records,
+        'client_bytes': client_bytes,
+        'remote_bytes': remote_bytes,
+        'seconds': round(elapsed, 6),
+        'megabytes_per_second': round((client_bytes + remote_bytes) / elapsed / 1e6, 3) if elapsed else None,
+        'output_matches': output == expected,
+    }
+
+
+#### Startup Profile ####
+
+class StartupProfile:
+    """
+    Times the phases of a cold start for --startup-profile: importing this module, setting
+    up and the first response to a client, which is when the profile is written to stderr.
+    Starting the interpreter and compiling the module come before and are not included.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()  # Command line parsed and event loop running
+        self.reported = False
+
+    def first_response_cb(self, client_output_cb: Callable[[bytes], None]) -> Callable[[bytes], None]:
+        """ Wrap a session's client output callback to report the profile when any session first responds. """
+        def report_first_response(data: bytes) -> None:
+            client_output_cb(data)
+            if not self.reported:
+                self.reported = True
+                print(self.report(time.perf_counter()), file=sys.stderr, flush=True)
+        return report_first_response
+
+    def report(self, first_response: float) -> str:
+        def ms(seconds: float) -> str:
+            return f'{seconds * 1000:.1f}ms'
+
+        return (f'Startup profile: import {ms(IMPORT_FINISHED - IMPORT_STARTED)}, '
+                f'setup {ms(self.started - IMPORT_FINISHED)}, '
+                f'first response {ms(first_response - IMPORT_STARTED)} after import started')
+
+
+# Set by main() when started with --startup-profile
+startup_profile: Optional[StartupProfile] = None
+
+
 #### Main ####
 
 async def handle_tcp_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
@@ -482,29 +2574,117 @@ async def handle_tcp_client(reader: asyncio.StreamReader, writer: asyncio.Stream
     :param writer: StreamWriter for the client.
     :return: None
     """
-    def tcp_client_out(data: bytes) -> None:
-        """ Output function for HayesATParser to send data to TCP client. 
-        :param data: Data to send.
-        :return: None
-        """
-        writer.write(data)
-        # Schedule drain asynchronously
-        asyncio.create_task(writer.drain())
+    if max_tcp_sessions and len(tcp_sessions) >= max_tcp_sessions:
+        logger.warning(f'Rejecting client, {len(tcp_sessions)} sessions are open')
+        writer.write(b'BUSY\r\n')
+        await close_writer(writer)
+        return
+
+    session = asyncio.current_task()
+    configure_keepalive(writer.get_extra_info('socket'))
+
+    # Data from the remote host is written to the client without waiting; the parser awaits
+    # drain() after each chunk so the remote host is paused once the client falls behind
+    writer.transport.set_write_buffer_limits(high=CLIENT_HIGH_WATER, low=CLIENT_LOW_WATER)
+    # Set when the client is another meowdem offering link compression
+    codec: Optional[LinkCodec] = None
+
+    def client_write(data: bytes) -> None:
+        writer.write(data if codec is None else codec.compress(data))
+
+    def hang_up() -> None:
+        # The read below sees the end of the stream and the session cleans up as usual
+        client_write(b'NO CARRIER\r\n')
+        writer.close()
 
-    logging.info('Connection is connected')
+    tcp_sessions[session] = hang_up
+    parser = HayesATParser(client_write, writer.drain, client_buffer_size_cb=writer.transport.get_write_buffer_size)
+    peer = writer.get_extra_info('peername')
+    parser.log.extra['client'] = f'{peer[0]}:{peer[1]}' if peer else None
+    parser.log.info('Client connected')
+
+    idle_timer: Optional[InactivityTimer] = None
+    if tcp_idle_timeout:
+        def disconnect_idle_client() -> None:
+            if parser.mode != ParserMode.COMMAND:
+                # Only sessions waiting at the command prompt are reaped, S30 covers open connections
+                idle_timer.touch()
+                idle_timer.start()
+                return
+            parser.log.info('Disconnecting idle client')
+            hang_up()
 
-    parser = HayesATParser(tcp_client_out)
+        idle_timer = InactivityTimer(tcp_idle_timeout, disconnect_idle_client)
+    first_chunk = True
     try:
         while True:
             data = await reader.read(1024)
             if not data:
                 break
-            parser.receive(data)
+            if idle_timer is not None:
+                idle_timer.touch()
+            if codec is not None:
+                data = codec.decompress(data)
+            elif first_chunk and data.startswith(LINK_HELLO):
+                writer.write(LINK_ACCEPT)
+                codec = LinkCodec()
+                parser.log.info('Link compression enabled')
+                data = codec.decompress(data[len(LINK_HELLO):])
+            first_chunk = False
+            if data:
+                parser.receive(data)
+            await parser.drain()
     except Exception:
         pass
     finally:
-        writer.close()
-        await writer.wait_closed()
+        tcp_sessions.pop(session, None)
+        if idle_timer is not None:
+            idle_timer.cancel()
+        parser.close()
+        await close_writer(writer)
+
+
+def is_pollable(fd: int) -> bool:
+    """ Check whether the event loop can watch a file descriptor. Regular files and some
+    character devices, such as /dev/null, cannot be registered with epoll.
+    :param fd: File descriptor to check.
+    :return: True if the descriptor can be registered with a selector.
+    """
+    try:
+        with selectors.DefaultSelector() as selector:
+            selector.register(fd, selectors.EVENT_READ)
+        return True
+    except (ValueError, OSError):
+        return False
+
+
+async def connect_stdio_pipes() -> Tuple[Optional[asyncio.StreamReader], Optional[asyncio.StreamWriter]]:
+    """ Register stdin and stdout with the event loop as non-blocking pipe transports.
+    Regular files and devices like /dev/null cannot be watched by the event loop, so either stream may fall back to None.
+    Terminals fall back too: O_NONBLOCK would be set on the terminal shared with the shell and other processes.
+    The transports get duplicated descriptors, so stdin and stdout stay open when they close.
+    :return: Tuple of the stdin StreamReader and the stdout StreamWriter, None where unsupported.
+    """
+    loop = asyncio.get_running_loop()
+    reader: Optional[asyncio.StreamReader] = asyncio.StreamReader(limit=STDIO_CHUNK_SIZE)
+    try:
+        if os.isatty(sys.stdin.fileno()) or not is_pollable(sys.stdin.fileno()):
+            raise ValueError('stdin cannot be polled')
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader),
+                                     open(os.dup(sys.stdin.fileno()), 'rb', buffering=0))
+    except (ValueError, OSError):
+        reader = None
+
+    writer: Optional[asyncio.StreamWriter] = None
+    try:
+        if os.isatty(sys.stdout.fileno()) or not is_pollable(sys.stdout.fileno()):
+            raise ValueError('stdout cannot be polled')
+        transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin,
+                                                            open(os.dup(sys.stdout.fileno()), 'wb', buffering=0))
+        writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+    except (ValueError, OSError):
+        pass
+    return reader, writer
 
 
 def stdio_client_task() -> asyncio.Task:
@@ -512,19 +2692,49 @@ def stdio_client_task() -> asyncio.Task:
     :return: The asyncio Task handling stdin.
     """
     def send_to_stdout(data: bytes) -> None:
+        """ Blocking fallback used when stdout is a regular file. """
         sys.stdout.buffer.write(data)
         sys.stdout.buffer.flush()
 
-    async def read_from_stdin(parser: HayesATParser) -> None:
+    async def read_from_stdin() -> None:
         loop = asyncio.get_running_loop()
-        while True:
-            data = await loop.run_in_executor(None, sys.stdin.buffer.read, 1)
-            if not data:
-                break
-            parser.receive(data)
+        # The pipe transports leave O_NONBLOCK set on descriptions that may be shared with other processes
+        blocking = {fd: os.get_blocking(fd) for fd in (sys.stdin.fileno(), sys.stdout.fileno())}
+        writer: Optional[asyncio.StreamWriter] = None
+        try:
+            reader, writer = await connect_stdio_pipes()
+            await stdio_session(loop, reader, writer)
+        finally:
+            if writer is not None:
+                # Closes the duplicated stdout descriptor once buffered output is written, from a callback
+                writer.close()
+                await asyncio.sleep(0)
+            for fd, was_blocking in blocking.items():
+                os.set_blocking(fd, was_blocking)
+
+    async def stdio_session(loop: asyncio.AbstractEventLoop, reader: Optional[asyncio.StreamReader],
+                            writer: Optional[asyncio.StreamWriter]) -> None:
+        if writer is not None:
+            writer.transport.set_write_buffer_limits(high=CLIENT_HIGH_WATER, low=CLIENT_LOW_WATER)
+            parser = HayesATParser(writer.write, writer.drain, client_buffer_size_cb=writer.transport.get_write_buffer_size)
+        else:
+            parser = HayesATParser(send_to_stdout)
+        try:
+            while True:
+                if reader is not None:
+                    data = await reader.read(STDIO_CHUNK_SIZE)
+                else:
+                    data = await loop.run_in_executor(None, sys.stdin.buffer.read1, STDIO_CHUNK_SIZE)
+                if not data:
+                    break
+                parser.receive(data)
+                await parser.drain()
+                if writer is not None:
+                    await writer.drain()
+        finally:
+            parser.close()
 
-    parser = HayesATParser(send_to_stdout)
-    return asyncio.create_task(read_from_stdin(parser))
+    return asyncio.create_task(read_from_stdin())
 
 
 def tcp_client_task(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> asyncio.Task:
@@ -536,12 +2746,167 @@ def tcp_client_task(reader: asyncio.StreamReader, writer: asyncio.StreamWriter)
     return asyncio.create_task(handle_tcp_client(reader, writer))
 
 
-def start_serial_client(serial_port_path: str, baudrate: int = 9600) -> None:
-    """ Start the serial port processing and add to event loop 
-    :param serial_port_path: Path to the serial port device (e.g., /dev/ttyS0).
+class SerialTransport:
+    """ Non-blocking transport for a serial port file descriptor registered with the event loop.
+    Queued writes are coalesced into large os.write() calls and partial writes advance an offset
+    instead of copying the remainder. Once more than high_water bytes are queued, drain() blocks
+    until the queue is back under low_water, which lets the remote host's reader pause while the
+    UART catches up.
+    """
+    def __init__(self, serial_fd: int, data_received_cb: Callable[[bytes], None],
+                 high_water: int = SERIAL_HIGH_WATER, low_water: int = SERIAL_LOW_WATER,
+                 connection_lost_cb: Optional[Callable[[], None]] = None) -> None:
+        self.fd = serial_fd
+        self.loop = asyncio.get_running_loop()
+        self.data_received_cb = data_received_cb
+        self.connection_lost_cb = connection_lost_cb  # Called once when the port is closed
+        self.high_water = high_water
+        self.low_water = low_water
+
+        self.write_buffer: collections.deque = collections.deque()
+        self.write_offset = 0  # Bytes of write_buffer[0] already written
+        self.buffer_size = 0  # Total bytes queued but not yet written
+        self.writing = False  # True while a writer callback is registered
+        self.reading = False
+        self.write_ready = asyncio.Event()
+        self.write_ready.set()
+        self.closed = asyncio.Event()
+
+    def resume_reading(self) -> None:
+        """ Start delivering data read from the serial port to data_received_cb. """
+        if not self.reading and self.fd >= 0:
+            self.loop.add_reader(self.fd, self._on_readable)
+            self.reading = True
+
+    def pause_reading(self) -> None:
+        """ Stop reading from the serial port until resume_reading() is called. """
+        if self.reading:
+            self.loop.remove_reader(self.fd)
+            self.reading = False
+
+    def get_write_buffer_size(self) -> int:
+        """ :return: Number of bytes queued for the serial port. """
+        return self.buffer_size
+
+    def write(self, data: bytes) -> None:
+        """ Queue data for the serial port, writing straight away when nothing is pending.
+        :param data: Bytes to send.
+        :return: None
+        """
+        if not data or self.fd < 0:
+            return
+        written = 0
+        if not self.write_buffer:
+            try:
+                written = os.write(self.fd, data)
+            except (BlockingIOError, InterruptedError):
+                pass
+            except OSError as e:
+                self._fatal_error(e)
+                return
+            if written == len(data):
+                return
+
+        self.write_buffer.append(data)
+        if written:
+            self.write_offset = written  # Only possible when data is the sole queued chunk
+        self.buffer_size += len(data) - written
+        if self.buffer_size > self.high_water:
+            self.write_ready.clear()
+        if not self.writing:
+            self.loop.add_writer(self.fd, self._on_writable)
+            self.writing = True
+
+    async def drain(self) -> None:
+        """ Wait until the write queue is below the low-water mark if it went over the high-water mark. """
+        await self.write_ready.wait()
+
+    def _coalesce(self) -> None:
+        """ Join the unwritten part of the head chunk with following small chunks into a single chunk. """
+        buffer = self.write_buffer
+        parts = [memoryview(buffer.popleft())[self.write_offset:]]
+        size = len(parts[0])
+        self.write_offset = 0
+        while buffer and size + len(buffer[0]) <= SERIAL_WRITE_SIZE:
+            chunk = buffer.popleft()
+            parts.append(chunk)
+            size += len(chunk)
+        buffer.appendleft(b''.join(parts))
+
+    def _on_writable(self) -> None:
+        """ Called by the event loop when the serial port can accept more data. """
+        buffer = self.write_buffer
+        while buffer:
+            if len(buffer) > 1 and len(buffer[0]) - self.write_offset < SERIAL_WRITE_SIZE:
+                self._coalesce()
+            head = buffer[0]
+            try:
+                written = os.write(self.fd, memoryview(head)[self.write_offset:])
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                self._fatal_error(e)
+                return
+            self.write_offset += written
+            self.buffer_size -= written
+            if self.write_offset < len(head):
+                break  # The UART is full, wait for the next writeable event
+            buffer.popleft()
+            self.write_offset = 0
+
+        if not buffer:
+            self.loop.remove_writer(self.fd)
+            self.writing = False
+        if self.buffer_size <= self.low_water:
+            self.write_ready.set()
+
+    def _on_readable(self) -> None:
+        """ Called by the event loop when data is waiting on the serial port. """
+        try:
+            data = os.read(self.fd, SERIAL_READ_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            self._fatal_error(e)
+            return
+        if not data:
+            logger.warning('Serial port hung up')
+            self.close()
+            return
+        self.data_received_cb(data)
+
+    def _fatal_error(self, error: OSError) -> None:
+        logger.error(f'Serial port error: {error}')
+        self.close()
+
+    def close(self) -> None:
+        """ Unregister the serial port from the event loop, drop queued data and close the descriptor. """
+        if self.fd < 0:
+            return
+        self.pause_reading()
+        if self.writing:
+            self.loop.remove_writer(self.fd)
+            self.writing = False
+        self.write_buffer.clear()
+        self.buffer_size = 0
+        self.write_ready.set()
+        os.close(self.fd)
+        self.fd = -1
+        self.closed.set()
+        if self.connection_lost_cb is not None:
+            self.connection_lost_cb()
+
+    async def wait_closed(self) -> None:
+        """ Wait until the port was closed, by close() or because it hung up or failed. """
+        await self.closed.wait()
+
+
+def configure_serial_port(serial_fd: int, baudrate: int) -> None:
+    """ Put a serial port into raw 8N1 mode at the given baud rate with hardware flow control.
+    :param serial_fd: File descriptor of the open serial port.
     :param baudrate: Baud rate for the serial port.
     """
-    serial_fd = os.open(serial_port_path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+    import fcntl, termios, tty
     # Set serial port to raw mode and baud rate
     attrs = termios.tcgetattr(serial_fd)
     tty.setraw(serial_fd)
@@ -606,60 +2971,233 @@ def start_serial_client(serial_port_path: str, baudrate: int = 9600) -> None:
 
     # Set CTS modem bit high after enabling hardware flow control
     if hasattr(termios, 'TIOCM_CTS') and hasattr(termios, 'TIOCMBIS'):
-        fcntl.ioctl(serial_fd, termios.TIOCMBIS, struct.pack('I', termios.TIOCM_CTS))
+        try:
+            fcntl.ioctl(serial_fd, termios.TIOCMBIS, struct.pack('I', termios.TIOCM_CTS))
+        except OSError:
+            pass  # Ports without modem control lines, such as ptys
+
+
+def start_serial_client(serial_port_path: str, baudrate: int = 9600) -> SerialTransport:
+    """ Start the serial port processing and add to event loop 
+    :param serial_port_path: Path to the serial port device (e.g., /dev/ttyS0).
+    :param baudrate: Baud rate for the serial port.
+    :return: The SerialTransport serving the port.
+    """
+    serial_fd = os.open(serial_port_path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+    try:
+        configure_serial_port(serial_fd, baudrate)
+    except BaseException:
+        os.close(serial_fd)
+        raise
+
+    parser: Optional[HayesATParser] = None
+    drain_tasks: set = set()  # Pending resume_after_drain() tasks, referenced until done so they are not collected
+
+    def read_from_serial(data: bytes) -> None:
+        parser.receive(data)
+        # Stop reading from the serial port while the remote host is not keeping up
+        writer = parser.writer
+        if writer is not None and writer.transport.get_write_buffer_size() > transport.high_water:
+            transport.pause_reading()
+            task = asyncio.create_task(resume_after_drain())
+            drain_tasks.add(task)
+            task.add_done_callback(drain_tasks.discard)
+
+    async def resume_after_drain() -> None:
+        await parser.drain()
+        transport.resume_reading()
+
+    # Losing the port hangs up the session's connection, as dropping DTR would
+    transport = SerialTransport(serial_fd, read_from_serial, connection_lost_cb=lambda: parser.close())
+    parser = HayesATParser(transport.write, transport.drain, client_buffer_size_cb=transport.get_write_buffer_size)
+    parser.log.extra['client'] = serial_port_path
+    transport.resume_reading()
+    return transport
+
+
+def parse_serial_port(spec: str, default_baud: int) -> Tuple[str, int]:
+    """ Split a device[:baud] serial port argument.
+    :param spec: Device path, optionally followed by a colon and the baud rate, e.g. /dev/ttyUSB0:19200.
+    :param default_baud: Baud rate used when spec has none.
+    :return: Tuple of the device path and the baud rate.
+    """
+    device, _, baud = spec.rpartition(':')
+    if device and baud.isdigit():
+        return device, int(baud)
+    return spec, default_baud
 
-    # Buffer for outgoing data
-    loop = asyncio.get_running_loop()
-    write_buffer = collections.deque()
 
-    def on_serial_writeable() -> None:
-        """ Called by event loop when serial_fd is writeable. """
-        logging.info('Serial port is writable')
+async def serve_serial_port(serial_port_path: str, baudrate: int) -> None:
+    """ Serve a serial port until cancelled, reopening it whenever it cannot be opened, fails or goes away,
+    such as an unplugged USB adapter. Each port is served by its own task, so errors never affect other ports.
+    :param serial_port_path: Path to the serial port device.
+    :param baudrate: Baud rate for the serial port.
+    :return: None
+    """
+    import termios
+    while True:
         try:
-            while write_buffer:
-                data = write_buffer[0]
-                try:
-                    written = os.write(serial_fd, data)
-                    if written < len(data):
-                        # Not all data written, keep the rest
-                        write_buffer[0] = data[written:]
-                        break
-                    else:
-                        write_buffer.popleft()
-                except BlockingIOError:
-                    break
-                except OSError as e:
-                    logging.error(f'Error writing to serial port: {e}')
-                    break
-            if not write_buffer:
-                loop.remove_writer(serial_fd)
+            transport = start_serial_client(serial_port_path, baudrate)
+        except (OSError, termios.error) as e:
+            logger.warning(f'Cannot open serial port {serial_port_path}: {e}')
         except Exception as e:
-            logging.error(f'Exception in on_serial_writeable: {e}')
+            # Retried like any other failure, so one bad port never stops the others or the TCP server
+            logger.error(f'Error opening serial port {serial_port_path}: {e}', exc_info=True)
+        else:
+            logger.info(f'Serving serial port {serial_port_path} at {baudrate} baud')
+            try:
+                await transport.wait_closed()
+            finally:
+                transport.close()
+            logger.warning(f'Serial port {serial_port_path} closed, reopening')
+        await asyncio.sleep(SERIAL_RECONNECT_DELAY)
 
-    def send_to_serial(data: bytes) -> None:
-        """ Buffer data to be sent to serial port when ready. """
-        write_buffer.append(data)
 
-    loop.add_writer(serial_fd, on_serial_writeable)
-    parser = HayesATParser(send_to_serial)
+# Tasks of the TCP client sessions currently open in this process, with a callable hanging each one up
+tcp_sessions: Dict[asyncio.Task, Callable[[], None]] = {}
+# Limits for TCP client sessions, set from the command line
+max_tcp_sessions: int = 0  # Clients arriving while this many sessions are open are answered BUSY, 0 for no limit
+tcp_idle_timeout: float = 0.0  # Seconds a client may stay idle in COMMAND mode before it is disconnected, 0 for never
 
-    def read_from_serial() -> None:
-        logging.info('Reading from serial port')
-        try:
-            data = os.read(serial_fd, 1024)
-            if not data:
-                return
-            parser.receive(data)
-        except OSError as e:
-            logging.error(f'Error reading from serial port: {e}')
 
-    loop.add_reader(serial_fd, read_from_serial)
+async def serve_tcp_clients(port: int, reuse_port: bool = False) -> None:
+    """ Accept TCP clients until SIGTERM, then stop listening and give open sessions time to finish.
+    :param port: Port to listen on.
+    :param reuse_port: Bind with SO_REUSEPORT so several worker processes can share the port.
+    :return: None
+    """
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+    if reuse_port:
+        # Ctrl-C reaches every worker in the process group, so drain on SIGINT too
+        loop.add_signal_handler(signal.SIGINT, stop.set)
+
+    try:
+        server = await asyncio.start_server(handle_tcp_client, '0.0.0.0', port, reuse_port=reuse_port)
+        await stop.wait()
+        # Not wait_closed(), which also waits for every open connection since Python 3.12.1
+        server.close()
+        logger.info(f'Stopped listening, waiting for {len(tcp_sessions)} session(s) to end')
+        if tcp_sessions:
+            await asyncio.wait(list(tcp_sessions), timeout=SESSION_DRAIN_TIMEOUT)
+        if tcp_sessions:
+            logger.info(f'Hanging up {len(tcp_sessions)} session(s)')
+            sessions = list(tcp_sessions)
+            for hang_up in list(tcp_sessions.values()):
+                hang_up()
+            _, stuck = await asyncio.wait(sessions, timeout=SESSION_HANGUP_TIMEOUT)
+            # Clients that stopped reading cannot take their NO CARRIER, drop them
+            for session in stuck:
+                session.cancel()
+            if stuck:
+                await asyncio.wait(stuck)
+    finally:
+        loop.remove_signal_handler(signal.SIGTERM)
+        if reuse_port:
+            loop.remove_signal_handler(signal.SIGINT)
+
+
+async def handle_metrics_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """ Answer a single HTTP request with the process metrics in the Prometheus text format.
+    :param reader: StreamReader for the HTTP client.
+    :param writer: StreamWriter for the HTTP client.
+    :return: None
+    """
+    try:
+        request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout=10)
+        path = request.split(b' ', 2)[1] if request.count(b' ') >= 2 else b''
+        if path in (b'/', b'/metrics'):
+            status, body = '200 OK', process_metrics.render().encode('ascii')
+        else:
+            status, body = '404 Not Found', b'Not Found\n'
+        writer.write(
+            f'HTTP/1.0 {status}\r\n'
+            f'Content-Type: text/plain; version=0.0.4\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            f'Connection: close\r\n\r\n'.encode('ascii') + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
 
+async def serve_metrics(port: int) -> asyncio.AbstractServer:
+    """ Serve the process metrics over HTTP and start sampling the event loop lag.
+    :param port: Port to listen on.
+    :return: The metrics server.
+    """
+    server = await asyncio.start_server(handle_metrics_request, '0.0.0.0', port)
+    metrics_tasks.add(asyncio.create_task(process_metrics.sample_loop_lag()))
+    logger.info(f'Serving metrics on port {port}')
+    return server
 
-async def main() -> None:
-    """ Main entry point: handles both stdin and TCP connections. 
+
+# Background tasks kept alive while metrics are served
+metrics_tasks: set = set()
+
+
+def run_workers(args: 'argparse.Namespace') -> None:
+    """ Fork args.workers processes that share the TCP port through SO_REUSEPORT and supervise them.
+    Workers that exit unexpectedly are restarted. SIGTERM or SIGINT is passed on to the workers,
+    which stop accepting clients and let open sessions finish before exiting.
+    :param args: Parsed command line arguments.
     :return: None
     """
+    workers: Dict[int, int] = {}  # Worker index by process id
+    stopping = False
+
+    def spawn(index: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            listener = setup_logging(args.log_level)  # The parent's log writer thread does not survive the fork
+            exit_code = 0
+            try:
+                asyncio.run(main(args, worker_index=index))
+            except BaseException:
+                logger.exception(f'Worker {index} failed')
+                exit_code = 1
+            finally:
+                finish_captures()
+                listener.stop()
+                os._exit(exit_code)
+        workers[pid] = index
+        logger.info(f'Started worker {index} (pid {pid})')
+
+    def stop(signum: int, frame: object) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for index in range(args.workers):
+        spawn(index)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index = workers.pop(pid, None)
+        if index is None or stopping:
+            continue
+        logger.warning(f'Worker {index} (pid {pid}) exited with status {status}, restarting')
+        time.sleep(WORKER_RESTART_DELAY)
+        if not stopping:
+            spawn(index)
+
+
+def parse_args() -> 'argparse.Namespace':
+    """ Parse the command line.
+    :return: Parsed arguments.
+    """
+    import argparse
     parser = argparse.ArgumentParser(
         description='Meowdem: A Hayes-compatible modem emulator supporting AT commands, TCP, and Telnet translation.',
         epilog='Example usage: python meowdem.py -c 2323.'
@@ -673,35 +3211,146 @@ async def main() -> None:
     parser.add_argument(
         '-s', '--serial-port',
         type=str,
-        default=None,
-        help='Serial port device to attach to (e.g., /dev/ttyS0). If specified, meowdem will use this serial port as a client interface.'
+        action='append',
+        default=[],
+        metavar='DEVICE[:BAUD]',
+        help='Serial port device to attach to (e.g., /dev/ttyS0 or /dev/ttyUSB0:19200). Repeat to serve several ports, '
+             'each with its own modem session. A port that fails or is unplugged is reopened without affecting the others.'
     )
     parser.add_argument(
         '--serial-baud',
         '-b',
         type=int,
         default=9600,
-        help='Baud rate for the serial port (default: 9600). Only used if --serial-port is specified.'
+        help='Baud rate for serial ports given without one (default: 9600).'
+    )
+    parser.add_argument(
+        '--phonebook',
+        type=str,
+        default=None,
+        help='File to keep the phonebook in, shared by all sessions (optional). If omitted, the phonebook is lost on exit.'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='Number of processes serving TCP clients on the shared --tcp-client-port (default: 1). '
+             'With more than one, stdin is not used, the serial ports are served by the first worker and --phonebook is required.'
+    )
+    parser.add_argument(
+        '--metrics-port',
+        type=int,
+        default=None,
+        help='Port serving runtime metrics in the Prometheus text format over HTTP (optional). '
+             'With --workers, each worker listens on this port plus its index.'
+    )
+    parser.add_argument(
+        '--max-sessions',
+        type=int,
+        default=0,
+        help='Most TCP client sessions served at once by each process, further clients are answered BUSY (default: 0, no limit).'
+    )
+    parser.add_argument(
+        '--idle-timeout',
+        type=float,
+        default=0.0,
+        help='Seconds a TCP client may stay idle at the command prompt before it is disconnected (default: 0, never).'
+    )
+    parser.add_argument(
+        '--capture-dir',
+        type=str,
+        default=None,
+        help='Directory to record every session to, as binary capture files with both directions and timestamps (optional).'
+    )
+    parser.add_argument(
+        '--replay',
+        type=str,
+        default=None,
+        metavar='CAPTURE',
+        help='Replay a capture file through the parser as fast as possible, print statistics as JSON and exit. '
+             'Give the --phonebook the session dialed from.'
+    )
+    parser.add_argument(
+        '--replay-realtime',
+        action='store_true',
+        help='Keep the captured timing and line rates when replaying with --replay.'
+    )
+    parser.add_argument(
+        '--log-level',
+        type=str.upper,
+        choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'),
+        default='INFO',
+        help='Lowest level of the messages logged to stderr (default: INFO).'
+    )
+    parser.add_argument(
+        '--startup-profile',
+        action='store_true',
+        help='Report to stderr how long importing and starting took, and when the first response was sent to a client.'
     )
     args = parser.parse_args()
+    if args.workers > 1 and args.tcp_client_port is not None and args.phonebook is None:
+        # Each worker would otherwise keep its own in-memory phonebook, and entries would depend on which one a client reaches
+        parser.error('--workers above 1 needs a --phonebook file shared by the workers')
+    return args
+
+
+async def main(args: Optional['argparse.Namespace'] = None, worker_index: Optional[int] = None) -> None:
+    """ Main entry point: handles both stdin and TCP connections. 
+    :param args: Parsed command line arguments, parsed from sys.argv if omitted.
+    :param worker_index: Index of this worker process when running with --workers, otherwise None.
+    :return: None
+    """
+    if args is None:
+        args = parse_args()
+
+    if args.replay is not None:
+        import json
+        replayed = await replay_capture(args.replay, realtime=args.replay_realtime, phonebook=Phonebook(args.phonebook))
+        print(json.dumps(replayed))
+        return
+
+    global shared_phonebook, capture_dir, max_tcp_sessions, tcp_idle_timeout, startup_profile
+    if args.startup_profile:
+        startup_profile = StartupProfile()
+    shared_phonebook = Phonebook(args.phonebook)
+    capture_dir = args.capture_dir
+    max_tcp_sessions = args.max_sessions
+    tcp_idle_timeout = args.idle_timeout
+
+    if args.metrics_port is not None:
+        await serve_metrics(args.metrics_port + (worker_index or 0))
 
     tasks = []
-    if args.serial_port is not None:
-        start_serial_client(args.serial_port, args.serial_baud)
-        # Keep the event loop alive if only serial is used
-        if args.tcp_client_port is None:
-            await asyncio.Future()
-    else:
+    if args.serial_port:
+        if worker_index is None or worker_index == 0:
+            for spec in args.serial_port:
+                tasks.append(asyncio.create_task(serve_serial_port(*parse_serial_port(spec, args.serial_baud))))
+    elif worker_index is None:
         tasks.append(stdio_client_task())
 
     if args.tcp_client_port is not None:
-        server = await asyncio.start_server(handle_tcp_client, '0.0.0.0', args.tcp_client_port)
-        tasks.append(server.serve_forever())
-        async with server:
-            await asyncio.gather(*tasks)
+        # Exit once the listener has drained after SIGTERM, whatever stdin is doing
+        await serve_tcp_clients(args.tcp_client_port, reuse_port=worker_index is not None)
     else:
         await asyncio.gather(*tasks)
 
 
+def run() -> None:
+    """ Command line entry point. Started with `python -m meowdem`, the module is loaded from cached bytecode. """
+    arguments = parse_args()
+    if arguments.workers > 1 and arguments.tcp_client_port is not None:
+        setup_logging(arguments.log_level, background=False)
+        run_workers(arguments)
+    else:
+        log_listener = setup_logging(arguments.log_level)
+        try:
+            asyncio.run(main(arguments))
+        finally:
+            finish_captures()
+            log_listener.stop()
+
+
+IMPORT_FINISHED = time.perf_counter()
+
 if __name__ == '__main__':
-    asyncio.run(main())
\ No newline at end of file
+    run()
\ No newline at end of file
@@ -0,0 +1,429 @@
+""" Throughput benchmarks for meowdem's hot paths.
+
+Run from the repository root:
+
+    python meowdem_bench.py                       # run everything, print JSON
+    python meowdem_bench.py --save baseline.json  # keep the results as a baseline
+    python meowdem_bench.py --compare baseline.json
+
+With --compare, every metric is checked against the baseline and the exit
+status is non-zero when one regressed by more than --tolerance.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import resource
+import socket
+import sys
+import time
+
+from typing import Callable, Dict, List
+
+try:
+    from . import meowdem
+except ImportError:
+    import meowdem
+
+# Result of a single metric: {'value': float, 'unit': str, 'higher_is_better': bool}
+Result = Dict[str, object]
+
+
+def result(value: float, unit: str, higher_is_better: bool = True) -> Result:
+    return {'value': round(value, 3), 'unit': unit, 'higher_is_better': higher_is_better}
+
+
+def measure_rate(operation: Callable[[], int], min_time: float) -> float:
+    """ Run operation repeatedly for at least min_time seconds.
+    :param operation: Callable doing one round of work and returning the amount of work done.
+    :param min_time: Minimum seconds to keep running.
+    :return: Work done per second.
+    """
+    done = 0
+    started = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < min_time:
+        done += operation()
+        elapsed = time.perf_counter() - started
+    return done / elapsed
+
+
+def make_payload(size: int, iac_every: int = 0) -> bytes:
+    """ Build a payload of printable text, with an escaped IAC pair every iac_every bytes if non-zero. """
+    text = bytearray((b'The quick brown fox jumps over the lazy dog. ' * (size // 45 + 1))[:size])
+    if iac_every:
+        for index in range(0, size - 1, iac_every):
+            text[index:index + 2] = b'\xff\xff'
+    return bytes(text)
+
+
+def bench_telnet(min_time: float) -> Dict[str, Result]:
+    """ TelnetTranslator throughput on clean data and on data with 1% IAC density. """
+    results = {}
+    chunk_size = 4096
+    for label, iac_every in (('clean', 0), ('iac_1pct', 100)):
+        chunks = [make_payload(chunk_size, iac_every)] * 256
+        translator = meowdem.TelnetTranslator()
+
+        def decode() -> int:
+            for chunk in chunks:
+                translator.input_translation(chunk)
+            return chunk_size * len(chunks)
+
+        def encode() -> int:
+            for chunk in chunks:
+                translator.output_translation(chunk)
+            return chunk_size * len(chunks)
+
+        results[f'telnet_input_{label}'] = result(measure_rate(decode, min_time) / 1e6, 'MB/s')
+        results[f'telnet_output_{label}'] = result(measure_rate(encode, min_time) / 1e6, 'MB/s')
+    return results
+
+
+async def bench_commands(min_time: float) -> Dict[str, Result]:
+    """ HayesATParser.execute_command rate for a chained command string. """
+    parser = meowdem.HayesATParser(lambda data: None, phonebook=meowdem.Phonebook())
+    command = 'ATE1S7=30S12=50*T0*B0S2=43S7?H0'
+    subcommands = 8
+
+    def execute() -> int:
+        for _ in range(100):
+            parser.execute_command(command)
+        return 100
+
+    rate = measure_rate(execute, min_time)
+    parser.close()
+    return {
+        'execute_command_chained': result(rate, 'commands/s'),
+        'execute_command_subcommands': result(rate * subcommands, 'subcommands/s'),
+    }
+
+
+async def start_echo_server() -> asyncio.AbstractServer:
+    async def echo(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+    return await asyncio.start_server(echo, '127.0.0.1', 0)
+
+
+async def bench_data_path(min_time: float) -> Dict[str, Result]:
+    """ DATA-mode throughput and round-trip latency through a parser connected to a local echo server. """
+    server = await start_echo_server()
+    port = server.sockets[0].getsockname()[1]
+    received = bytearray()
+    arrived = asyncio.Event()
+
+    def client_out(data: bytes) -> None:
+        received.extend(data)
+        arrived.set()
+
+    parser = meowdem.HayesATParser(client_out, phonebook=meowdem.Phonebook())
+    parser.receive(f'ATD127.0.0.1:{port}\r'.encode('ascii'))
+    while b'CONNECTED' not in received:
+        arrived.clear()
+        await asyncio.wait_for(arrived.wait(), timeout=5)
+    received.clear()
+
+    chunk = make_payload(4096).replace(b'+', b'-')
+    sent = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < min_time:
+        for _ in range(64):
+            parser.receive(chunk)
+            await parser.drain()
+            sent += len(chunk)
+    while len(received) < sent:
+        arrived.clear()
+        await asyncio.wait_for(arrived.wait(), timeout=5)
+    throughput = sent / (time.perf_counter() - started)
+
+    latencies: List[float] = []
+    for _ in range(200):
+        received.clear()
+        arrived.clear()
+        started = time.perf_counter()
+        parser.receive(b'x')
+        await asyncio.wait_for(arrived.wait(), timeout=5)
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+
+    parser.close()
+    # Let the echo handler see EOF before the loop shuts down
+    await asyncio.sleep(0.1)
+    server.close()
+    await server.wait_closed()
+    return {
+        'data_mode_echo_throughput': result(throughput / 1e6, 'MB/s'),
+        'data_mode_echo_latency_p50': result(latencies[len(latencies) // 2] * 1e6, 'us', higher_is_better=False),
+        'data_mode_echo_latency_p99': result(latencies[int(len(latencies) * 0.99)] * 1e6, 'us', higher_is_better=False),
+    }
+
+
+async def bench_transfer(min_time: float) -> Dict[str, Result]:
+    """ Download throughput of a ZMODEM-like binary stream from a telnet host, with telnet and PETSCII translation on. """
+    block = bytes(range(256)) * 64
+    wire_block = block.replace(b'\xff', b'\xff\xff')  # IAC escaped by the telnet host
+    done = asyncio.Event()
+
+    async def sender(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        writer.write(b'**\x18B00000000000000\r\x8a\x11')
+        try:
+            while not done.is_set():
+                writer.write(wire_block)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(sender, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    received = 0
+    connected = asyncio.Event()
+
+    def client_out(data: bytes) -> None:
+        nonlocal received
+        received += len(data)
+        connected.set()
+
+    parser = meowdem.HayesATParser(client_out, phonebook=meowdem.Phonebook())
+    parser.receive(f'AT*T1*C1\rATD127.0.0.1:{port}\r'.encode('ascii'))
+    await asyncio.wait_for(connected.wait(), timeout=5)
+    while parser.transfer is None:
+        await asyncio.sleep(0.001)
+    received = 0
+    started = time.perf_counter()
+    await asyncio.sleep(min_time)
+    throughput = received / (time.perf_counter() - started)
+    done.set()
+    parser.close()
+    await asyncio.sleep(0.1)
+    server.close()
+    await server.wait_closed()
+    return {'transfer_download_throughput': result(throughput / 1e6, 'MB/s')}
+
+
+def resident_memory() -> int:
+    """ :return: Resident set size of this process in bytes. """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def raise_fd_limit(wanted: int) -> int:
+    """ Raise the soft file descriptor limit towards wanted. :return: The resulting limit. """
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+    if target > soft:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+        return target
+    return soft
+
+
+async def bench_sessions(session_count: int, idle_time: float) -> Dict[str, Result]:
+    """ Memory per idle handle_tcp_client session and CPU use while they sit idle.
+    The client sockets live in the same process, so memory per session is an upper bound.
+    """
+    fd_limit = raise_fd_limit(2 * session_count + 256)
+    session_count = min(session_count, (fd_limit - 256) // 2)
+    server = await asyncio.start_server(meowdem.handle_tcp_client, '127.0.0.1', 0, backlog=1024)
+    port = server.sockets[0].getsockname()[1]
+    loop = asyncio.get_running_loop()
+
+    gc.collect()
+    memory_before = resident_memory()
+    clients = []
+    for _ in range(session_count):
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client.setblocking(False)
+        await loop.sock_connect(client, ('127.0.0.1', port))
+        clients.append(client)
+    while len(meowdem.tcp_sessions) < session_count:
+        await asyncio.sleep(0.05)
+    await asyncio.sleep(0.2)
+    gc.collect()
+    memory_per_session = (resident_memory() - memory_before) / session_count
+
+    cpu_started = time.process_time()
+    wall_started = time.perf_counter()
+    await asyncio.sleep(idle_time)
+    idle_cpu = (time.process_time() - cpu_started) / (time.perf_counter() - wall_started)
+
+    for client in clients:
+        client.close()
+    server.close()
+    await server.wait_closed()
+    while meowdem.tcp_sessions:
+        await asyncio.sleep(0.05)
+    return {
+        f'sessions_{session_count}_memory_per_session': result(memory_per_session / 1024, 'KiB', higher_is_better=False),
+        f'sessions_{session_count}_idle_cpu': result(idle_cpu * 100, '%', higher_is_better=False),
+    }
+
+
+def bench_charsets(min_time: float) -> Dict[str, Result]:
+    """ CharsetTranslator throughput to and from each registered character set. """
+    results = {}
+    chunk_size = 4096
+    chunks = [make_payload(chunk_size).replace(b'. ', b'.\r\n')] * 256
+    for charset in meowdem.charsets.values():
+        translator = meowdem.CharsetTranslator(charset)
+        label = charset.name.lower().replace(' ', '_')
+
+        def decode() -> int:
+            for chunk in chunks:
+                translator.input_translation(chunk)
+            return chunk_size * len(chunks)
+
+        def encode() -> int:
+            for chunk in chunks:
+                translator.output_translation(chunk)
+            return chunk_size * len(chunks)
+
+        results[f'charset_input_{label}'] = result(measure_rate(decode, min_time) / 1e6, 'MB/s')
+        results[f'charset_output_{label}'] = result(measure_rate(encode, min_time) / 1e6, 'MB/s')
+    return results
+
+
+def make_ansi_screen(size: int) -> bytes:
+    """ Build BBS-style output: coloured menu lines with cursor movement, as a remote host sends them. """
+    lines = []
+    for row in range(size // 40 + 1):
+        lines.append(f'\x1b[{row % 24 + 1};1H\x1b[1;3{row % 8}m[{row % 10}] Message area {row}\x1b[0m\r\n'.encode('ascii'))
+    return b''.join(lines)[:size]
+
+
+def bench_link_compression(min_time: float) -> Dict[str, Result]:
+    """ Compression ratio and per-chunk cost of LinkCodec on ANSI screens, text and keystrokes. """
+    results = {}
+    chunk_size = 4096
+    for label, chunk in (('ansi', make_ansi_screen(chunk_size)), ('text', make_payload(chunk_size))):
+        sender = meowdem.LinkCodec()
+        wire = sum(len(sender.compress(chunk)) for _ in range(16))
+        results[f'link_compression_ratio_{label}'] = result(16 * chunk_size / wire, 'x')
+        sender, receiver = meowdem.LinkCodec(), meowdem.LinkCodec()
+
+        def round_trip() -> int:
+            for _ in range(64):
+                receiver.decompress(sender.compress(chunk))
+            return 64
+
+        results[f'link_compression_latency_{label}_4k'] = result(1e6 / measure_rate(round_trip, min_time), 'us',
+                                                                 higher_is_better=False)
+
+    sender, receiver = meowdem.LinkCodec(), meowdem.LinkCodec()
+
+    def keystroke() -> int:
+        for _ in range(256):
+            receiver.decompress(sender.compress(b'x'))
+        return 256
+
+    results['link_compression_latency_keystroke'] = result(1e6 / measure_rate(keystroke, min_time), 'us',
+                                                           higher_is_better=False)
+    # Each keystroke carries a sync flush marker, which is the price of sending it at once
+    results['link_compression_keystroke_bytes'] = result(len(sender.compress(b'x')), 'bytes', higher_is_better=False)
+    return results
+
+
+async def bench_replay(captures: List[str], min_time: float) -> Dict[str, Result]:
+    """ Replay throughput of captured sessions, fed through the parser as fast as possible. """
+    results = {}
+    for path in captures:
+        name = os.path.splitext(os.path.basename(path))[0]
+        replayed = 0
+        started = time.perf_counter()
+        while time.perf_counter() - started < min_time:
+            stats = await meowdem.replay_capture(path)
+            replayed += stats['client_bytes'] + stats['remote_bytes']
+        results[f'replay_{name}'] = result(replayed / (time.perf_counter() - started) / 1e6, 'MB/s')
+    return results
+
+
+async def run_benchmarks(min_time: float, session_counts: List[int], captures: List[str]) -> Dict[str, Result]:
+    results: Dict[str, Result] = {}
+    results.update(bench_telnet(min_time))
+    results.update(bench_charsets(min_time))
+    results.update(bench_link_compression(min_time))
+    results.update(await bench_commands(min_time))
+    results.update(await bench_data_path(min_time))
+    results.update(await bench_transfer(min_time))
+    results.update(await bench_replay(captures, min_time))
+    for session_count in session_counts:
+        results.update(await bench_sessions(session_count, idle_time=max(1.0, min_time * 2)))
+    return results
+
+
+def compare_results(results: Dict[str, Result], baseline: Dict[str, Result], tolerance: float) -> List[str]:
+    """ Compare results against a baseline.
+    :param results: Current results.
+    :param baseline: Baseline results, in the same format.
+    :param tolerance: Allowed relative change in the wrong direction, e.g. 0.1 for 10%.
+    :return: Names of the metrics that regressed beyond the tolerance.
+    """
+    regressions = []
+    for name, current in sorted(results.items()):
+        previous = baseline.get(name)
+        if previous is None or not previous['value']:
+            continue
+        change = (current['value'] - previous['value']) / previous['value']
+        worse = -change if current['higher_is_better'] else change
+        status = 'REGRESSION' if worse > tolerance else 'ok'
+        if worse > tolerance:
+            regressions.append(name)
+        print(f"{name:45} {previous['value']:>12} -> {current['value']:>12} {current['unit']:12} {change:+7.1%}  {status}",
+              file=sys.stderr)
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Benchmark meowdem throughput, latency and per-session cost.')
+    parser.add_argument('--min-time', type=float, default=1.0, help='Seconds to run each throughput benchmark (default: 1).')
+    parser.add_argument('--sessions', type=str, default='1000,10000',
+                        help='Comma separated idle session counts to measure, empty to skip (default: 1000,10000).')
+    parser.add_argument('--capture', type=str, action='append', default=[],
+                        help='Also measure replay throughput of a capture recorded with --capture-dir (repeatable).')
+    parser.add_argument('--save', type=str, default=None, help='Write the results to this JSON file.')
+    parser.add_argument('--compare', type=str, default=None, help='Compare the results with a JSON file saved by --save.')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Allowed regression for --compare (default: 0.1 = 10%%).')
+    args = parser.parse_args()
+
+    meowdem.logging.disable(meowdem.logging.INFO)
+    session_counts = [int(count) for count in args.sessions.split(',') if count]
+    results = asyncio.run(run_benchmarks(args.min_time, session_counts, args.capture))
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.save:
+        with open(args.save, 'w') as output:
+            json.dump(report, output, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        if compare_results(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,7 +3,7 @@ import pytest_asyncio
 import asyncio
 import unittest.mock
 
-from .meowdem import HayesATParser
+from .meowdem import HayesATParser, Phonebook, TelnetNegotiator, TelnetTranslator
 
 class OutputCollector:
     """ Collects output as a single string for transparent test assertions. :param output: str :return: None """
@@ -13,7 +13,13 @@ class OutputCollector:
         self.value += new_output.decode('latin-1')
 
 
+class MockTransport:
+    def get_write_buffer_size(self) -> int:
+        return 0
+
+
 class MockStreamWriter:
+    transport = MockTransport()
     def write(self, data: bytes) -> None:
         pass
     def drain(self) -> None:
@@ -24,6 +30,8 @@ class MockStreamWriter:
         pass
     async def wait_closed(self) -> None:
         pass
+    def get_extra_info(self, name: str, default: object = None) -> object:
+        return default
 
 
 class MockStreamReader:
@@ -36,15 +44,11 @@ class MockStreamReader:
 async def parser():
     """ Fixture to create a HayesATParser and OutputCollector. :return: tuple[HayesATParser, OutputCollector] """
     collector = OutputCollector()
-    p = HayesATParser(client_output_cb=collector)
+    p = HayesATParser(client_output_cb=collector, phonebook=Phonebook())
     try:
         yield p, collector
     finally:
-        p.guard_time_task.cancel()
-        try:
-            await p.guard_time_task
-        except asyncio.CancelledError:
-            pass
+        p.close()
 
 
 @pytest.mark.asyncio
@@ -71,9 +75,10 @@ async def test_escape_data_mode_with_plus(parser: tuple[HayesATParser, OutputCol
     p.writer = MockStreamWriter()  # type: ignore
     p.mode = ParserMode.DATA
     collector.value = ''
-    await asyncio.to_thread(p.receive, b'+++')
+    p.receive(b'+++')
     await asyncio.sleep(1.1)
     assert 'OK' in collector.value
+    assert p.mode == ParserMode.COMMAND
 
 
 @pytest.mark.asyncio
@@ -185,3 +190,1162 @@ async def test_ATO_command_no_carrier(parser: tuple[HayesATParser, OutputCollect
     await asyncio.to_thread(p.receive, b'ATO\r')
     assert 'NO CARRIER' in collector.value
     assert p.mode == ParserMode.COMMAND
+
+
+class RecordingStreamWriter(MockStreamWriter):
+    """ Stream writer that records every write call. :return: None """
+    def __init__(self) -> None:
+        self.writes: list[bytes] = []
+    def write(self, data: bytes) -> None:
+        self.writes.append(bytes(data))
+    async def drain(self) -> None:
+        pass
+
+
+@pytest.mark.asyncio
+async def test_data_mode_forwards_chunk_in_single_write(parser: tuple[HayesATParser, OutputCollector]) -> None:
+    """ Test that a chunk received in DATA mode is forwarded with one write. :param parser: tuple[HayesATParser, OutputCollector] :return: None """
+    from .meowdem import ParserMode
+    p, collector = parser
+    p.writer = RecordingStreamWriter()  # type: ignore
+    p.mode = ParserMode.DATA
+    p.receive(b'hello+world' * 100)
+    await p.drain()
+    assert p.writer.writes == [b'hello+world' * 100]
+    assert p.escape_timer is None
+
+
+@pytest.mark.asyncio
+async def test_escape_sequence_split_across_chunks(parser: tuple[HayesATParser, OutputCollector]) -> None:
+    """ Test that a '+++' escape split over several chunks is still detected. :param parser: tuple[HayesATParser, OutputCollector] :return: None """
+    from .meowdem import ParserMode
+    p, collector = parser
+    p.writer = RecordingStreamWriter()  # type: ignore
+    p.mode = ParserMode.DATA
+    p.receive(b'data+')
+    p.receive(b'+')
+    assert p.escape_timer is None
+    p.receive(b'+')
+    assert p.escape_timer is not None
+    p.receive(b'x')
+    assert p.escape_timer is None
+    p.receive(b'++++')
+    assert p.escape_timer is None
+    assert p.writer.writes == [b'data+', b'+', b'+', b'x', b'++++']
+
+
+def test_telnet_input_translation_across_chunks() -> None:
+    """ Test that telnet commands split over chunk boundaries decode the same as a whole stream. :return: None """
+    stream = b'AB\xff\xffC\xff\xfb\x01D\xff\xfa\x18\x01\xff\xff\xff\xf0E\xff\xf1F'
+    assert TelnetTranslator().input_translation(stream) == b'AB\xffCDEF'
+    for split in range(len(stream) + 1):
+        translator = TelnetTranslator()
+        decoded = translator.input_translation(stream[:split]) + translator.input_translation(stream[split:])
+        assert decoded == b'AB\xffCDEF'
+
+
+def test_telnet_output_translation_escapes_iac() -> None:
+    """ Test that IAC bytes are doubled and clean data passes through untouched. :return: None """
+    translator = TelnetTranslator()
+    assert translator.output_translation(b'plain') == b'plain'
+    assert translator.output_translation(b'\xffA\xff') == b'\xff\xffA\xff\xff'
+
+
+@pytest.mark.asyncio
+async def test_chained_command(parser: tuple[HayesATParser, OutputCollector]) -> None:
+    """ Test that a chained command string runs every subcommand in order. :param parser: tuple[HayesATParser, OutputCollector] :return: None """
+    p, collector = parser
+    p.receive(b'ATE0S7=45*T1S7?\r')
+    assert p.echo_enabled is False
+    assert p.telnet_translation_enabled is True
+    assert collector.value.endswith('OK\r\n45\r\nOK\r\n')
+
+
+@pytest.mark.asyncio
+async def test_register_command_on_subclass(parser: tuple[HayesATParser, OutputCollector]) -> None:
+    """ Test that a subclass can register a new subcommand without affecting the base parser. :param parser: tuple[HayesATParser, OutputCollector] :return: None """
+    class CustomParser(HayesATParser):
+        def handle_ATX(self, level: str) -> None:
+            self.client_out_str(f"X{level}\r\n")
+    CustomParser.register_command(r'X(\d)', 'handle_ATX')
+
+    collector = OutputCollector()
+    custom = CustomParser(client_output_cb=collector)
+    custom.receive(b'ATX4\r')
+    assert collector.value == 'ATX4\r\nX4\r\nOK\r\n'
+
+    p, base_collector = parser
+    base_collector.value = ''
+    p.receive(b'ATX4\r')
+    assert 'ERROR' in base_collector.value
+
+
+@pytest.mark.asyncio
+async def test_escape_cancelled_by_data_within_guard_time(parser: tuple[HayesATParser, OutputCollector]) -> None:
+    """ Test that data following '+++' within the guard time keeps the session in DATA mode. :param parser: tuple[HayesATParser, OutputCollector] :return: None """
+    from .meowdem import ParserMode
+    p, collector = parser
+    p.writer = RecordingStreamWriter()  # type: ignore
+    p.mode = ParserMode.DATA
+    p.handle_ats_set('12', '5')  # 100ms guard time
+    p.receive(b'+++')
+    await asyncio.sleep(0.05)
+    p.receive(b'more')
+    await asyncio.sleep(0.15)
+    assert p.mode == ParserMode.DATA
+    assert collector.value == ''
+
+
+@pytest.mark.asyncio
+async def test_escape_uses_s2_escape_character(parser: tuple[HayesATParser, OutputCollector]) -> None:
+    """ Test that the escape sequence honors the S2 escape character and guard time S12. :param parser: tuple[HayesATParser, OutputCollector] :return: None """
+    from .meowdem import ParserMode
+    p, collector = parser
+    p.receive(b'ATS2=45S12=5\r')
+    p.writer = RecordingStreamWriter()  # type: ignore
+    p.mode = ParserMode.DATA
+    collector.value = ''
+    p.receive(b'+++')
+    assert p.escape_timer is None
+    p.receive(b'---')
+    await asyncio.sleep(0.15)
+    assert p.mode == ParserMode.COMMAND
+    assert collector.value == 'OK\r\n'
+
+
+@pytest.mark.asyncio
+async def test_stdio_client_over_pipes(monkeypatch: pytest.MonkeyPatch) -> None:
+    """ Test that the stdio client reads commands from a stdin pipe and answers on a stdout pipe. :param monkeypatch: pytest.MonkeyPatch :return: None """
+    import io
+    import os
+    from . import meowdem
+    from .meowdem import connect_stdio_pipes, stdio_client_task
+    stdin_read, stdin_write = os.pipe()
+    stdout_read, stdout_write = os.pipe()
+    monkeypatch.setattr('sys.stdin', io.TextIOWrapper(open(stdin_read, 'rb')))
+    monkeypatch.setattr('sys.stdout', io.TextIOWrapper(open(stdout_write, 'wb')))
+
+    pipes: list = []
+
+    async def recording_connect_stdio_pipes():
+        pipes.append(await connect_stdio_pipes())
+        return pipes[-1]
+
+    monkeypatch.setattr(meowdem, 'connect_stdio_pipes', recording_connect_stdio_pipes)
+    task = stdio_client_task()
+    os.write(stdin_write, b'ATE0\rATI\r')
+    os.close(stdin_write)
+    await asyncio.wait_for(task, timeout=2)
+    await asyncio.sleep(0.05)
+    assert os.get_blocking(stdin_read) and os.get_blocking(stdout_write)
+    [(_, writer)] = pipes
+    assert writer.transport.is_closing() and writer.transport.get_extra_info('pipe').closed
+
+    output = os.read(stdout_read, 4096)
+    os.close(stdout_read)
+    assert output.startswith(b'ATE0\r\nOK\r\n')
+    assert b'Modem Info' in output
+    assert b'ATI' not in output
+    assert output.endswith(b'OK\r\n')
+
+
+@pytest.mark.asyncio
+async def test_serial_port_retries_after_unexpected_errors(monkeypatch: pytest.MonkeyPatch) -> None:
+    """ Test that a serial port failing with an unexpected exception is retried instead of ending its task. :param monkeypatch: pytest.MonkeyPatch :return: None """
+    from . import meowdem
+    attempts: list[str] = []
+
+    def failing_start_serial_client(path: str, baudrate: int):
+        attempts.append(path)
+        raise ValueError('unsupported baud rate')
+
+    monkeypatch.setattr(meowdem, 'SERIAL_RECONNECT_DELAY', 0.01)
+    monkeypatch.setattr(meowdem, 'start_serial_client', failing_start_serial_client)
+    task = asyncio.ensure_future(meowdem.serve_serial_port('/dev/ttyBAD', 1234))
+    for _ in range(100):
+        if len(attempts) >= 3:
+            break
+        await asyncio.sleep(0.01)
+    assert len(attempts) >= 3 and not task.done()
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+
+@pytest.mark.asyncio
+async def test_serial_transport_backpressure() -> None:
+    """ Test that the serial transport coalesces queued writes and blocks drain() above its high-water mark. :return: None """
+    import socket
+    from .meowdem import SerialTransport
+    local, remote = socket.socketpair()
+    local.setblocking(False)
+    local.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+    received: list[bytes] = []
+    transport = SerialTransport(local.detach(), received.append, high_water=8192, low_water=1024)
+    transport.resume_reading()
+
+    payload = bytes(range(256)) * 1024
+    for offset in range(0, len(payload), 100):
+        transport.write(payload[offset:offset + 100])
+    assert transport.get_write_buffer_size() > 8192
+    drain = asyncio.ensure_future(transport.drain())
+    await asyncio.sleep(0.01)
+    assert not drain.done()
+
+    remote.setblocking(False)
+    collected = bytearray()
+    while len(collected) < len(payload):
+        try:
+            collected += remote.recv(65536)
+        except BlockingIOError:
+            await asyncio.sleep(0.001)
+    await asyncio.wait_for(drain, timeout=1)
+    assert bytes(collected) == payload
+    assert transport.get_write_buffer_size() == 0
+
+    remote.send(b'ATZ\r')
+    await asyncio.sleep(0.05)
+    assert b''.join(received) == b'ATZ\r'
+    transport.close()
+    remote.close()
+
+
+@pytest.mark.asyncio
+async def test_remote_reader_waits_for_client_drain() -> None:
+    """ Test that the remote socket reader stops reading while the client is over its high-water mark. :return: None """
+    from .meowdem import REMOTE_READ_SIZE
+    collector = OutputCollector()
+    client_ready = asyncio.Event()
+    p = HayesATParser(collector, client_ready.wait)
+    reader = asyncio.StreamReader()
+    reader.feed_data(b'x' * REMOTE_READ_SIZE * 4)
+    reader.feed_eof()
+
+    connection = asyncio.ensure_future(p._handle_socket_connection(reader, MockStreamWriter()))  # type: ignore
+    await asyncio.sleep(0.05)
+    assert len(collector.value) == REMOTE_READ_SIZE
+    client_ready.set()
+    await asyncio.wait_for(connection, timeout=1)
+    assert len(collector.value) == REMOTE_READ_SIZE * 4
+    p.close()
+
+
+@pytest.mark.asyncio
+async def test_line_rate_pacing(parser: tuple[HayesATParser, OutputCollector]) -> None:
+    """ Test that AT*B paces remote data to the line rate in batches. :param parser: tuple[HayesATParser, OutputCollector] :return: None """
+    p, collector = parser
+    p.receive(b'AT*B9600\r')
+    collector.value = ''
+    p.receive(b'AT*B?\r')
+    assert collector.value == 'AT*B?\r\n9600\r\nOK\r\n'
+
+    batches: list[bytes] = []
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    await p.pacer.pace(b'x' * 240, batches.append)  # 0.25s of data at 960 bytes/s
+    elapsed = loop.time() - started
+    assert b''.join(batches) == b'x' * 240
+    assert 0.2 <= elapsed < 0.4
+    assert len(batches) < 20
+
+    p.receive(b'AT*B0\r')
+    assert p.pacer is None
+
+
+def test_telnet_negotiation_replies() -> None:
+    """ Test that the negotiator accepts supported options, refuses others and answers TTYPE requests. :return: None """
+    negotiator = TelnetNegotiator(terminal_type='VT100', window_size=(80, 25))
+    translator = TelnetTranslator(negotiator)
+    data = translator.input_translation(
+        b'\xff\xfd\x18'          # DO TTYPE
+        b'\xff\xfb\x01'          # WILL ECHO
+        b'\xff\xfd\x05'          # DO STATUS
+        b'\xff\xfa\x18\x01\xff\xf0'  # SB TTYPE SEND IAC SE
+        b'Welcome'
+    )
+    assert data == b'Welcome'
+    assert negotiator.take_replies() == (
+        b'\xff\xfb\x18'          # WILL TTYPE
+        b'\xff\xfd\x01'          # DO ECHO
+        b'\xff\xfc\x05'          # WONT STATUS
+        b'\xff\xfa\x18\x00VT100\xff\xf0'
+    )
+    translator.input_translation(b'\xff\xfd\x18')  # Repeated DO TTYPE is not answered again
+    assert negotiator.take_replies() == b''
+
+
+def test_telnet_negotiation_offers_not_answered_twice() -> None:
+    """ Test that acknowledgements of opening offers produce no replies except the NAWS window size. :return: None """
+    negotiator = TelnetNegotiator(window_size=(80, 24))
+    negotiator.offer()
+    assert negotiator.take_replies() == b'\xff\xfd\x03\xff\xfd\x01\xff\xfb\x18\xff\xfb\x1f'
+    translator = TelnetTranslator(negotiator)
+    translator.input_translation(b'\xff\xfb\x03\xff\xfb\x01\xff\xfe\x18\xff\xfd\x1f')
+    assert negotiator.take_replies() == b'\xff\xfa\x1f\x00\x50\x00\x18\xff\xf0'
+    assert negotiator.local_enabled == {31}
+
+
+@pytest.mark.asyncio
+async def test_terminal_type_and_window_size_commands(parser: tuple[HayesATParser, OutputCollector]) -> None:
+    """ Test that AT*TT and AT*TW set what the next connection reports to the telnet server. :param parser: tuple[HayesATParser, OutputCollector] :return: None """
+    from .meowdem import ParserMode
+    p, collector = parser
+    p.receive(b'ATE0\r')
+    collector.value = ''
+    p.receive(b'AT*T1*TT=VT100*TW=40,25\r')
+    p.receive(b'AT*TT?*TW?\r')
+    assert collector.value == 'OK\r\nVT100\r\n40,25\r\nOK\r\n'
+
+    reader = asyncio.StreamReader()
+    writer = RecordingStreamWriter()
+    p.mode = ParserMode.DATA
+    connection = asyncio.ensure_future(p._handle_socket_connection(reader, writer))  # type: ignore
+    reader.feed_data(b'\xff\xfd\x1f\xff\xfa\x18\x01\xff\xf0')  # DO NAWS, SB TTYPE SEND
+    await asyncio.sleep(0.01)
+    replies = b''.join(writer.writes)
+    assert b'\xff\xfa\x1f\x00\x28\x00\x19\xff\xf0' in replies
+    assert b'\xff\xfa\x18\x00VT100\xff\xf0' in replies
+    reader.feed_eof()
+    await asyncio.wait_for(connection, timeout=1)
+
+    p.receive(b'ATZ\r')
+    collector.value = ''
+    p.receive(b'AT*TT?*TW?\r')
+    assert collector.value == 'AT*TT?*TW?\r\nANSI\r\n80,24\r\nOK\r\n'
+
+
+@pytest.mark.asyncio
+async def test_resolver_cache_reuses_lookups() -> None:
+    """ Test that the resolver cache shares and reuses lookups and interleaves address families. :return: None """
+    import socket
+    from .meowdem import ResolverCache
+    lookups: list[str] = []
+
+    async def fake_getaddrinfo(host, port, **kwargs):
+        lookups.append(host)
+        await asyncio.sleep(0.01)
+        return [
+            (socket.AF_INET6, socket.SOCK_STREAM, 6, '', ('2001:db8::1', 0, 0, 0)),
+            (socket.AF_INET6, socket.SOCK_STREAM, 6, '', ('2001:db8::2', 0, 0, 0)),
+            (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('192.0.2.1', 0)),
+        ]
+
+    cache = ResolverCache(ttl=60)
+    loop = asyncio.get_running_loop()
+    with unittest.mock.patch.object(loop, 'getaddrinfo', fake_getaddrinfo):
+        first, second = await asyncio.gather(cache.resolve('bbs.example'), cache.resolve('bbs.example'))
+        third = await cache.resolve('bbs.example')
+        literal = await cache.resolve('127.0.0.1')
+    assert first == second == third == ['2001:db8::1', '192.0.2.1', '2001:db8::2']
+    assert literal == ['127.0.0.1']
+    assert lookups == ['bbs.example']
+
+
+@pytest.mark.asyncio
+async def test_resolver_cache_evicts_expired_and_least_recent_entries() -> None:
+    """ Test that the resolver cache drops expired answers and failures and stays within its size. :return: None """
+    import socket
+    from .meowdem import ResolverCache
+
+    async def fake_getaddrinfo(host, port, **kwargs):
+        if host.startswith('dead'):
+            raise socket.gaierror(socket.EAI_NONAME, 'Name or service not known')
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('192.0.2.1', 0))]
+
+    cache = ResolverCache(ttl=60, negative_ttl=0.01, max_entries=3)
+    loop = asyncio.get_running_loop()
+    with unittest.mock.patch.object(loop, 'getaddrinfo', fake_getaddrinfo):
+        for host in ('dead1.example', 'dead2.example'):
+            with pytest.raises(OSError):
+                await cache.resolve(host)
+        await asyncio.sleep(0.02)
+        await cache.resolve('a.example')
+        assert list(cache.entries) == ['a.example']
+        await cache.resolve('b.example')
+        await cache.resolve('c.example')
+        await cache.resolve('a.example')  # Most recently used again
+        await cache.resolve('d.example')
+    assert list(cache.entries) == ['c.example', 'a.example', 'd.example']
+
+
+@pytest.mark.asyncio
+async def test_happy_eyeballs_skips_dead_address() -> None:
+    """ Test that a hanging address does not delay the connection past the attempt delay. :return: None """
+    from .meowdem import open_happy_eyeballs_connection
+    attempts: list[str] = []
+    cancelled: list[str] = []
+
+    async def fake_open_connection(host, port):
+        attempts.append(host)
+        if host == '2001:db8::1':
+            try:
+                await asyncio.sleep(30)
+            except asyncio.CancelledError:
+                cancelled.append(host)
+                raise
+        return MockStreamReader(), MockStreamWriter()
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    with unittest.mock.patch('asyncio.open_connection', fake_open_connection):
+        reader, writer = await open_happy_eyeballs_connection(['2001:db8::1', '192.0.2.1'], 23, delay=0.05)
+    await asyncio.sleep(0)
+    assert loop.time() - started < 1
+    assert attempts == ['2001:db8::1', '192.0.2.1']
+    assert cancelled == ['2001:db8::1']
+
+
+@pytest.mark.asyncio
+async def test_prewarmed_favorite_connects_without_dialing(parser: tuple[HayesATParser, OutputCollector]) -> None:
+    """ Test that dialing a favorite phonebook entry uses a standby connection when prewarming is on. :param parser: tuple[HayesATParser, OutputCollector] :return: None """
+    from .meowdem import ParserMode, prewarmer
+    p, collector = parser
+    dialed: list[tuple[str, int]] = []
+
+    async def fake_open_connection(host, port):
+        dialed.append((host, port))
+        return asyncio.StreamReader(), MockStreamWriter()
+
+    with unittest.mock.patch('asyncio.open_connection', fake_open_connection):
+        p.receive(b'AT&ZBBS=127.0.0.1:6400\r')
+        p.receive(b'AT*FBBS=1*P1\r')
+        for _ in range(20):
+            if prewarmer.pools.get(('127.0.0.1', 6400)):
+                break
+            await asyncio.sleep(0.01)
+        assert dialed == [('127.0.0.1', 6400)]
+
+        p.receive(b'ATDBBS\r')
+        for _ in range(20):
+            if 'CONNECTED' in collector.value:
+                break
+            await asyncio.sleep(0.01)
+        assert 'CONNECTED' in collector.value
+        assert p.mode == ParserMode.DATA
+        await asyncio.sleep(0.01)
+        assert dialed == [('127.0.0.1', 6400), ('127.0.0.1', 6400)]  # The pool is refilled
+
+        p.close()
+        assert prewarmer.task is None
+        assert not prewarmer.pools
+
+
+@pytest.mark.asyncio
+async def test_phonebook_persists_and_is_shared(tmp_path) -> None:
+    """ Test that phonebook edits are journaled, shared between sessions and dialable by unique prefix. :param tmp_path: Path :return: None """
+    path = str(tmp_path / 'phonebook.txt')
+    phonebook = Phonebook(path)
+    first, second = OutputCollector(), OutputCollector()
+    p1 = HayesATParser(first, phonebook=phonebook)
+    p2 = HayesATParser(second, phonebook=phonebook)
+    p1.receive(b'AT&ZBLACKFLAG=bbs.example:2323\r')
+    p1.receive(b'AT&ZBLUE=blue.example\r')
+    p1.receive(b'AT&ZOLD=old.example\r')
+    p1.receive(b'AT&ZOLD=\r')
+    p2.receive(b'AT&ZBLACKFLAG?\r')
+    assert 'BBS.EXAMPLE:2323\r\n' in second.value
+    assert phonebook.lookup('BLA') == ('BBS.EXAMPLE', 2323)
+    assert phonebook.lookup('BL') is None  # Ambiguous prefix
+
+    with open(path) as journal:
+        assert len(journal.readlines()) == 4  # One appended line per edit
+
+    reloaded = Phonebook(path)
+    assert reloaded.items() == [('BLACKFLAG', ('BBS.EXAMPLE', 2323)), ('BLUE', ('BLUE.EXAMPLE', None))]
+    p1.close()
+    p2.close()
+
+
+@pytest.mark.asyncio
+async def test_command_mode_batches_output(parser: tuple[HayesATParser, OutputCollector]) -> None:
+    """ Test that echo and responses for a pasted chunk are sent in a single output call. :param parser: tuple[HayesATParser, OutputCollector] :return: None """
+    p, collector = parser
+    calls: list[bytes] = []
+    p.client_out_cb = calls.append
+    p.receive(b'ats7=40\rATS7?\r\natx\x08Z\r')
+    assert calls == [b'ATS7=40\r\nOK\r\nATS7?\r\n40\r\nOK\r\n\nATX\b \bZ\r\nOK\r\n']
+
+
+@pytest.mark.asyncio
+async def test_command_buffer_is_capped(parser: tuple[HayesATParser, OutputCollector]) -> None:
+    """ Test that line noise without a line ending cannot grow the command buffer without limit. :param parser: tuple[HayesATParser, OutputCollector] :return: None """
+    from .meowdem import MAX_COMMAND_LENGTH
+    p, collector = parser
+    p.echo_enabled = False
+    for _ in range(100):
+        p.receive(b'x' * 100)
+    assert len(p.command_buffer) <= MAX_COMMAND_LENGTH
+    p.receive(b'ATI\r')
+    assert 'Modem Info' in collector.value
+
+
+@pytest.mark.asyncio
+async def test_phonebook_rejects_malformed_addresses_and_records(tmp_path) -> None:
+    """ Test that AT&Z only stores host[:port] addresses and that bad journal records are skipped. :param tmp_path: Path :return: None """
+    path = str(tmp_path / 'phonebook.txt')
+    with open(path, 'w') as journal:
+        journal.write('SET\tBAD\tbad.example\tx23\nSET\tGOOD\tgood.example\t23\n')
+    phonebook = Phonebook(path)
+    collector = OutputCollector()
+    p = HayesATParser(collector, phonebook=phonebook)
+    for address in (b'bbs.example\t1', b'bbs.example:99999', b'bbs.example:', b'bbs example'):
+        collector.value = ''
+        p.receive(b'AT&ZNEW=' + address + b'\r')
+        assert 'ERROR: INVALID ADDRESS' in collector.value
+    assert phonebook.items() == [('GOOD', ('good.example', 23))]
+    p.close()
+
+
+@pytest.mark.asyncio
+async def test_dial_literal_host_is_not_taken_for_longer_phonebook_name() -> None:
+    """ Test that ATD dials a literal host even when a phonebook name starts with it, and ATDS= dials by prefix. :return: None """
+    phonebook = Phonebook()
+    phonebook.set('LOCALHOST2', 'bbs.example', 2323)
+    collector = OutputCollector()
+    p = HayesATParser(collector, phonebook=phonebook)
+    with unittest.mock.patch.object(HayesATParser, 'open_remote', side_effect=OSError('refused')):
+        p.receive(b'ATDLOCALHOST\r')
+        await wait_for_output(collector, 'NO CARRIER')
+        assert 'DIALING LOCALHOST:23' in collector.value
+        collector.value = ''
+        p.receive(b'ATDS=LOCAL\r')
+        await wait_for_output(collector, 'NO CARRIER')
+        assert 'DIALING bbs.example:2323' in collector.value
+    collector.value = ''
+    p.receive(b'ATDS=NOWHERE\r')
+    assert 'NOT SET' in collector.value
+    p.close()
+
+
+def test_phonebook_follows_other_processes(tmp_path) -> None:
+    """ Test that a phonebook sees edits and compaction made through another instance of the same journal. :param tmp_path: Path :return: None """
+    path = str(tmp_path / 'phonebook.txt')
+    worker_a, worker_b = Phonebook(path), Phonebook(path)
+    worker_a.set('BBS', 'bbs.example', 23)
+    assert worker_b.get('BBS') == ('bbs.example', 23)
+    worker_b.set('BBS', 'bbs.example', 6400)
+    worker_b.set_favorite('BBS', True)
+    assert worker_a.get('BBS') == ('bbs.example', 6400)
+    assert worker_a.favorites() == [('bbs.example', 6400)]
+
+    for port in range(200):
+        worker_a.set('NOISE', 'noise.example', port)
+    compacting = Phonebook(path)
+    assert len(compacting) == 2
+    with open(path) as journal:
+        assert len(journal.readlines()) == 3
+    worker_b.delete('NOISE')
+    assert worker_a.get('NOISE') is None
+    assert compacting.get('NOISE') is None
+
+
+def test_benchmark_compare_flags_regressions() -> None:
+    """ Test that benchmark comparison flags metrics that got worse beyond the tolerance in either direction. :return: None """
+    from .meowdem_bench import compare_results, result
+    baseline = {
+        'throughput': result(100.0, 'MB/s'),
+        'latency': result(100.0, 'us', higher_is_better=False),
+        'steady': result(100.0, 'MB/s'),
+    }
+    current = {
+        'throughput': result(80.0, 'MB/s'),
+        'latency': result(120.0, 'us', higher_is_better=False),
+        'steady': result(95.0, 'MB/s'),
+        'new_metric': result(1.0, 'MB/s'),
+    }
+    assert compare_results(current, baseline, tolerance=0.1) == ['latency', 'throughput']
+
+
+@pytest.mark.asyncio
+async def test_ATI1_shows_session_statistics(parser: tuple[HayesATParser, OutputCollector]) -> None:
+    """ Test that ATI1 reports the bytes forwarded in DATA mode and ATI still shows the modem info. :param parser: tuple[HayesATParser, OutputCollector] :return: None """
+    from .meowdem import ParserMode
+    p, collector = parser
+    p.writer = RecordingStreamWriter()  # type: ignore
+    p.mode = ParserMode.DATA
+    p.receive(b'x' * 100)
+    p.mode = ParserMode.COMMAND
+    p.receive(b'ATI1\r')
+    assert 'Bytes to remote: 100\r\n' in collector.value
+    assert 'Bytes from client: 105\r\n' in collector.value
+    collector.value = ''
+    p.receive(b'ATI\r')
+    assert 'Modem Info' in collector.value
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint_serves_prometheus_text(parser: tuple[HayesATParser, OutputCollector]) -> None:
+    """ Test that the metrics endpoint includes the bytes of open sessions and rejects other paths. :param parser: tuple[HayesATParser, OutputCollector] :return: None """
+    from .meowdem import handle_metrics_request, process_metrics
+    p, collector = parser
+    before = process_metrics.totals().bytes_from_client
+    p.receive(b'AT\r')
+    server = await asyncio.start_server(handle_metrics_request, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+
+    async def fetch(path: str) -> bytes:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(f'GET {path} HTTP/1.0\r\n\r\n'.encode('ascii'))
+        response = await reader.read()
+        writer.close()
+        return response
+
+    response = await fetch('/metrics')
+    assert response.startswith(b'HTTP/1.0 200 OK\r\n')
+    assert f'meowdem_bytes_from_client_total {before + 3}\n'.encode('ascii') in response
+    assert b'meowdem_dial_latency_seconds_bucket{le="+Inf"}' in response
+    assert (await fetch('/other')).startswith(b'HTTP/1.0 404')
+    server.close()
+    await server.wait_closed()
+
+
+def test_rate_limit_filter_drops_and_reports_repeated_messages() -> None:
+    """ Test that a call site is limited per window and the next record reports how many were dropped. :return: None """
+    import logging
+    from .meowdem import RateLimitFilter
+    rate_limit = RateLimitFilter(limit=2, window=10.0)
+
+    def record(created: float, lineno: int = 1) -> logging.LogRecord:
+        log_record = logging.LogRecord('meowdem', logging.INFO, 'meowdem.py', lineno, 'event', None, None)
+        log_record.created = created
+        return log_record
+
+    assert [rate_limit.filter(record(t)) for t in (0.0, 1.0, 2.0, 3.0)] == [True, True, False, False]
+    assert rate_limit.filter(record(4.0, lineno=2))
+    late = record(11.0)
+    assert rate_limit.filter(late)
+    assert late.getMessage() == 'event (2 similar messages suppressed)'
+
+
+def test_session_log_adapter_adds_context(parser: tuple[HayesATParser, OutputCollector], caplog) -> None:
+    """ Test that session log records carry the session context as attributes and message prefix. :param parser: tuple[HayesATParser, OutputCollector] :param caplog: LogCaptureFixture :return: None """
+    p, collector = parser
+    p.log.extra['remote'] = 'bbs.example:23'
+    with caplog.at_level('INFO', logger='meowdem'):
+        p.log.info('Connected')
+    record = caplog.records[-1]
+    assert record.remote == 'bbs.example:23'
+    assert record.getMessage() == f"[session={record.session} remote=bbs.example:23] Connected"
+
+
+def test_idle_session_memory_within_budget() -> None:
+    """ Test that an idle parser stays within SESSION_MEMORY_BUDGET and shares the power-on S-registers. :return: None """
+    import gc
+    import tracemalloc
+    from .meowdem import SESSION_MEMORY_BUDGET, S_REGISTER_POWER_ON
+    phonebook = Phonebook()
+    collector = OutputCollector()
+    HayesATParser(collector, phonebook=phonebook).close()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        parsers = [HayesATParser(collector, phonebook=phonebook) for _ in range(200)]
+        per_session = (tracemalloc.get_traced_memory()[0] - before) / len(parsers)
+    finally:
+        tracemalloc.stop()
+    assert per_session <= SESSION_MEMORY_BUDGET
+    assert all(p.s_registers is S_REGISTER_POWER_ON for p in parsers)
+    for p in parsers:
+        p.close()
+
+
+@pytest.mark.asyncio
+async def test_ats_copies_registers_on_write_and_checks_range(parser: tuple[HayesATParser, OutputCollector]) -> None:
+    """ Test that setting an S-register leaves the shared power-on values alone and out-of-range values are rejected. :param parser: tuple[HayesATParser, OutputCollector] :return: None """
+    from .meowdem import S_REGISTER_POWER_ON
+    p, collector = parser
+    p.echo_enabled = False
+    p.receive(b'ATS7=5S7?\r')
+    assert collector.value == '5\r\nOK\r\n'
+    assert S_REGISTER_POWER_ON[7] == 30
+    collector.value = ''
+    p.receive(b'ATS7=256S7?\r')
+    assert collector.value.startswith('ERROR')
+    assert 'OK' not in collector.value
+    collector.value = ''
+    p.receive(b'ATZS7?\r')
+    assert collector.value == '30\r\nOK\r\n'
+
+
+@pytest.mark.asyncio
+async def test_remote_close_reports_no_carrier(parser: tuple[HayesATParser, OutputCollector]) -> None:
+    """ Test that a connection closed by the remote host returns to COMMAND mode with NO CARRIER. :param parser: tuple[HayesATParser, OutputCollector] :return: None """
+    from .meowdem import ParserMode
+    p, collector = parser
+    reader = asyncio.StreamReader()
+    p.mode = ParserMode.DATA
+    connection = asyncio.ensure_future(p._handle_socket_connection(reader, MockStreamWriter()))  # type: ignore
+    reader.feed_data(b'bye')
+    reader.feed_eof()
+    await asyncio.wait_for(connection, timeout=1)
+    assert collector.value == 'byeNO CARRIER\r\n'
+    assert p.mode == ParserMode.COMMAND
+    assert p.writer is None
+
+
+@pytest.mark.asyncio
+async def test_s30_hangs_up_inactive_connection(parser: tuple[HayesATParser, OutputCollector], monkeypatch: pytest.MonkeyPatch) -> None:
+    """ Test that S30 hangs up a connection only once no data flowed for its timeout. :param parser: tuple[HayesATParser, OutputCollector] :param monkeypatch: pytest.MonkeyPatch :return: None """
+    from . import meowdem
+    monkeypatch.setattr(meowdem, 'INACTIVITY_UNIT', 0.05)
+    p, collector = parser
+    p.receive(b'ATS30=2\r')
+    reader = asyncio.StreamReader()
+    p.mode = meowdem.ParserMode.DATA
+    connection = asyncio.ensure_future(p._handle_socket_connection(reader, MockStreamWriter()))  # type: ignore
+    for _ in range(3):
+        await asyncio.sleep(0.06)
+        p.receive(b'x')
+    assert p.mode == meowdem.ParserMode.DATA
+    await asyncio.sleep(0.15)
+    assert p.mode == meowdem.ParserMode.COMMAND
+    assert collector.value.endswith('NO CARRIER\r\n')
+    assert p.inactivity_timer is None
+    reader.feed_eof()
+    await asyncio.wait_for(connection, timeout=1)
+
+
+@pytest.mark.asyncio
+async def test_tcp_session_limit_and_idle_disconnect(monkeypatch: pytest.MonkeyPatch) -> None:
+    """ Test that clients over --max-sessions get BUSY and idle clients at the prompt are disconnected. :param monkeypatch: pytest.MonkeyPatch :return: None """
+    from . import meowdem
+    monkeypatch.setattr(meowdem, 'max_tcp_sessions', 1)
+    monkeypatch.setattr(meowdem, 'tcp_idle_timeout', 0.2)
+    server = await asyncio.start_server(meowdem.handle_tcp_client, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    first_reader, first_writer = await asyncio.open_connection('127.0.0.1', port)
+    await asyncio.sleep(0.05)
+    second_reader, second_writer = await asyncio.open_connection('127.0.0.1', port)
+    assert await asyncio.wait_for(second_reader.read(), timeout=1) == b'BUSY\r\n'
+
+    first_writer.write(b'AT\r')
+    assert await asyncio.wait_for(first_reader.read(), timeout=1) == b'AT\r\nOK\r\nNO CARRIER\r\n'
+    for writer in (first_writer, second_writer):
+        writer.close()
+    server.close()
+    await server.wait_closed()
+
+
+def test_workers_require_a_shared_phonebook(monkeypatch: pytest.MonkeyPatch, tmp_path) -> None:
+    """ Test that more than one worker is refused without a phonebook file the workers can share. :param monkeypatch: pytest.MonkeyPatch :param tmp_path: Path :return: None """
+    from .meowdem import parse_args
+    monkeypatch.setattr('sys.argv', ['meowdem', '-c', '2323', '--workers', '2'])
+    with pytest.raises(SystemExit):
+        parse_args()
+    path = str(tmp_path / 'phonebook.txt')
+    monkeypatch.setattr('sys.argv', ['meowdem', '-c', '2323', '--workers', '2', '--phonebook', path])
+    assert parse_args().phonebook == path
+
+
+@pytest.mark.asyncio
+async def test_capture_replays_with_identical_output(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """ Test that a captured telnet session replays through the parser with the same client output. :param tmp_path: Path :param monkeypatch: pytest.MonkeyPatch :return: None """
+    import os
+    from . import meowdem
+
+    async def bbs(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        writer.write(b'\xff\xfb\x01Welcome\r\n\xff\xff')
+        data = await reader.read(100)
+        while b'hi' not in data:
+            data += await reader.read(100)
+        writer.write(b'you said hi')
+        await writer.drain()
+
+    server = await asyncio.start_server(bbs, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    monkeypatch.setattr(meowdem, 'capture_dir', str(tmp_path))
+    collector = OutputCollector()
+    p = HayesATParser(collector, phonebook=Phonebook())
+    p.receive(f'AT*T1\rATD127.0.0.1:{port}\r'.encode('ascii'))
+    for _ in range(100):
+        if 'Welcome' in collector.value:
+            break
+        await asyncio.sleep(0.01)
+    p.receive(b'hi')
+    for _ in range(100):
+        if 'you said hi' in collector.value:
+            break
+        await asyncio.sleep(0.01)
+    p.close()
+    meowdem.finish_captures()
+    server.close()
+    await server.wait_closed()
+
+    [capture] = os.listdir(tmp_path)
+    stats = await meowdem.replay_capture(str(tmp_path / capture))
+    assert stats['output_matches']
+    assert stats['client_bytes'] == len(f'AT*T1\rATD127.0.0.1:{port}\r') + 2
+
+
+@pytest.mark.asyncio
+async def test_capture_replays_phonebook_dial_without_link_hello_wait(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """ Test that a capture dialing a phonebook key with AT*Z1 replays identically and without waiting for a link answer. :param tmp_path: Path :param monkeypatch: pytest.MonkeyPatch :return: None """
+    import os
+    from . import meowdem
+
+    async def bbs(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        data = b''
+        while b'hi' not in data:
+            data += await reader.read(100)
+        writer.write(b'you said hi')
+        await writer.drain()
+
+    server = await asyncio.start_server(bbs, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    phonebook = Phonebook(str(tmp_path / 'phonebook.txt'))
+    phonebook.set('BBS', '127.0.0.1', port)
+    capture_path = tmp_path / 'captures'
+    capture_path.mkdir()
+    monkeypatch.setattr(meowdem, 'LINK_HELLO_TIMEOUT', 0.3)
+    monkeypatch.setattr(meowdem, 'capture_dir', str(capture_path))
+    collector = OutputCollector()
+    p = HayesATParser(collector, phonebook=phonebook)
+    p.receive(b'AT*Z1\rATDBBS\r')
+    await wait_for_output(collector, 'CONNECTED')
+    await asyncio.sleep(0.4)  # Past the link hello timeout
+    p.receive(b'hi')
+    await wait_for_output(collector, 'you said hi')
+    p.close()
+    meowdem.finish_captures()
+    server.close()
+    await server.wait_closed()
+
+    [capture] = os.listdir(capture_path)
+    stats = await meowdem.replay_capture(str(capture_path / capture), phonebook=Phonebook(str(tmp_path / 'phonebook.txt')))
+    assert stats['output_matches']
+    assert stats['seconds'] < 0.2
+
+
+async def wait_for_output(collector: OutputCollector, text: str) -> None:
+    for _ in range(200):
+        if text in collector.value:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"{text!r} not in {collector.value!r}")
+
+
+@pytest.mark.asyncio
+async def test_link_compression_between_meowdems() -> None:
+    """ Test that AT*Z1 compresses the link to a meowdem TCP server and the far side decompresses it. :return: None """
+    from . import meowdem
+    server = await asyncio.start_server(meowdem.handle_tcp_client, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    collector = OutputCollector()
+    p = HayesATParser(collector, phonebook=Phonebook())
+    p.receive(f'AT*Z1\rATD127.0.0.1:{port}\r'.encode('ascii'))
+    await wait_for_output(collector, 'CONNECTED')
+    assert p.link_codec is not None
+    # The far meowdem runs the commands and echoes them through the compressed link
+    p.receive(b'ATE1\r')
+    await wait_for_output(collector, 'ATE1\r\nOK\r\n')
+    p.close()
+    server.close()
+    await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_idle_disconnect_over_compressed_link(monkeypatch: pytest.MonkeyPatch, caplog) -> None:
+    """ Test that an idle disconnect on an AT*Z1 link reaches the dialing meowdem as a clean NO CARRIER. :param monkeypatch: pytest.MonkeyPatch :param caplog: LogCaptureFixture :return: None """
+    import logging
+    from . import meowdem
+    from .meowdem import ParserMode
+    monkeypatch.setattr(meowdem, 'tcp_idle_timeout', 0.3)
+    server = await asyncio.start_server(meowdem.handle_tcp_client, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    collector = OutputCollector()
+    p = HayesATParser(collector, phonebook=Phonebook())
+    p.receive(f'AT*Z1\rATD127.0.0.1:{port}\r'.encode('ascii'))
+    await wait_for_output(collector, 'CONNECTED')
+    assert p.link_codec is not None
+    collector.value = ''
+    await wait_for_output(collector, 'NO CARRIER\r\n')
+    for _ in range(100):
+        if p.mode == ParserMode.COMMAND:
+            break
+        await asyncio.sleep(0.01)
+    assert collector.value.startswith('NO CARRIER\r\n')
+    assert not [record for record in caplog.records if record.levelno >= logging.ERROR]
+    p.close()
+    server.close()
+    await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_link_compression_falls_back_for_other_servers() -> None:
+    """ Test that a server ignoring the compression offer gets an uncompressed link and its banner is kept. :return: None """
+    received = bytearray()
+
+    async def banner(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        writer.write(b'Welcome\r\n')
+        received.extend(await reader.read(100))
+        while b'hi' not in received:
+            received.extend(await reader.read(100))
+        writer.close()
+
+    server = await asyncio.start_server(banner, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    collector = OutputCollector()
+    p = HayesATParser(collector, phonebook=Phonebook())
+    p.receive(f'AT*Z1\rATD127.0.0.1:{port}\r'.encode('ascii'))
+    await wait_for_output(collector, 'Welcome\r\n')
+    assert p.link_codec is None
+    p.receive(b'hi')
+    await wait_for_output(collector, 'NO CARRIER')
+    assert bytes(received).endswith(b'hi')
+    p.close()
+    server.close()
+    await server.wait_closed()
+
+
+def test_link_codec_round_trip() -> None:
+    """ Test that every compressed chunk decompresses on its own, so keystrokes are not held back. :return: None """
+    from .meowdem import LinkCodec
+    sender, receiver = LinkCodec(), LinkCodec()
+    for chunk in (b'\x1b[1;33mHello\x1b[0m\r\n' * 20, b'x', b'\x1b[1;33mHello\x1b[0m\r\n'):
+        assert receiver.decompress(sender.compress(chunk)) == chunk
+
+
+@pytest.mark.asyncio
+async def test_charset_translation(parser: tuple[HayesATParser, OutputCollector]) -> None:
+    """ Test that AT*C1 takes PETSCII commands and answers in PETSCII with CR line ends. :param parser: tuple[HayesATParser, OutputCollector] :return: None """
+    p, collector = parser
+    p.receive(b'ATE0\r')
+    collector.value = ''
+    p.receive(b'AT*C1\r')
+    assert collector.value == '\xcf\xcb\r'  # OK
+    collector.value = ''
+    # Unshifted keys send 0x41-0x5A in lower/upper case mode, which are lowercase letters
+    p.receive(b'\x41\x54*\x43?\r')
+    assert collector.value == '\xd0\xc5\xd4\xd3\xc3\xc9\xc9\r\xcf\xcb\r'  # PETSCII, OK
+    collector.value = ''
+    p.receive(b'AT*C9\r')
+    assert collector.value.startswith('\xc5\xd2\xd2\xcf\xd2:')  # ERROR:
+
+
+def test_charset_output_joins_crlf_split_across_chunks() -> None:
+    """ Test that a CR LF split across chunks gives the client a single end of line. :return: None """
+    from .meowdem import CharsetTranslator, charsets
+    for number, expected in ((1, b'\xc1\r\xc2\r'), (2, b'A\x9bB\x9b'), (3, b'A\r\nB\r\n')):
+        translator = CharsetTranslator(charsets[number])
+        assert translator.output_translation(b'A\r') + translator.output_translation(b'\nB\n') == expected
+
+
+@pytest.mark.asyncio
+async def test_zmodem_download_passes_through_untouched(parser: tuple[HayesATParser, OutputCollector]) -> None:
+    """ Test that a ZMODEM transfer skips character set translation and escapes until both sides sent ZFIN. :param parser: tuple[HayesATParser, OutputCollector] :return: None """
+    from .meowdem import ParserMode
+    p, collector = parser
+    p.receive(b'AT*C3S12=1\r')
+    reader = asyncio.StreamReader()
+    writer = RecordingStreamWriter()
+    p.mode = ParserMode.DATA
+    connection = asyncio.ensure_future(p._handle_socket_connection(reader, writer))  # type: ignore
+    collector.value = ''
+    reader.feed_data(b'**\x18B00000000000000\r\x8a\x11data\nmore\n')
+    await asyncio.sleep(0.01)
+    assert collector.value == '**\x18B00000000000000\r\x8a\x11data\nmore\n'
+    assert p.transfer is not None and p.transfer.protocol == 'ZMODEM'
+    p.receive(b'+++')
+    await asyncio.sleep(0.05)
+    assert p.mode == ParserMode.DATA and p.escape_timer is None
+    reader.feed_data(b'**\x18B0800000000022d\r\x8a')
+    await asyncio.sleep(0.01)
+    p.receive(b'**\x18B0800000000022d\r\x8a')
+    assert p.transfer is None
+    assert writer.writes[-2:] == [b'+++', b'**\x18B0800000000022d\r\x8a']
+    # Back to normal processing once the transfer is over
+    collector.value = ''
+    reader.feed_data(b'menu\n')
+    await asyncio.sleep(0.01)
+    assert collector.value == 'menu\r\n'
+    assert p.metrics.transfers == 1
+    assert p.metrics.transfer_bytes == 2 * 20 + 31 + 3
+    reader.feed_eof()
+    await asyncio.wait_for(connection, timeout=1)
+
+
+def test_detect_transfer() -> None:
+    """ Test recognising the first blocks of X/YMODEM and ZMODEM transfers. :return: None """
+    from .meowdem import detect_transfer
+    assert detect_transfer(b'rz\r**\x18B00000000000000\r\x8a\x11') == 'ZMODEM'
+    assert detect_transfer(b'rz\r**\x18B00000000000000\r\x8a\x11', True) == 'ZMODEM'
+    assert detect_transfer(b'\x01\x01\xfe' + b'\x1a' * 128 + b'\x00') == 'XMODEM'
+    assert detect_transfer(b'\x02\x01\xfe' + b'\x1a' * 1024 + b'\x00\x00') == 'XMODEM'
+    assert detect_transfer(b'\x01\x00\xffREADME.TXT' + b'\x00' * 118 + b'\x12\x34') == 'YMODEM'
+    assert detect_transfer(b'\x01\x00\xff' + b'\x00' * 130) is None  # End of a YMODEM batch
+    # Two CRC blocks and the EOT in one chunk
+    blocks = b'\x01\x01\xfe' + b'\x01' * 128 + b'\x01\x02' + b'\x01\x02\xfd' + b'\x1a' * 128 + b'\x03\x04'
+    assert detect_transfer(blocks + b'\x04') == 'XMODEM'
+    # Only whole blocks from the remote host count
+    assert detect_transfer(b'\x01\x02\x03hello') is None
+    assert detect_transfer(b'\x01\x01\xfe' + b'\x1a' * 100) is None
+    assert detect_transfer(b'\x01\x01\xfe' + b'\x1a' * 128 + b'\x00', True) is None
+
+
+@pytest.mark.asyncio
+async def test_xmodem_transfer_follows_blocks_split_across_reads() -> None:
+    """ Test that EOT and cancels inside a block split over several reads do not end an XMODEM transfer. :return: None """
+    from .meowdem import FileTransfer
+    block = b'\x01\x05\xfa' + b'\x04' * 128 + b'\x04'
+    transfer = FileTransfer('XMODEM', lambda: None)
+    try:
+        assert not transfer.update(block, False)
+        assert not transfer.update(block[:2], False)
+        for piece in (block[2:50], b'\x04', b'\x18\x18', block[53:]):
+            assert not transfer.update(piece, False)
+        assert not transfer.update(b'\x06', True)  # ACK from the receiver
+        assert transfer.update(b'\x04', False)
+    finally:
+        transfer.idle_timer.cancel()
+    transfer = FileTransfer('XMODEM', lambda: None)
+    try:
+        assert transfer.update(block + block + b'\x04', False)
+    finally:
+        transfer.idle_timer.cancel()
+
+
+@pytest.mark.asyncio
+async def test_ymodem_transfer_lasts_until_empty_block_zero() -> None:
+    """ Test that a YMODEM batch ends only once the empty block 0 after the last file has arrived. :return: None """
+    from .meowdem import FileTransfer
+    header = b'\x01\x00\xffREADME.TXT' + b'\x00' * 118 + b'\x12\x34'
+    wrapped = b'\x02\x00\xff' + b'\x00' * 1024 + b'\x00\x00'  # Block number 256 of a large file
+    end_of_batch = b'\x01\x00\xff' + b'\x00' * 128 + b'\x00\x00'
+    transfer = FileTransfer('YMODEM', lambda: None)
+    try:
+        assert not transfer.update(header, False)
+        assert not transfer.update(wrapped, False)
+        assert not transfer.update(b'\x04', False)
+        assert not transfer.update(b'\x04', False)
+        assert not transfer.update(end_of_batch[:3], False)
+        assert not transfer.update(end_of_batch[3:100], False)
+        assert transfer.update(end_of_batch[100:], False)
+    finally:
+        transfer.idle_timer.cancel()
+
+
+
+def test_telnet_input_unescapes_binary_data_in_bulk() -> None:
+    """ Test that chunks holding only escaped IAC pairs decode like the state machine would. :return: None """
+    translator = TelnetTranslator()
+    assert translator.input_translation(b'\xff\xff\x00\xff\xff\xff\xff') == b'\xff\x00\xff\xff'
+    assert translator.input_translation(b'a\xff\xff\xff\xfb\x01b') == b'a\xffb'
+    assert translator.iac_count == 9
+
+
+async def read_until(fd: int, expected: bytes) -> bytes:
+    """ Read a non-blocking descriptor until expected arrived. :param fd: int :param expected: bytes :return: bytes """
+    import os
+    data = b''
+    for _ in range(200):
+        try:
+            data += os.read(fd, 1024)
+        except BlockingIOError:
+            pass
+        if expected in data:
+            return data
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"{expected!r} not in {data!r}")
+
+
+@pytest.mark.asyncio
+async def test_serial_ports_are_served_and_reopened_independently(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """ Test that several serial ports have their own sessions and an unplugged one is reopened without affecting the others. :param tmp_path: Path :param monkeypatch: pytest.MonkeyPatch :return: None """
+    import os
+    from . import meowdem
+    monkeypatch.setattr(meowdem, 'SERIAL_RECONNECT_DELAY', 0.05)
+    assert meowdem.parse_serial_port('/dev/ttyUSB0:19200', 9600) == ('/dev/ttyUSB0', 19200)
+    assert meowdem.parse_serial_port('/dev/ttyS1', 9600) == ('/dev/ttyS1', 9600)
+
+    def plug_in(link) -> int:
+        master, slave = os.openpty()
+        os.set_blocking(master, False)
+        if os.path.lexists(link):
+            os.unlink(link)
+        os.symlink(os.ttyname(slave), link)
+        os.close(slave)
+        return master
+
+    first_link, second_link = tmp_path / 'first', tmp_path / 'second'
+    first, second = plug_in(first_link), plug_in(second_link)
+    tasks = [asyncio.ensure_future(meowdem.serve_serial_port(str(link), 9600)) for link in (first_link, second_link)]
+    await asyncio.sleep(0.05)
+    os.write(first, b'ATE0\r')
+    os.write(second, b'AT\r')
+    assert (await read_until(first, b'OK\r\n')).startswith(b'ATE0')
+    await read_until(second, b'AT\r\nOK\r\n')
+
+    os.close(first)  # Unplug the first port
+    await asyncio.sleep(0.1)
+    os.write(second, b'AT\r')
+    await read_until(second, b'AT\r\nOK\r\n')
+    first = plug_in(first_link)
+    await asyncio.sleep(0.2)
+    os.write(first, b'AT\r')
+    await read_until(first, b'AT\r\nOK\r\n')  # A new session, with echo on again
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    os.close(first)
+    os.close(second)
+
+
+def test_command_table_compiles_patterns_on_first_use() -> None:
+    """ Test that a command table compiles a leading character's patterns only once it is looked up. :return: None """
+    from .meowdem import build_command_table
+    table = build_command_table(((r'S(\d+)=(\d+)', 'handle_ats_set'), (r'S(\d+)\?', 'handle_ats_query'), (r'Z', 'handle_ATZ')))
+    assert not table and set(table.pending) == {'S', 'Z'}
+    assert [handler for _, handler in table['S']] == ['handle_ats_set', 'handle_ats_query']
+    assert table['S'][0][0].match('S7=5') and set(table.pending) == {'Z'}
+    table.add(r'S(\d+)!', 'handle_custom', first=True)
+    copy = table.copy()
+    copy.add(r'Z(\d)', 'handle_custom', first=True)
+    assert [handler for _, handler in copy['Z']] == ['handle_custom', 'handle_ATZ']
+    assert table['S'][0][1] == 'handle_custom' and len(table['Z']) == 1
+    assert table['Q'] == [] and 'Q' not in table
+
+
+@pytest.mark.asyncio
+async def test_startup_profile_reports_first_response(monkeypatch: pytest.MonkeyPatch, capsys) -> None:
+    """ Test that --startup-profile reports once, when a session first responds. :param monkeypatch: pytest.MonkeyPatch :param capsys: CaptureFixture :return: None """
+    from . import meowdem
+    monkeypatch.setattr(meowdem, 'startup_profile', meowdem.StartupProfile())
+    collector = OutputCollector()
+    p = HayesATParser(collector, phonebook=Phonebook())
+    p.receive(b'AT\r')
+    p.receive(b'AT\r')
+    p.close()
+    assert collector.value == 'AT\r\nOK\r\n' * 2
+    assert capsys.readouterr().err.count('Startup profile: import ') == 1
+
+
+@pytest.mark.asyncio
+async def test_shutdown_hangs_up_idle_sessions_after_drain_timeout(monkeypatch: pytest.MonkeyPatch) -> None:
+    """ Test that SIGTERM stops the TCP server within the drain timeout even with an idle client connected. :param monkeypatch: pytest.MonkeyPatch :return: None """
+    import os
+    import signal
+    import socket
+    from . import meowdem
+    monkeypatch.setattr(meowdem, 'SESSION_DRAIN_TIMEOUT', 0.3)
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    serving = asyncio.ensure_future(meowdem.serve_tcp_clients(port))
+    for _ in range(100):
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            break
+        except ConnectionError:
+            await asyncio.sleep(0.01)
+    while not meowdem.tcp_sessions:
+        await asyncio.sleep(0.01)
+
+    started = asyncio.get_running_loop().time()
+    os.kill(os.getpid(), signal.SIGTERM)
+    await asyncio.wait_for(serving, timeout=2)
+    assert asyncio.get_running_loop().time() - started < 1
+    assert await asyncio.wait_for(reader.read(), timeout=1) == b'NO CARRIER\r\n'
+    assert not meowdem.tcp_sessions
+    writer.close()
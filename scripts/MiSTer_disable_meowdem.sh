@@ -15,6 +15,7 @@ fi
 if [ -f "$MEOWDEM_FIRMWARE_DEST" ]; then
     echo "Removing Meowdem firmware from ${MEOWDEM_FIRMWARE_DEST}..."
     rm -f "$MEOWDEM_FIRMWARE_DEST"
+    rm -f "$(dirname "$MEOWDEM_FIRMWARE_DEST")"/__pycache__/meowdem.*.pyc
 else
     echo "No Meowdem firmware found at ${MEOWDEM_FIRMWARE_DEST}."
 fi
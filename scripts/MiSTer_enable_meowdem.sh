@@ -17,6 +17,11 @@ MEOWDEM_FIRMWARE_DEST="${MEOWDEM_FIRMWARE_DEST:-/media/fat/linux/meowdem.py}"
 echo "Downloading Meowdem firmware to ${MEOWDEM_FIRMWARE_DEST}..."
 curl -fsSkL "$MEOWDEM_FIRMWARE_SOURCE" -o "$MEOWDEM_FIRMWARE_DEST"
 
+# Compile the bytecode now; started with "python -m meowdem" it is loaded from the cache instead of
+# compiling the source every time the modem is toggled on
+echo "Precompiling Meowdem..."
+python -m py_compile "$MEOWDEM_FIRMWARE_DEST" || echo "Warning: precompiling failed, Meowdem will start more slowly."
+
 
 UARTMODE="${UARTMODE:-/usr/sbin/uartmode}"
 if [ ! -f "$UARTMODE" ]; then
@@ -24,6 +29,9 @@ if [ ! -f "$UARTMODE" ]; then
     exit 1
 fi
 
-sed -i "/killall mpg123/a\	ps aux | grep '[m]eowdem.py' | awk '{print \$1}' | xargs -r kill" "$UARTMODE"
+# The edits below replace what an earlier run added, so enabling again upgrades the uartmode script in place
+sed -i "/grep '\[m\]eowdem/d" "$UARTMODE"
+sed -i "/killall mpg123/a\	ps aux | grep '[m]eowdem' | awk '{print \$1}' | xargs -r kill" "$UARTMODE"
 
-sed -i '/echo "1" >\/tmp\/uartmode4/,/wait \$!/s/midilink MENU QUIET/python \/media\/fat\/linux\/meowdem.py -s \/dev\/ttyS1 -b \$conn_speed/' "$UARTMODE"
+MEOWDEM_COMMAND='PYTHONPATH=/media/fat/linux python -m meowdem -s /dev/ttyS1 -b $conn_speed --phonebook /media/fat/linux/meowdem_phonebook.txt'
+sed -i -E '/echo "1" >\/tmp\/uartmode4/,/wait \$!/s#midilink MENU QUIET|(PYTHONPATH=[^ ]+ )?python [^&]*meowdem[^&]*[^ &]#'"$MEOWDEM_COMMAND"'#' "$UARTMODE"